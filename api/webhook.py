@@ -1,3 +1,6 @@
+from contextlib import asynccontextmanager
+from typing import Optional
+
 from fastapi import FastAPI, Request, HTTPException, Response
 from fastapi.responses import JSONResponse
 from telegram import Update
@@ -6,11 +9,139 @@ import json
 import hmac
 import hashlib
 import asyncio
+import logging
+import time
+import uuid
 
 from config import Config
 from bot import SynaplinkBot
+from broadcaster import Broadcaster, BroadcastStats
+from update_dedup import UpdateDeduplicator
+from update_queue import UpdateWorkerPool
+from redis_pool import forget_redis
+import metrics
+from logging_setup import logging_configured, setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Один «тёплый» экземпляр бота на процесс: Application, OpenAI-клиент и Redis
+# создаются один раз и переиспользуют пулы соединений между апдейтами.
+_bot: Optional[SynaplinkBot] = None
+# Бот, его пулы соединений и lock привязаны к event loop, в котором созданы
+_bot_loop: Optional[asyncio.AbstractEventLoop] = None
+_bot_lock: Optional[asyncio.Lock] = None
+# Пул воркеров для обработки апдейтов после быстрого ответа Telegram (WEBHOOK_WORKERS > 0)
+_workers: Optional[UpdateWorkerPool] = None
+# Повторные доставки одного update_id отбрасываются до обработки
+_dedup: Optional[UpdateDeduplicator] = None
+
+# Рассылки, запущенные через /api/broadcast: job_id -> прогресс.
+# Завершённые хранятся BROADCAST_JOB_TTL секунд и не больше BROADCAST_JOBS_MAX штук
+_broadcast_jobs: dict = {}
+_broadcast_tasks: set = set()
+BROADCAST_JOB_TTL = 3600.0
+BROADCAST_JOBS_MAX = 100
+
+
+async def _get_bot() -> SynaplinkBot:
+    """Возвращает инициализированный экземпляр бота, создавая его при первом обращении.
+
+    Обычно бот создаётся в lifespan; ленивое создание нужно для окружений,
+    где lifespan-события не доставляются (часть serverless-рантаймов). Такие
+    рантаймы могут запускать каждый вызов в новом event loop: тогда бот и пул
+    Redis, созданные в прежнем loop, непригодны и собираются заново.
+    """
+    global _bot, _bot_loop, _bot_lock, _workers, _dedup
+    loop = asyncio.get_running_loop()
+    if _bot is not None and _bot_loop is loop:
+        return _bot
+    if _bot_loop is not loop:
+        if _bot is not None:
+            # Закрыть старого бота нельзя: его loop уже не работает
+            logger.warning("Webhook: event loop сменился, экземпляр бота создаётся заново")
+            _bot = None
+            _workers = None
+            _dedup = None
+            forget_redis()
+        _bot_loop = loop
+        _bot_lock = asyncio.Lock()
+    async with _bot_lock:
+        if _bot is None:
+            _setup_logging()
+            bot_instance = SynaplinkBot()
+            await bot_instance.startup()
+            _start_workers(bot_instance)
+            _start_dedup()
+            _bot = bot_instance
+            logger.info("Webhook: экземпляр бота создан и инициализирован")
+    return _bot
+
+
+def _setup_logging() -> None:
+    """Настраивает логирование при старте приложения, а не при импорте модуля."""
+    if not logging_configured():
+        # Вебхук пишет логи только в консоль: на serverless файловая система недоступна для записи
+        setup_logging(log_file='')
+
+
+def _start_workers(bot_instance: SynaplinkBot) -> None:
+    """Запускает пул воркеров апдейтов, если задан WEBHOOK_WORKERS."""
+    global _workers
+    if Config.WEBHOOK_WORKERS <= 0:
+        return
+    _workers = UpdateWorkerPool(
+        bot_instance.application.process_update,
+        workers=Config.WEBHOOK_WORKERS,
+        queue_size=Config.WEBHOOK_QUEUE_SIZE,
+    )
+    _workers.start()
+    metrics.register_stats('update_queue', _workers.stats)
+
+
+def _start_dedup() -> None:
+    global _dedup
+    _dedup = UpdateDeduplicator()
+    metrics.register_stats('update_dedup', _dedup.stats)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    _setup_logging()
+    # Создаём бота внутри lifespan, чтобы он был привязан к event loop сервера
+    try:
+        await _get_bot()
+    except Exception as e:
+        logger.error(f"Webhook: не удалось инициализировать бота при старте: {e}")
+    try:
+        yield
+    finally:
+        global _bot, _workers
+        if _workers is not None:
+            # Сначала дорабатываем принятые апдейты, потом останавливаем бота
+            await _workers.stop()
+            _workers = None
+        if _bot is not None:
+            try:
+                await _bot.shutdown()
+            except Exception as e:
+                logger.warning(f"Webhook: ошибка при остановке бота: {e}")
+            _bot = None
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
+
+
+def _evict_broadcast_jobs() -> None:
+    """Забывает завершённые рассылки старше BROADCAST_JOB_TTL и самые старые сверх BROADCAST_JOBS_MAX."""
+    now = time.monotonic()
+    finished = [job_id for job_id, stats in _broadcast_jobs.items() if stats.finished_at is not None]
+    expired = {job_id for job_id in finished if now - _broadcast_jobs[job_id].finished_at > BROADCAST_JOB_TTL}
+    # dict хранит порядок запуска: лишние завершённые удаляются начиная с самых старых
+    excess = len(_broadcast_jobs) - len(expired) - BROADCAST_JOBS_MAX
+    if excess > 0:
+        expired.update([job_id for job_id in finished if job_id not in expired][:excess])
+    for job_id in expired:
+        del _broadcast_jobs[job_id]
 
 
 def _verify_secret(request: Request) -> None:
@@ -29,32 +160,54 @@ async def telegram_webhook(request: Request):
         data = await request.json()
     except Exception:
         body = await request.body()
-        data = json.loads(body.decode('utf-8'))
+        try:
+            data = json.loads(body.decode('utf-8'))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON")
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail="Update must be a JSON object")
 
-    # Создаём приложение на каждый запрос, чтобы оно было привязано к актуальному event loop
-    bot_instance = SynaplinkBot()
+    bot_instance = await _get_bot()
     telegram_app: Application = bot_instance.application
 
-    update = Update.de_json(data, telegram_app.bot)
+    if _dedup is not None and await _dedup.seen(data.get('update_id')):
+        return JSONResponse({"ok": True, "duplicate": True})
+
     try:
-        await telegram_app.initialize()
+        update = Update.de_json(data, telegram_app.bot)
+        # Быстрый ответ: апдейт обработает воркер. Если пул выключен или очередь
+        # переполнена, обрабатываем апдейт внутри запроса
+        if _workers is not None and _workers.submit(update):
+            return JSONResponse({"ok": True, "queued": True})
         await telegram_app.process_update(update)
         return JSONResponse({"ok": True})
     except Exception as e:
-        import logging, traceback
-        logging.getLogger(__name__).error(f"process_update error: {e}\n{traceback.format_exc()}")
+        import traceback
+        metrics.ERRORS.labels('webhook').inc()
+        logger.error(f"process_update error: {e}\n{traceback.format_exc()}")
         return JSONResponse({"ok": False, "error": str(e)}, status_code=200)
-    finally:
-        try:
-            await telegram_app.shutdown()
-        except Exception:
-            pass
 
 
 @app.get("/")
 async def health():
     return {"status": "ok"}
 
+
+@app.get("/api/outbox")
+async def outbox_stats():
+    """Глубина outbox лидов и возраст самой старой незаписанной заявки."""
+    bot_instance = await _get_bot()
+    if not bot_instance.lead_outbox:
+        return {"ok": False, "error": "outbox disabled"}
+    return {"ok": True, **await bot_instance.lead_outbox.stats()}
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Метрики процесса в формате Prometheus."""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE_LATEST)
+
+
 @app.get("/favicon.ico")
 async def favicon_ico():
     # Возвращаем 204 No Content, чтобы браузер не считал это ошибкой
@@ -78,40 +231,34 @@ async def broadcast(request: Request):
     if not text:
         raise HTTPException(status_code=400, detail="Text is required")
 
-    # Создаём приложение на этот запрос
-    bot_instance = SynaplinkBot()
+    bot_instance = await _get_bot()
     telegram_app: Application = bot_instance.application
 
-    # Получаем список подписчиков
-    subs = bot_instance.openai_client.get_all_subscribers()
-    sent = 0
-    failed = 0
-    try:
-        await telegram_app.initialize()
-        for chat_id in subs:
-            try:
-                await telegram_app.bot.send_message(chat_id=int(chat_id), text=text)
-                sent += 1
-            except Exception as e:
-                # Если Telegram просит подождать (429), пробуем один раз с паузой
-                retry_after = getattr(e, 'retry_after', None)
-                if isinstance(retry_after, (int, float)) and retry_after > 0:
-                    await asyncio.sleep(float(retry_after) + 0.5)
-                    try:
-                        await telegram_app.bot.send_message(chat_id=int(chat_id), text=text)
-                        sent += 1
-                        continue
-                    except Exception:
-                        failed += 1
-                else:
-                    failed += 1
-            # Плавная задержка между отправками, чтобы не упереться в лимиты
-            await asyncio.sleep(0.06)
-        return {"ok": True, "sent": sent, "failed": failed}
-    finally:
-        try:
-            await telegram_app.shutdown()
-        except Exception:
-            pass
+    # Подписчики читаются страницами SSCAN параллельно с отправкой
+    openai_client = bot_instance.openai_client
+    stats = BroadcastStats(total=await openai_client.count_subscribers())
+    job_id = uuid.uuid4().hex[:12]
+    _evict_broadcast_jobs()
+    _broadcast_jobs[job_id] = stats
+    broadcaster = Broadcaster(telegram_app.bot, prune=openai_client.prune_subscribers)
+    task = asyncio.create_task(broadcaster.run(openai_client.aiter_subscribers(), text, stats=stats))
+    # Держим ссылку на задачу, чтобы её не собрал GC до завершения
+    _broadcast_tasks.add(task)
+    task.add_done_callback(_broadcast_tasks.discard)
+
+    # По умолчанию отвечаем сразу: большая рассылка дольше таймаута HTTP-запроса.
+    # Прогресс доступен по GET /api/broadcast/{job_id}; {"wait": true} — дождаться конца.
+    if payload.get("wait"):
+        await task
+    return {"ok": True, "job_id": job_id, **stats.as_dict()}
 
 
+@app.get("/api/broadcast/{job_id}")
+async def broadcast_status(job_id: str, request: Request):
+    secret = request.headers.get("X-Broadcast-Secret")
+    if not getattr(Config, 'BROADCAST_SECRET', None) or secret != Config.BROADCAST_SECRET:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    stats = _broadcast_jobs.get(job_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Unknown broadcast job")
+    return {"ok": True, "job_id": job_id, **stats.as_dict()}
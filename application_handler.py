@@ -5,24 +5,118 @@
 
 import re
 import logging
-from typing import Dict, Optional, Tuple
+from dataclasses import dataclass, field, fields
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
 
 logger = logging.getLogger(__name__)
 
+LEAD_HEADER = '[Заявка в рабочий чат]'
+
+# Подпись поля в блоке заявки -> атрибут Lead
+_LEAD_LABELS = {
+    'имя': 'name',
+    'телефон': 'phone',
+    'телеграм': 'telegram',
+    'telegram': 'telegram',
+    'email': 'email',
+    'e-mail': 'email',
+    'запрос': 'request',
+}
+
+# Все поля заявки извлекаются одной регуляркой за один проход после заголовка.
+# Вокруг подписи допускается Markdown (**Имя:**), чтобы разбирать и сырой ответ.
+_LEAD_FIELD_RE = re.compile(
+    r"^[ \t>*_-]*(?P<label>Имя|Телефон|Телеграм|Telegram|E-?mail|Запрос)[*_]*[ \t]*:[*_]*[ \t]*(?P<value>[^\n]*)",
+    re.MULTILINE | re.IGNORECASE,
+)
+
+# Значения-заглушки, которыми ассистент помечает незаполненное необязательное поле
+# (Email). В обязательных полях заглушка остаётся как есть: «Телеграм: -» у клиента
+# только с телефоном — нормальная заявка
+_EMPTY_VALUES = {'-', '—', '–', 'нет', 'не указано'}
+
+
+@dataclass
+class Lead:
+    """Заявка из финального блока ответа ассистента"""
+
+    name: str = ''
+    phone: str = ''
+    telegram: str = ''
+    email: str = ''
+    request: str = ''
+
+    # Подписи полей, найденные в блоке: полнота заявки определяется по ним
+    labels: Set[str] = field(default_factory=set, repr=False, compare=False)
+
+    # Поля, без подписи которых заявка не отправляется в рабочий чат
+    REQUIRED = ('name', 'phone', 'telegram', 'request')
+
+    @property
+    def missing(self) -> List[str]:
+        return [name for name in self.REQUIRED if name not in self.labels]
+
+    @property
+    def is_complete(self) -> bool:
+        return not self.missing
+
+    def as_dict(self) -> Dict[str, str]:
+        return {f.name: getattr(self, f.name) for f in fields(self) if f.name != 'labels'}
+
+    def sheet_row(self) -> List[str]:
+        """Строка для Google Sheets (порядок колонок: Имя, Телефон, Телеграм, Запрос)"""
+        return [self.name, self.phone, self.telegram, self.request]
+
+
+def parse_lead(text: str) -> Optional[Lead]:
+    """
+    Находит блок [Заявка в рабочий чат] и извлекает его поля за один проход
+
+    Поля до заголовка не учитываются; при повторе поля берётся первое значение.
+
+    Args:
+        text: Ответ ассистента
+
+    Returns:
+        Lead или None, если заголовка заявки нет
+    """
+    start = text.find(LEAD_HEADER) if text else -1
+    if start == -1:
+        return None
+    lead = Lead()
+    for match in _LEAD_FIELD_RE.finditer(text, start + len(LEAD_HEADER)):
+        name = _LEAD_LABELS[match.group('label').lower()]
+        if name in lead.labels:
+            continue
+        lead.labels.add(name)
+        value = match.group('value').strip().strip('*_').strip()
+        if name not in Lead.REQUIRED and value.lower() in _EMPTY_VALUES:
+            value = ''
+        setattr(lead, name, value)
+    return lead
+
+
+def format_lead_for_working_chat(lead: Lead, user_id: int) -> str:
+    """Сообщение о заявке для рабочего чата"""
+    return (
+        f"🚨 НОВАЯ ЗАЯВКА ОТ ПОЛЬЗОВАТЕЛЯ {user_id}\n\n"
+        f"📋 {LEAD_HEADER}\n\n"
+        f"👤 Имя: {lead.name or 'Не указано'}\n"
+        f"📱 Телефон: {lead.phone or 'Не указано'}\n"
+        f"✈️ Телеграм: {lead.telegram or 'Не указано'}\n"
+        f"📧 Email: {lead.email or 'Не указано'}\n"
+        f"💬 Запрос: {lead.request or 'Не указано'}\n\n"
+        f"🆔 ID пользователя: {user_id}\n"
+        f"⏰ Время: {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}"
+    )
+
+
 class ApplicationHandler:
     """Класс для обработки заявок от пользователей"""
     
     def __init__(self):
         """Инициализация обработчика заявок"""
-        # Паттерны для определения заявок
-        self.application_patterns = {
-            'header': r'\[Заявка в рабочий чат\]',
-            'name': r'Имя:\s*(.+)',
-            'phone': r'Телефон:\s*(.+)',
-            'email': r'Email:\s*(.+)',
-            'request': r'Запрос:\s*(.+)',
-        }
-        
         # Дополнительные индикаторы заявки
         self.application_indicators = [
             'заявка',
@@ -46,35 +140,17 @@ class ApplicationHandler:
         if not text:
             return False
         
-        text_lower = text.lower()
-        
-        # Проверяем основные паттерны заявки
-        if self._check_main_patterns(text):
+        # Проверяем блок заявки
+        lead = parse_lead(text)
+        if lead is not None and lead.is_complete:
             return True
         
         # Проверяем дополнительные индикаторы
-        if self._check_indicators(text_lower):
+        if self._check_indicators(text.lower()):
             return True
         
         return False
     
-    def _check_main_patterns(self, text: str) -> bool:
-        """Проверяет основные паттерны заявки"""
-        # Проверяем наличие заголовка
-        if not re.search(self.application_patterns['header'], text):
-            return False
-        
-        # Проверяем наличие основных полей
-        required_fields = ['name', 'phone', 'email', 'request']
-        found_fields = 0
-        
-        for field in required_fields:
-            if re.search(self.application_patterns[field], text):
-                found_fields += 1
-        
-        # Должно быть найдено минимум 3 поля из 4
-        return found_fields >= 3
-    
     def _check_indicators(self, text_lower: str) -> bool:
         """Проверяет дополнительные индикаторы заявки"""
         # Ищем ключевые слова, указывающие на заявку
@@ -95,29 +171,10 @@ class ApplicationHandler:
             text: Текст заявки
             
         Returns:
-            Dict[str, str]: Словарь с полями заявки или None если парсинг не удался
+            Dict[str, str]: Словарь с полями заявки или None, если блока заявки нет
         """
-        try:
-            application_data = {}
-            
-            # Извлекаем данные по паттернам
-            for field, pattern in self.application_patterns.items():
-                match = re.search(pattern, text)
-                if match:
-                    if field == 'header':
-                        application_data[field] = match.group(0)
-                    else:
-                        application_data[field] = match.group(1).strip()
-            
-            # Проверяем, что получили достаточно данных
-            if len(application_data) >= 4:  # header + 3 поля
-                return application_data
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"Ошибка при парсинге заявки: {e}")
-            return None
+        lead = parse_lead(text)
+        return lead.as_dict() if lead else None
     
     def format_application_for_working_chat(self, application_text: str, user_id: int) -> str:
         """
@@ -130,45 +187,19 @@ class ApplicationHandler:
         Returns:
             str: Отформатированная заявка для рабочего чата
         """
-        try:
-            # Парсим заявку
-            app_data = self.parse_application(application_text)
-            
-            if app_data:
-                # Форматируем структурированную заявку
-                formatted = (
-                    f"🚨 НОВАЯ ЗАЯВКА ОТ ПОЛЬЗОВАТЕЛЯ {user_id}\n\n"
-                    f"📋 {app_data.get('header', '[Заявка]')}\n\n"
-                    f"👤 Имя: {app_data.get('name', 'Не указано')}\n"
-                    f"📱 Телефон: {app_data.get('phone', 'Не указано')}\n"
-                    f"📧 Email: {app_data.get('email', 'Не указано')}\n"
-                    f"💬 Запрос: {app_data.get('request', 'Не указано')}\n\n"
-                    f"🆔 ID пользователя: {user_id}\n"
-                    f"⏰ Время: {self._get_current_time()}"
-                )
-            else:
-                # Если парсинг не удался, отправляем как есть
-                formatted = (
-                    f"🚨 НОВАЯ ЗАЯВКА ОТ ПОЛЬЗОВАТЕЛЯ {user_id}\n\n"
-                    f"📋 Содержание заявки:\n{application_text}\n\n"
-                    f"🆔 ID пользователя: {user_id}\n"
-                    f"⏰ Время: {self._get_current_time()}"
-                )
-            
-            return formatted
-            
-        except Exception as e:
-            logger.error(f"Ошибка при форматировании заявки: {e}")
-            # Возвращаем простой формат в случае ошибки
-            return (
-                f"🚨 НОВАЯ ЗАЯВКА ОТ ПОЛЬЗОВАТЕЛЯ {user_id}\n\n"
-                f"📋 Содержание:\n{application_text}\n\n"
-                f"🆔 ID пользователя: {user_id}"
-            )
+        lead = parse_lead(application_text)
+        if lead:
+            return format_lead_for_working_chat(lead, user_id)
+        # Если блока заявки нет, отправляем как есть
+        return (
+            f"🚨 НОВАЯ ЗАЯВКА ОТ ПОЛЬЗОВАТЕЛЯ {user_id}\n\n"
+            f"📋 Содержание заявки:\n{application_text}\n\n"
+            f"🆔 ID пользователя: {user_id}\n"
+            f"⏰ Время: {self._get_current_time()}"
+        )
     
     def _get_current_time(self) -> str:
         """Возвращает текущее время в читаемом формате"""
-        from datetime import datetime
         return datetime.now().strftime("%d.%m.%Y %H:%M:%S")
     
     def validate_application(self, application_text: str) -> Tuple[bool, str]:
@@ -0,0 +1,193 @@
+"""
+Асинхронная загрузка удалённых медиа с дисковым кэшем
+Общий пул соединений httpx, content-addressed хранение файлов
+и повторная проверка через ETag/Last-Modified
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+import httpx
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Размер блока при потоковом скачивании
+CHUNK_SIZE = 64 * 1024
+# Сколько байт копится в памяти перед записью на диск в отдельном потоке
+WRITE_BATCH_SIZE = 1024 * 1024
+
+
+def file_sha256(path: Path) -> str:
+    """Хэш содержимого локального файла (читается блоками)."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CachedAsset:
+    """Файл в дисковом кэше: путь к содержимому, его хэш и тип."""
+
+    def __init__(self, path: Path, sha256: str, content_type: str = ''):
+        self.path = path
+        self.sha256 = sha256
+        self.content_type = content_type
+
+    def open(self):
+        return open(self.path, 'rb')
+
+    def head(self, size: int = 8) -> bytes:
+        with open(self.path, 'rb') as f:
+            return f.read(size)
+
+
+class AssetFetcher:
+    """Скачивает медиа в дисковый кэш, адресуемый хэшем содержимого.
+
+    Повторные запросы к тому же URL в пределах max_age отдаются с диска без сети,
+    позже — проверяются условным GET (If-None-Match / If-Modified-Since): при 304
+    тело не передаётся. Тело пишется на диск потоково и не держится в памяти целиком.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_age: Optional[float] = None):
+        self.cache_dir = Path(cache_dir or Config.ASSET_CACHE_DIR)
+        self.max_age = Config.ASSET_CACHE_MAX_AGE if max_age is None else max_age
+        self._index_path = self.cache_dir / 'index.json'
+        self._index: Dict[str, dict] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._load_index()
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(Config.MEDIA_DOWNLOAD_TIMEOUT),
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+                follow_redirects=True,
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def fetch(self, url: str) -> Optional[CachedAsset]:
+        """Возвращает актуальную копию ресурса из кэша, при необходимости скачивая её."""
+        lock = self._locks.setdefault(url, asyncio.Lock())
+        async with lock:
+            entry = self._index.get(url)
+            cached = self._cached_asset(entry)
+            if cached and time.time() - entry.get('checked_at', 0) < self.max_age:
+                return cached
+
+            headers = {}
+            if cached:
+                if entry.get('etag'):
+                    headers['If-None-Match'] = entry['etag']
+                if entry.get('last_modified'):
+                    headers['If-Modified-Since'] = entry['last_modified']
+            try:
+                async with self._get_client().stream('GET', url, headers=headers) as resp:
+                    if resp.status_code == 304 and cached:
+                        entry['checked_at'] = time.time()
+                        await asyncio.to_thread(self._save_index)
+                        return cached
+                    if resp.status_code != 200:
+                        logger.warning(f"Assets: не удалось скачать {url}: HTTP {resp.status_code}")
+                        return cached
+                    sha256 = await self._download(resp)
+                    entry = {
+                        'sha256': sha256,
+                        'etag': resp.headers.get('ETag'),
+                        'last_modified': resp.headers.get('Last-Modified'),
+                        'content_type': resp.headers.get('Content-Type', ''),
+                        'checked_at': time.time(),
+                    }
+            except Exception as e:
+                logger.warning(f"Assets: ошибка скачивания {url}: {e}")
+                # Сеть недоступна — лучше отдать прошлую копию, чем ничего
+                return cached
+            previous = self._index.get(url)
+            self._index[url] = entry
+            await asyncio.to_thread(self._save_index)
+            if previous and previous.get('sha256') != entry['sha256']:
+                await self._remove_orphan(previous['sha256'])
+            return self._cached_asset(entry)
+
+    async def _download(self, resp: httpx.Response) -> str:
+        """Потоково пишет тело ответа во временный файл и переносит его под именем хэша.
+
+        Запись на диск идёт в отдельном потоке пачками по WRITE_BATCH_SIZE,
+        чтобы медленный диск не блокировал event loop.
+        """
+        fd, tmp_name = await asyncio.to_thread(self._make_tmp)
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                batch = bytearray()
+                async for chunk in resp.aiter_bytes(CHUNK_SIZE):
+                    digest.update(chunk)
+                    batch += chunk
+                    if len(batch) >= WRITE_BATCH_SIZE:
+                        await asyncio.to_thread(tmp.write, bytes(batch))
+                        batch.clear()
+                if batch:
+                    await asyncio.to_thread(tmp.write, bytes(batch))
+            sha256 = digest.hexdigest()
+            await asyncio.to_thread(os.replace, tmp_name, self.cache_dir / sha256)
+            return sha256
+        except BaseException:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+            raise
+
+    def _make_tmp(self):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        return tempfile.mkstemp(dir=self.cache_dir, suffix='.part')
+
+    async def _remove_orphan(self, sha256: str) -> None:
+        """Удаляет файл прежней версии, если на него не ссылается другой URL."""
+        if any(entry.get('sha256') == sha256 for entry in self._index.values()):
+            return
+        try:
+            await asyncio.to_thread((self.cache_dir / sha256).unlink, missing_ok=True)
+        except OSError as e:
+            logger.warning(f"Assets: не удалось удалить устаревший файл {sha256}: {e}")
+
+    def _cached_asset(self, entry: Optional[dict]) -> Optional[CachedAsset]:
+        if not entry:
+            return None
+        path = self.cache_dir / entry['sha256']
+        if not path.exists():
+            return None
+        return CachedAsset(path, entry['sha256'], entry.get('content_type', ''))
+
+    def _load_index(self) -> None:
+        try:
+            if self._index_path.exists():
+                self._index = json.loads(self._index_path.read_text(encoding='utf-8'))
+        except Exception as e:
+            logger.warning(f"Assets: не удалось прочитать индекс кэша: {e}")
+            self._index = {}
+
+    def _save_index(self) -> None:
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp = self._index_path.with_suffix('.tmp')
+            tmp.write_text(json.dumps(self._index, ensure_ascii=False), encoding='utf-8')
+            tmp.replace(self._index_path)
+        except Exception as e:
+            logger.warning(f"Assets: не удалось сохранить индекс кэша: {e}")
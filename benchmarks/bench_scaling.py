@@ -0,0 +1,202 @@
+"""
+Бенчмарк горизонтального масштабирования вебхука
+
+Для каждого числа воркеров из --workers запускает `uvicorn api.webhook:app
+--workers N` отдельным процессом (так же, как Procfile с WEB_CONCURRENCY) на
+эмуляторах из fake_services.py и общем Redis. Каждый пользователь присылает
+серию из --burst сообщений подряд; соединения не переиспользуются, поэтому
+сообщения одного пользователя попадают в разные воркеры.
+
+Отчёт по каждому N: пропускная способность, p50/p95 времени до ответа,
+число ранов и конфликтов (новый ран в thread с активным раном — то, от чего
+защищает lease пользователя), ответы с ошибкой. С --no-lock тот же прогон
+без блокировки (USER_LOCK_TTL=0) показывает, сколько конфликтов она снимает.
+
+Нужен запущенный Redis: без него у каждого воркера свои thread пользователей.
+Запуск из корня репозитория:
+    python benchmarks/bench_scaling.py --redis-url redis://localhost:6379/15 --workers 1,2,4
+    python benchmarks/bench_scaling.py --redis-url redis://localhost:6379/15 --workers 4 --no-lock
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx  # noqa: E402
+
+from fake_services import FakeAssistants, FakeSheets, FakeTelegram, free_port, serve, shutdown  # noqa: E402
+from load_test import ERROR_PREFIXES, WEBHOOK_SECRET, configure_env, percentile  # noqa: E402
+
+
+class BurstGenerator:
+    """Серии сообщений от пользователей; ответ закрывает все сообщения чата, отправленные до него."""
+
+    def __init__(self, telegram: FakeTelegram, first_user: int, users: int, burst: int, gap: float):
+        self.users = list(range(first_user, first_user + users))
+        self.burst = burst
+        self.gap = gap
+        self._update_id = first_user * 100
+        self._pending: Dict[int, List[float]] = defaultdict(list)
+        self.latency: List[float] = []
+        self.sent = 0
+        self.replies = 0
+        self.errors = 0
+        self.ack_errors = 0
+        self.last_reply_at = 0.0
+        telegram.on_message = self._on_message
+
+    def _on_message(self, chat_id: int, text: str) -> None:
+        if text == '…' or not self.users[0] <= chat_id <= self.users[-1]:
+            return
+        now = self.last_reply_at = time.monotonic()
+        self.replies += 1
+        if text.startswith(ERROR_PREFIXES):
+            self.errors += 1
+        # Сообщения серии могут склеиться в один ход: ответ закрывает все ожидающие
+        self.latency.extend(now - sent_at for sent_at in self._pending.pop(chat_id, []))
+
+    def _update(self, user_id: int) -> dict:
+        self._update_id += 1
+        return {
+            "update_id": self._update_id,
+            "message": {
+                "message_id": self._update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+                "text": f"Вопрос {self._update_id}",
+            },
+        }
+
+    async def run(self, url: str) -> None:
+        headers = {'X-Telegram-Bot-Api-Secret-Token': WEBHOOK_SECRET}
+        # Без keep-alive каждое сообщение — новое соединение и, возможно, другой воркер
+        limits = httpx.Limits(max_connections=1000, max_keepalive_connections=0)
+        async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+
+            async def deliver(user_id: int) -> None:
+                self._pending[user_id].append(time.monotonic())
+                self.sent += 1
+                try:
+                    response = await client.post(url, json=self._update(user_id), headers=headers)
+                    response.raise_for_status()
+                except Exception:
+                    self.ack_errors += 1
+
+            self.started = time.monotonic()
+            for _ in range(self.burst):
+                await asyncio.gather(*(deliver(user_id) for user_id in self.users))
+                await asyncio.sleep(self.gap)
+
+    async def drain(self, timeout: float) -> None:
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+
+async def wait_ready(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"uvicorn завершился с кодом {process.returncode}")
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("uvicorn не поднялся за отведённое время")
+
+
+async def run_workers(args, workers: int, index: int, telegram: FakeTelegram, assistants: FakeAssistants) -> dict:
+    """Один прогон с N воркерами uvicorn; пользователи не пересекаются с другими прогонами."""
+    port = free_port()
+    env = dict(os.environ, USER_LOCK_TTL='0' if args.no_lock else os.environ.get('USER_LOCK_TTL', '30'))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'api.webhook:app', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--log-level', 'warning'],
+        cwd=ROOT, env=env,
+    )
+    runs_before, conflicts_before = len(assistants.runs), assistants.conflicts
+    try:
+        await wait_ready(f"http://127.0.0.1:{port}/", process)
+        generator = BurstGenerator(telegram, (index + 1) * 100000, args.users, args.burst, args.gap)
+        await generator.run(f"http://127.0.0.1:{port}/api/webhook")
+        await generator.drain(args.drain)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    window = max(generator.last_reply_at - generator.started, 1e-9)
+    return {
+        "workers": workers,
+        "sent": generator.sent,
+        "replies": generator.replies,
+        "unanswered": sum(len(v) for v in generator._pending.values()),
+        "throughput": generator.sent / window if generator.replies else 0.0,
+        "p50": percentile(generator.latency, 50),
+        "p95": percentile(generator.latency, 95),
+        "runs": len(assistants.runs) - runs_before,
+        "conflicts": assistants.conflicts - conflicts_before,
+        "errors": generator.errors,
+        "ack_errors": generator.ack_errors,
+    }
+
+
+async def main(args) -> None:
+    telegram = FakeTelegram()
+    assistants = FakeAssistants(run_latency=args.run_latency, jitter=args.run_jitter)
+    sheets = FakeSheets(latency=0.05)
+    ports = [free_port() for _ in range(3)]
+    servers = [await serve(service.app, port) for service, port in zip((telegram, assistants, sheets), ports)]
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        configure_env(args, *(f"http://127.0.0.1:{port}" for port in ports), workdir)
+        for index, workers in enumerate(args.workers):
+            results.append(await run_workers(args, workers, index, telegram, assistants))
+
+    for server in servers:
+        await shutdown(server)
+
+    lock = 'без блокировки' if args.no_lock else f"lease {os.environ.get('USER_LOCK_TTL', '30')}с"
+    print(f"\nпользователей: {args.users}, серия: {args.burst} сообщ. через {args.gap}с, ран: {args.run_latency}с, {lock}")
+    print(f"{'воркеров':>9}{'сообщ.':>8}{'ответов':>9}{'без отв.':>10}{'сообщ./с':>10}"
+          f"{'p50, мс':>10}{'p95, мс':>10}{'ранов':>7}{'конфл.':>8}{'ошибок':>8}")
+    for r in results:
+        print(f"{r['workers']:>9}{r['sent']:>8}{r['replies']:>9}{r['unanswered']:>10}{r['throughput']:>10.2f}"
+              f"{r['p50'] * 1000:>10.0f}{r['p95'] * 1000:>10.0f}{r['runs']:>7}{r['conflicts']:>8}"
+              f"{r['errors'] + r['ack_errors']:>8}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--redis-url', required=True, help='REDIS_URL, общий для всех воркеров')
+    parser.add_argument('--workers', type=lambda s: [int(n) for n in s.split(',')], default=[1, 2, 4],
+                        help='числа воркеров uvicorn через запятую')
+    parser.add_argument('--users', type=int, default=50, help='число пользователей в прогоне')
+    parser.add_argument('--burst', type=int, default=3, help='сообщений от пользователя в серии')
+    parser.add_argument('--gap', type=float, default=0.2, help='пауза между сообщениями серии, секунд')
+    parser.add_argument('--run-latency', type=float, default=1.0, help='длительность рана, секунд')
+    parser.add_argument('--run-jitter', type=float, default=0.2, help='разброс длительности рана, секунд')
+    parser.add_argument('--webhook-workers', type=int, default=8, help='WEBHOOK_WORKERS в каждом воркере uvicorn')
+    parser.add_argument('--drain', type=float, default=60.0, help='сколько ждать оставшиеся ответы, секунд')
+    parser.add_argument('--no-lock', action='store_true', help='прогон без lease пользователя (USER_LOCK_TTL=0)')
+    args = parser.parse_args()
+    # configure_env из load_test ожидает и параметры polling
+    args.polling_concurrency = 1
+    return args
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,114 @@
+"""
+Микробенчмарк постобработки ответов ассистента
+
+Сравнивает прежнюю цепочку re.sub (OpenAIClient._extract_text_without_annotations +
+_strip_markdown_simple + bot._strip_markdown) с однопроходным text_pipeline.clean_reply
+на длинных ответах с Markdown, цитатами Retrieval и блоком заявки.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_text_pipeline.py [--number 2000]
+"""
+
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from text_pipeline import StreamingReplyCleaner, clean_reply  # noqa: E402
+
+PARAGRAPH = (
+    "**Отличный вопрос!** Для команды из *25 человек* мы обычно предлагаем формат "
+    "[выездной стратегической сессии](https://synaplink.example/strategy)【4:0†source】. "
+    "Он включает `диагностику`, работу с __целями__ и _обратную связь_ от фасилитатора.   "
+    "Сроки — от 2 недель, бюджет зависит от площадки【4:1†source】.\n\n"
+)
+
+APPLICATION = (
+    "[Заявка в рабочий чат]\n"
+    "  Имя: **Иван Петров**  \n\n"
+    "  Телефон: +7 999 123-45-67\n"
+    "Телеграм: @ivan_petrov\n"
+    "Email: ivan@example.com\n\n"
+    "Запрос: стратегическая сессия для отдела продаж\n"
+)
+
+REPLIES = {
+    "short": PARAGRAPH,
+    "long": PARAGRAPH * 12,
+    "application": PARAGRAPH * 2 + APPLICATION,
+}
+
+
+def legacy_clean(text: str) -> str:
+    """Прежний путь ответа: три независимые цепочки re.sub подряд."""
+    text = re.sub(r"【[^】]*】", "", text).replace("†", "").strip()
+    text = re.sub(r"\[([^\]]+)\]\(([^)]+)\)", r"\1", text)
+    text = re.sub(r"`{1,3}([\s\S]*?)`{1,3}", r"\1", text)
+    text = re.sub(r"\*\*([\s\S]*?)\*\*", r"\1", text)
+    text = re.sub(r"\*([\s\S]*?)\*", r"\1", text)
+    text = re.sub(r"__([\s\S]*?)__", r"\1", text)
+    text = re.sub(r"_([\s\S]*?)_", r"\1", text)
+    text = text.replace("**", "").replace("*", "")
+    if "[Заявка в рабочий чат]" in text:
+        text = '\n'.join(line.strip() for line in text.strip().split('\n') if line.strip())
+    # bot._strip_markdown
+    text = re.sub(r"\[([^\]]+)\]\(([^)]+)\)", r"\1", text)
+    text = re.sub(r"\*\*(.*?)\*\*", r"\1", text)
+    text = re.sub(r"\*(.*?)\*", r"\1", text)
+    text = re.sub(r"__(.*?)__", r"\1", text)
+    text = re.sub(r"_(.*?)_", r"\1", text)
+    text = re.sub(r"`{1,3}([\s\S]*?)`{1,3}", r"\1", text)
+    text = re.sub(r"【[^】]*】", "", text)
+    text = text.replace("†", "")
+    text = re.sub(r"[ \t]+", " ", text)
+    return re.sub(r"\s*\n\s*\n\s*", "\n\n", text).strip()
+
+
+def legacy_stream(text: str, chunk: int) -> str:
+    """Прежний стриминг: весь накопленный текст очищается заново на каждой дельте."""
+    raw = ''
+    shown = ''
+    for i in range(0, len(text), chunk):
+        raw += text[i:i + chunk]
+        shown = legacy_clean(raw)
+    return shown
+
+
+def pipeline_stream(text: str, chunk: int) -> str:
+    cleaner = StreamingReplyCleaner()
+    for i in range(0, len(text), chunk):
+        cleaner.feed(text[i:i + chunk])
+        cleaner.text()
+    return cleaner.text()
+
+
+def bench(func, number: int) -> float:
+    """Лучшее из трёх измерений, микросекунд на вызов."""
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=2000, help='вызовов на одно измерение')
+    parser.add_argument('--chunk', type=int, default=20, help='размер дельты при стриминге, символов')
+    args = parser.parse_args()
+
+    print(f"{'ответ':<14}{'символов':>10}{'legacy, µs':>14}{'pipeline, µs':>15}{'ускорение':>12}")
+    for name, text in REPLIES.items():
+        compact = "[Заявка в рабочий чат]" in text
+        old = bench(lambda: legacy_clean(text), args.number)
+        new = bench(lambda: clean_reply(text, compact=compact), args.number)
+        print(f"{name:<14}{len(text):>10}{old:>14.1f}{new:>15.1f}{old / new:>11.1f}x")
+
+    text = REPLIES["long"]
+    number = max(args.number // 100, 5)
+    old = bench(lambda: legacy_stream(text, args.chunk), number)
+    new = bench(lambda: pipeline_stream(text, args.chunk), number)
+    print(f"{'stream(long)':<14}{len(text):>10}{old:>14.1f}{new:>15.1f}{old / new:>11.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+"""
+Локальные эмуляторы внешних сервисов для нагрузочных тестов
+
+- FakeTelegram: Bot API (/bot<token>/<method>) — записывает вызовы, отдаёт
+  апдейты через getUpdates (режим polling) и сообщает о каждом ответе бота в чат.
+- FakeAssistants: Assistants API (/v1/...) с настраиваемой длительностью рана,
+  долей неуспешных ранов и долей ответов 429.
+- FakeSheets: values.append из Sheets API v4, считает записанные строки.
+
+Каждый эмулятор — приложение FastAPI; serve() поднимает его в текущем event loop.
+"""
+
+import asyncio
+import json
+import random
+import socket
+import time
+import uuid
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qs
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+BOT_USER = {"id": 100000, "is_bot": True, "first_name": "BenchBot", "username": "bench_bot"}
+
+REPLY_TEXT = (
+    "**Спасибо за вопрос!** Для команды такого размера подойдёт "
+    "[стратегическая сессия](https://example.com/strategy)【4:0†source】. "
+    "Подскажите, пожалуйста, сроки и примерный бюджет?"
+)
+LEAD_TEXT = (
+    "[Заявка в рабочий чат]\n"
+    "Имя: **Иван Петров**\n"
+    "Телефон: +7 999 123-45-67\n"
+    "Телеграм: @ivan_petrov\n"
+    "Email: ivan@example.com\n"
+    "Запрос: стратегическая сессия для отдела продаж"
+)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def serve(app: FastAPI, port: int) -> uvicorn.Server:
+    """Запускает приложение на 127.0.0.1:port в текущем event loop и ждёт готовности."""
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning'))
+    server._task = asyncio.create_task(server.serve())  # type: ignore[attr-defined]
+    while not server.started:
+        if server._task.done():  # type: ignore[attr-defined]
+            server._task.result()  # type: ignore[attr-defined]
+        await asyncio.sleep(0.01)
+    return server
+
+
+async def shutdown(server: uvicorn.Server) -> None:
+    server.should_exit = True
+    await server._task  # type: ignore[attr-defined]
+
+
+class FakeTelegram:
+    """Эмулятор Bot API."""
+
+    def __init__(self):
+        self.calls: Counter = Counter()
+        self.updates: List[dict] = []
+        self._new_updates = asyncio.Event()
+        self._message_id = 0
+        # Вызывается на каждый sendMessage/editMessageText: (chat_id, text)
+        self.on_message: Optional[Callable[[int, str], None]] = None
+        self.app = FastAPI()
+        self.app.add_api_route('/bot{token}/{method}', self._handle, methods=['GET', 'POST'])
+
+    def push_update(self, update: dict) -> None:
+        """Кладёт апдейт в очередь getUpdates (режим polling)."""
+        self.updates.append(update)
+        self._new_updates.set()
+
+    async def _params(self, request: Request) -> dict:
+        content_type = request.headers.get('content-type', '')
+        body = await request.body()
+        if content_type.startswith('application/json'):
+            return json.loads(body or b'{}')
+        if content_type.startswith('application/x-www-form-urlencoded'):
+            return {k: v[0] for k, v in parse_qs(body.decode()).items()}
+        # multipart (файлы) не разбираем: для нагрузки достаточно имени метода
+        return dict(request.query_params)
+
+    def _message(self, chat_id, text: str = '') -> dict:
+        self._message_id += 1
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id or 0), "type": "private"},
+            "from": BOT_USER,
+            "text": text,
+        }
+
+    async def _handle(self, token: str, method: str, request: Request):
+        params = await self._params(request)
+        self.calls[method] += 1
+        if method == 'getUpdates':
+            return {"ok": True, "result": await self._get_updates(params)}
+        if method == 'getMe':
+            return {"ok": True, "result": BOT_USER}
+        if method in ('sendMessage', 'editMessageText'):
+            chat_id, text = params.get('chat_id'), params.get('text', '')
+            if self.on_message and chat_id is not None:
+                self.on_message(int(chat_id), text)
+            return {"ok": True, "result": self._message(chat_id, text)}
+        if method in ('sendPhoto', 'sendDocument'):
+            return {"ok": True, "result": self._message(params.get('chat_id'))}
+        if method == 'getChatMember':
+            return {"ok": True, "result": {"status": "member", "user": BOT_USER}}
+        return {"ok": True, "result": True}
+
+    async def _get_updates(self, params: dict) -> List[dict]:
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        limit = int(params.get('limit') or 100)
+        # Подтверждённые апдейты (update_id < offset) больше не отдаём
+        self.updates = [u for u in self.updates if u['update_id'] >= offset]
+        if not self.updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:limit]
+
+
+class FakeAssistants:
+    """Эмулятор Assistants API.
+
+    Ран проводит queue_delay секунд в статусе queued и run_latency секунд
+    (± jitter) в in_progress; с вероятностью failure_rate завершается статусом
+    failed. Любой запрос с вероятностью rate_limit_rate получает 429. Новый ран
+    в thread с активным раном получает 400, как в настоящем API (счётчик conflicts).
+    """
+
+    def __init__(
+        self,
+        run_latency: float = 1.0,
+        jitter: float = 0.2,
+        queue_delay: float = 0.0,
+        failure_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        lead_rate: float = 0.0,
+    ):
+        self.run_latency = run_latency
+        self.jitter = jitter
+        self.queue_delay = queue_delay
+        self.failure_rate = failure_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.lead_rate = lead_rate
+        self.calls: Counter = Counter()
+        self.rate_limited = 0
+        self.conflicts = 0
+        self.runs: Dict[str, dict] = {}
+        self._active: Dict[str, dict] = {}
+        self.messages: Dict[str, List[dict]] = defaultdict(list)
+        self.app = FastAPI()
+        self.app.middleware('http')(self._rate_limit)
+        self.app.add_api_route('/v1/assistants/{assistant_id}', self._assistant, methods=['GET'])
+        self.app.add_api_route('/v1/threads', self._create_thread, methods=['POST'])
+        self.app.add_api_route('/v1/threads/runs', self._create_and_run, methods=['POST'])
+        self.app.add_api_route('/v1/threads/{thread_id}/runs', self._create_run, methods=['POST'])
+        self.app.add_api_route('/v1/threads/{thread_id}/runs/{run_id}', self._get_run, methods=['GET'])
+        self.app.add_api_route('/v1/threads/{thread_id}/messages', self._list_messages, methods=['GET'])
+
+    async def _rate_limit(self, request: Request, call_next):
+        self.calls[f"{request.method} {request.url.path.split('/')[2]}"] += 1
+        if random.random() < self.rate_limit_rate:
+            self.rate_limited += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                status_code=429,
+                headers={"retry-after-ms": "50"},
+            )
+        return await call_next(request)
+
+    async def _assistant(self, assistant_id: str):
+        return {
+            "id": assistant_id, "object": "assistant", "created_at": int(time.time()),
+            "name": "Bench assistant", "model": "fake", "instructions": "", "tools": [], "metadata": {},
+        }
+
+    def _thread(self) -> dict:
+        return {"id": f"thread_{uuid.uuid4().hex[:16]}", "object": "thread", "created_at": int(time.time()), "metadata": {}}
+
+    async def _create_thread(self):
+        return self._thread()
+
+    async def _create_and_run(self, request: Request):
+        body = await request.json()
+        return self._start_run(self._thread()['id'], body.get('assistant_id', ''))
+
+    async def _create_run(self, thread_id: str, request: Request):
+        body = await request.json()
+        active = self._active.get(thread_id)
+        if active is not None and time.monotonic() < active['ends_at']:
+            self.conflicts += 1
+            return JSONResponse(
+                {"error": {
+                    "message": f"Thread {thread_id} already has an active run {active['id']}.",
+                    "type": "invalid_request_error",
+                }},
+                status_code=400,
+            )
+        return self._start_run(thread_id, body.get('assistant_id', ''))
+
+    def _start_run(self, thread_id: str, assistant_id: str) -> dict:
+        now = time.monotonic()
+        latency = max(0.0, self.run_latency + random.uniform(-self.jitter, self.jitter))
+        run = {
+            "id": f"run_{uuid.uuid4().hex[:16]}", "thread_id": thread_id, "assistant_id": assistant_id,
+            "starts_at": now + self.queue_delay, "ends_at": now + self.queue_delay + latency,
+            "fail": random.random() < self.failure_rate,
+        }
+        self.runs[run['id']] = run
+        self._active[thread_id] = run
+        return self._run_object(run)
+
+    def _run_object(self, run: dict) -> dict:
+        now = time.monotonic()
+        if now < run['starts_at']:
+            status = 'queued'
+        elif now < run['ends_at']:
+            status = 'in_progress'
+        else:
+            status = 'failed' if run['fail'] else 'completed'
+            if status == 'completed' and not self.messages.get(run['id']):
+                self.messages[run['id']] = [self._reply(run)]
+        return {
+            "id": run['id'], "object": "thread.run", "created_at": int(time.time()),
+            "thread_id": run['thread_id'], "assistant_id": run['assistant_id'], "status": status,
+            "last_error": {"code": "server_error", "message": "fake failure"} if status == 'failed' else None,
+            "model": "fake", "instructions": "", "tools": [], "metadata": {},
+        }
+
+    def _reply(self, run: dict) -> dict:
+        text = LEAD_TEXT if random.random() < self.lead_rate else REPLY_TEXT
+        return {
+            "id": f"msg_{uuid.uuid4().hex[:16]}", "object": "thread.message", "created_at": int(time.time()),
+            "thread_id": run['thread_id'], "run_id": run['id'], "assistant_id": run['assistant_id'],
+            "role": "assistant", "status": "completed", "attachments": [], "metadata": {},
+            "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+        }
+
+    async def _get_run(self, thread_id: str, run_id: str):
+        run = self.runs.get(run_id)
+        if run is None:
+            return JSONResponse({"error": {"message": "No run found"}}, status_code=404)
+        return self._run_object(run)
+
+    async def _list_messages(self, thread_id: str, run_id: Optional[str] = None):
+        data = self.messages.get(run_id, []) if run_id else []
+        return {
+            "object": "list", "data": data, "has_more": False,
+            "first_id": data[0]['id'] if data else None, "last_id": data[-1]['id'] if data else None,
+        }
+
+
+class FakeSheets:
+    """Эмулятор values.append из Sheets API v4."""
+
+    def __init__(self, latency: float = 0.1):
+        self.latency = latency
+        self.rows: List[list] = []
+        self.requests = 0
+        self.app = FastAPI()
+        self.app.add_api_route('/v4/spreadsheets/{spreadsheet_id}/values/{range_}', self._append, methods=['POST'])
+
+    async def _append(self, spreadsheet_id: str, range_: str, request: Request):
+        body = await request.json()
+        await asyncio.sleep(self.latency)
+        self.requests += 1
+        self.rows.extend(body.get('values', []))
+        return {"spreadsheetId": spreadsheet_id, "updates": {"updatedRows": len(body.get('values', []))}}
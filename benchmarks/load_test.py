@@ -0,0 +1,287 @@
+"""
+Нагрузочный тест бота на локальных эмуляторах Telegram, OpenAI и Google Sheets
+
+Поднимает эмуляторы из fake_services.py, запускает бота в том же процессе
+(вебхук api/webhook.py через uvicorn или polling через getUpdates эмулятора)
+и подаёт текстовые сообщения с заданной частотой от пула пользователей.
+У каждого пользователя не больше одного сообщения без ответа, поэтому ответ
+однозначно сопоставляется с сообщением.
+
+Отчёт: пропускная способность, p50/p95/p99 по этапам (ack вебхука, ответ
+пользователю, обработчик и его этапы из сводных записей logging_setup),
+доля ошибок, число вызовов Bot API и Assistants API, строки в Sheets.
+
+Запуск из корня репозитория:
+    python benchmarks/load_test.py --mode webhook --rate 20 --duration 30
+    python benchmarks/load_test.py --mode polling --rate 5 --run-latency 2 --failure-rate 0.05
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx  # noqa: E402
+
+from fake_services import FakeAssistants, FakeSheets, FakeTelegram, free_port, serve, shutdown  # noqa: E402
+
+BOT_TOKEN = '123456:BENCH'
+WORKING_CHAT_ID = -100999
+WEBHOOK_SECRET = 'bench-secret'
+ERROR_PREFIXES = ('Извините', 'Произошла ошибка')
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class StageCollector(logging.Handler):
+    """Собирает время этапов из сводных записей logging_setup.update_context."""
+
+    def __init__(self):
+        super().__init__(level=logging.INFO)
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        fields = getattr(record, 'fields', None) or {}
+        if 'duration_ms' not in fields:
+            return
+        self.samples['handler'].append(fields['duration_ms'] / 1000)
+        for name, ms in (fields.get('stages') or {}).items():
+            self.samples[f"handler.{name}"].append(ms / 1000)
+
+
+class LoadGenerator:
+    """Подаёт сообщения с частотой rate и ждёт ответ бота в тот же чат."""
+
+    def __init__(self, telegram: FakeTelegram, users: int, rate: float, duration: float):
+        self.telegram = telegram
+        self.users = list(range(1, users + 1))
+        self.rate = rate
+        self.duration = duration
+        self._update_id = 0
+        self._pending: Dict[int, float] = {}
+        self.latency: Dict[str, List[float]] = defaultdict(list)
+        self.sent = 0
+        self.replied = 0
+        self.errors = 0
+        self.ack_errors = 0
+        self.skipped = 0
+        self.started = self.last_reply_at = time.monotonic()
+        telegram.on_message = self._on_message
+
+    def _on_message(self, chat_id: int, text: str) -> None:
+        sent_at = self._pending.pop(chat_id, None)
+        if sent_at is None or text == '…':
+            if sent_at is not None:
+                self._pending[chat_id] = sent_at
+            return
+        self.last_reply_at = time.monotonic()
+        self.latency['reply'].append(self.last_reply_at - sent_at)
+        self.replied += 1
+        if text.startswith(ERROR_PREFIXES):
+            self.errors += 1
+
+    def _update(self, user_id: int) -> dict:
+        self._update_id += 1
+        sender = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+        return {
+            "update_id": self._update_id,
+            "message": {
+                "message_id": self._update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": sender,
+                "text": f"Нужна стратегическая сессия, сообщение {self._update_id}",
+            },
+        }
+
+    async def run(self, deliver) -> None:
+        started = self.started = time.monotonic()
+        tasks = set()
+        next_at = started
+        while time.monotonic() - started < self.duration:
+            free = [u for u in self.users if u not in self._pending]
+            if not free:
+                self.skipped += 1
+            else:
+                user_id = random.choice(free)
+                self._pending[user_id] = time.monotonic()
+                self.sent += 1
+                task = asyncio.create_task(deliver(self._update(user_id)))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            next_at += 1 / self.rate
+            await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+        self.elapsed = time.monotonic() - started
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def drain(self, timeout: float) -> None:
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+
+def configure_env(args, telegram_url: str, openai_url: str, sheets_url: str, workdir: str) -> None:
+    """Переменные окружения бота; задаются до импорта config."""
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': BOT_TOKEN,
+        'TELEGRAM_API_BASE_URL': telegram_url,
+        'TELEGRAM_WEBHOOK_SECRET': WEBHOOK_SECRET,
+        'OPENAI_API_KEY': 'sk-bench',
+        'OPENAI_ASSISTANT_ID': 'asst_bench',
+        'OPENAI_BASE_URL': f"{openai_url}/v1",
+        'GOOGLE_SHEETS_ENDPOINT': sheets_url,
+        'GOOGLE_SHEETS_SPREADSHEET_ID': 'bench',
+        'WORKING_CHAT_ID': str(WORKING_CHAT_ID),
+        'LEAD_OUTBOX_PATH': os.path.join(workdir, 'lead_outbox.sqlite3'),
+        'ASSET_CACHE_DIR': os.path.join(workdir, 'assets'),
+        'SHEETS_FLUSH_INTERVAL': '0.5',
+        'WEBHOOK_WORKERS': str(args.webhook_workers),
+        'POLLING_CONCURRENCY': str(args.polling_concurrency),
+        'REDIS_URL': args.redis_url or '',
+        'STREAM_REPLIES': 'false',
+        'LOG_LEVEL': 'WARNING',
+        'LOG_FILE': '',
+        'METRICS_PORT': '',
+        'LOGO_IMAGE_URL': '',
+        'CHECKLIST_URL': '',
+    })
+
+
+async def run_webhook(args, generator: LoadGenerator) -> None:
+    from api.webhook import app
+
+    port = free_port()
+    server = await serve(app, port)
+    url = f"http://127.0.0.1:{port}/api/webhook"
+    headers = {'X-Telegram-Bot-Api-Secret-Token': WEBHOOK_SECRET}
+    limits = httpx.Limits(max_connections=1000, max_keepalive_connections=100)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+
+        async def deliver(update: dict) -> None:
+            started = time.monotonic()
+            try:
+                response = await client.post(url, json=update, headers=headers)
+                response.raise_for_status()
+            except Exception:
+                generator.ack_errors += 1
+                return
+            generator.latency['ack'].append(time.monotonic() - started)
+
+        await generator.run(deliver)
+        await generator.drain(args.drain)
+    await shutdown(server)
+
+
+async def run_polling(args, generator: LoadGenerator, telegram: FakeTelegram) -> None:
+    from bot import SynaplinkBot
+
+    bot = SynaplinkBot()
+    await bot.startup()
+    await bot.application.updater.start_polling(poll_interval=0, timeout=10)
+
+    async def deliver(update: dict) -> None:
+        telegram.push_update(update)
+
+    try:
+        await generator.run(deliver)
+        await generator.drain(args.drain)
+    finally:
+        await bot.application.updater.stop()
+        await bot.shutdown()
+
+
+def report(args, generator: LoadGenerator, stages: StageCollector, telegram, assistants, sheets) -> None:
+    elapsed = generator.elapsed
+    print(f"\nрежим: {args.mode}, цель: {args.rate} upd/s, длительность: {elapsed:.1f}с, пользователей: {args.users}")
+    print(f"отправлено: {generator.sent}, ответов: {generator.replied}, без ответа: {len(generator._pending)}, "
+          f"пропущено (все пользователи ждут ответа): {generator.skipped}")
+    # Считаем до последнего ответа: при перегрузке ответы приходят и после конца подачи
+    window = max(elapsed, generator.last_reply_at - generator.started)
+    print(f"пропускная способность: {generator.replied / window:.2f} ответов/с (за {window:.1f}с)")
+    error_rate = generator.errors / generator.replied if generator.replied else 0.0
+    print(f"ошибки: ответов с ошибкой {generator.errors} ({error_rate:.1%}), ошибок HTTP вебхука {generator.ack_errors}")
+
+    print(f"\n{'этап':<24}{'n':>7}{'p50, мс':>11}{'p95, мс':>11}{'p99, мс':>11}")
+    rows = dict(generator.latency)
+    rows.update(stages.samples)
+    for name in sorted(rows, key=lambda n: (n not in ('ack', 'reply'), n)):
+        values = rows[name]
+        print(f"{name:<24}{len(values):>7}" + ''.join(f"{percentile(values, q) * 1000:>11.1f}" for q in (50, 95, 99)))
+
+    print(f"\nBot API: {dict(telegram.calls)}")
+    print(f"Assistants API: {dict(assistants.calls)}, ответов 429: {assistants.rate_limited}")
+    print(f"Sheets: запросов {sheets.requests}, строк {len(sheets.rows)}")
+
+
+async def main(args) -> None:
+    telegram = FakeTelegram()
+    assistants = FakeAssistants(
+        run_latency=args.run_latency,
+        jitter=args.run_jitter,
+        queue_delay=args.queue_delay,
+        failure_rate=args.failure_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        lead_rate=args.lead_rate,
+    )
+    sheets = FakeSheets(latency=args.sheets_latency)
+    ports = [free_port() for _ in range(3)]
+    servers = [await serve(service.app, port) for service, port in zip((telegram, assistants, sheets), ports)]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure_env(args, *(f"http://127.0.0.1:{port}" for port in ports), workdir)
+        stages = StageCollector()
+        stage_logger = logging.getLogger('logging_setup')
+        stage_logger.addHandler(stages)
+        stage_logger.setLevel(logging.INFO)
+        stage_logger.propagate = False
+
+        generator = LoadGenerator(telegram, users=args.users, rate=args.rate, duration=args.duration)
+        if args.mode == 'webhook':
+            await run_webhook(args, generator)
+        else:
+            await run_polling(args, generator, telegram)
+
+    for server in servers:
+        await shutdown(server)
+    report(args, generator, stages, telegram, assistants, sheets)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=('webhook', 'polling'), default='webhook')
+    parser.add_argument('--rate', type=float, default=10.0, help='апдейтов в секунду')
+    parser.add_argument('--duration', type=float, default=20.0, help='секунд подачи нагрузки')
+    parser.add_argument('--users', type=int, default=200, help='число пользователей')
+    parser.add_argument('--drain', type=float, default=30.0, help='сколько ждать оставшиеся ответы, секунд')
+    parser.add_argument('--run-latency', type=float, default=1.0, help='длительность рана, секунд')
+    parser.add_argument('--run-jitter', type=float, default=0.2, help='разброс длительности рана, секунд')
+    parser.add_argument('--queue-delay', type=float, default=0.0, help='время рана в статусе queued, секунд')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='доля ранов со статусом failed')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='доля запросов к OpenAI с ответом 429')
+    parser.add_argument('--lead-rate', type=float, default=0.05, help='доля ответов с блоком заявки')
+    parser.add_argument('--sheets-latency', type=float, default=0.1, help='задержка записи в Sheets, секунд')
+    parser.add_argument('--webhook-workers', type=int, default=0, help='WEBHOOK_WORKERS (0 — обработка в запросе)')
+    parser.add_argument('--polling-concurrency', type=int, default=32, help='POLLING_CONCURRENCY (1 — последовательно)')
+    parser.add_argument('--redis-url', default='', help='REDIS_URL (по умолчанию без Redis)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -6,6 +6,7 @@
 import logging
 import asyncio
 import re
+import time
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application, 
@@ -17,18 +18,29 @@ from telegram.ext import (
 )
 from config import Config
 from openai_client import OpenAIClient
-from application_handler import ApplicationHandler
+from application_handler import ApplicationHandler, Lead, format_lead_for_working_chat, parse_lead
 from google_sheets_client import append_lead_row
-import requests  # type: ignore[reportMissingImports]
-from io import BytesIO
+from turn_queue import UserTurnQueue
+from update_queue import ChatOrderedUpdateProcessor
+from broadcaster import Broadcaster
+from lead_outbox import LeadOutbox, LeadOutboxWorker
+from persistence import RedisPersistence, pins_user_data
+from redis_pool import close_redis, get_redis
+from metrics import ERRORS, LEADS, InstrumentedHTTPXRequest, register_stats, timed_handler
+from logging_setup import log_payload, logged_update, stage
+from media_cache import FileIdCache
+from asset_fetcher import AssetFetcher, CachedAsset, file_sha256
+from pathlib import Path
+from typing import Optional
 
-# Настраиваем логирование
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
+# Максимальная длина текста одного сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+CHECKLIST_CAPTION = "В знак благодарности отправляем вам наш гайд «Как игры помогают выявить лидеров в команде»."
+CHECKLIST_FILENAME = "Как игры помогают выявить лидеров в команде.pdf"
+
 class SynaplinkBot:
     """Основной класс Telegram-бота FriendEvent (ребрендинг)"""
     
@@ -38,20 +50,56 @@ class SynaplinkBot:
             logger.info("🔧 Инициализация бота...")
             logger.info(f"🔑 Создание Application с токеном: {Config.TELEGRAM_BOT_TOKEN[:10]}...")
             
-            self.application = Application.builder().token(Config.TELEGRAM_BOT_TOKEN).build()
-            logger.info("✅ Application создан успешно")
-            
             logger.info("🤖 Создание OpenAI клиента...")
             self.openai_client = OpenAIClient()
             logger.info("✅ OpenAI клиент создан")
+
+            # Состояние пользователей (context.user_data) хранится в Redis
+            self.persistence = RedisPersistence(redis=get_redis())
+
+            # Апдейты разных чатов обрабатываются параллельно, одного чата — по порядку
+            self.update_processor = ChatOrderedUpdateProcessor(Config.POLLING_CONCURRENCY)
+
+            builder = (
+                Application.builder()
+                .token(Config.TELEGRAM_BOT_TOKEN)
+                .concurrent_updates(self.update_processor)
+                # Время каждого вызова Bot API пишется в метрики по имени метода
+                .request(InstrumentedHTTPXRequest(connection_pool_size=Config.TELEGRAM_POOL_SIZE))
+                .get_updates_request(InstrumentedHTTPXRequest())
+                .persistence(self.persistence)
+                .post_init(self._post_init)
+                .post_shutdown(self._post_shutdown)
+            )
+            if Config.TELEGRAM_API_BASE_URL:
+                # Локальный Bot API сервер или эмулятор из benchmarks/
+                api_url = Config.TELEGRAM_API_BASE_URL.rstrip('/')
+                builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+            self.application = builder.build()
+            logger.info("✅ Application создан успешно")
             
             logger.info("📋 Создание ApplicationHandler...")
             self.application_handler = ApplicationHandler()
             logger.info("✅ ApplicationHandler создан")
             
-            self.user_states = {}  # Хранит состояние пользователей
-            logger.info("✅ Словарь состояний пользователей инициализирован")
+            # Один активный ран на пользователя; сообщения во время рана склеиваются
+            self.turn_queue = UserTurnQueue()
+
+            # file_id логотипа и чек-листа, уже загруженных в Telegram
+            self.media_cache = FileIdCache(redis=get_redis())
+            # Общий пул HTTP-соединений и дисковый кэш для скачивания медиа
+            self.asset_fetcher = AssetFetcher()
+
+            # Лиды сначала пишутся в локальный outbox, в Sheets их переносит фоновый воркер
+            try:
+                self.lead_outbox = LeadOutboxWorker(LeadOutbox())
+                logger.info("✅ Outbox лидов открыт")
+            except Exception as e:
+                logger.warning(f"Outbox лидов недоступен, пишем в Sheets напрямую: {e}")
+                self.lead_outbox = None
             
+            self._register_metrics()
+
             # Регистрируем обработчики
             logger.info("🔧 Регистрация обработчиков...")
             self._setup_handlers()
@@ -63,6 +111,67 @@ class SynaplinkBot:
             logger.error(f"🔍 Stack trace: {traceback.format_exc()}")
             raise
         
+    def _register_metrics(self) -> None:
+        """Экспортирует внутренние счётчики компонентов в метрики Prometheus."""
+        register_stats('openai', self.openai_client.stats)
+        register_stats('turn_queue', self.turn_queue.stats)
+        register_stats('polling', self.update_processor.stats)
+        register_stats('persistence', self.persistence.stats)
+        if self.lead_outbox:
+            register_stats('outbox', self.lead_outbox.snapshot)
+
+    async def startup(self):
+        """Инициализирует Application для обработки апдейтов вне run_polling (вебхук).
+
+        Вызывается один раз на процесс: соединения с Telegram, OpenAI и Redis
+        затем переиспользуются всеми апдейтами.
+        """
+        await self.application.initialize()
+        # start() без updater: запускает периодическое сохранение persistence
+        await self.application.start()
+        await self._start_background()
+        logger.info("✅ Application инициализирован")
+
+    async def shutdown(self):
+        """Освобождает ресурсы Application, созданные в startup()."""
+        await self._stop_background()
+        if self.application.running:
+            await self.application.stop()
+        await self.application.shutdown()
+        # Пул Redis закрываем последним: shutdown() ещё сохраняет persistence через него
+        await close_redis()
+        logger.info("✅ Application остановлен")
+
+    async def _post_init(self, application: Application) -> None:
+        """Хук run_polling: запускает фоновые задачи после инициализации Application."""
+        await self._start_background()
+
+    async def _post_shutdown(self, application: Application) -> None:
+        """Хук run_polling: останавливает фоновые задачи (PTB уже сохранил persistence)."""
+        await self._stop_background()
+        await close_redis()
+
+    async def _start_background(self):
+        """Запускает фоновые задачи бота в текущем event loop."""
+        if self.lead_outbox:
+            self.lead_outbox.start()
+        self.persistence.start(self.application)
+        await self.media_cache.load()
+        # Фильтр подписчиков прогревается в фоне; до этого лишний SADD просто дойдёт до Redis
+        self._subs_task = asyncio.create_task(self.openai_client.warm_subscriber_filter())
+        # Предзагрузка медиа не задерживает старт: идёт фоновой задачей
+        self._media_task = asyncio.create_task(self._preupload_media())
+
+    async def _stop_background(self):
+        """Останавливает фоновые задачи бота."""
+        if self.lead_outbox:
+            await self.lead_outbox.stop()
+        await self.persistence.stop()
+        for task in (getattr(self, '_media_task', None), getattr(self, '_subs_task', None)):
+            if task and not task.done():
+                task.cancel()
+        await self.asset_fetcher.aclose()
+
     def _setup_handlers(self):
         """Настраивает все обработчики команд и сообщений"""
         
@@ -101,30 +210,6 @@ class SynaplinkBot:
         except Exception:
             return url
 
-    def _strip_markdown(self, text: str) -> str:
-        """Удаляет базовую Markdown-разметку у ответа ассистента."""
-        if not text:
-            return text
-        try:
-            # [текст](url) -> текст
-            text = re.sub(r"\[([^\]]+)\]\(([^)]+)\)", r"\1", text)
-            # **x**, *x*, __x__, _x_ -> x
-            text = re.sub(r"\*\*(.*?)\*\*", r"\1", text)
-            text = re.sub(r"\*(.*?)\*", r"\1", text)
-            text = re.sub(r"__(.*?)__", r"\1", text)
-            text = re.sub(r"_(.*?)_", r"\1", text)
-            # `x` или ```x``` -> x
-            text = re.sub(r"`{1,3}([\s\S]*?)`{1,3}", r"\1", text)
-            # Удаляем цитаты Retrieval вида 【...】 и спецсимвол †
-            text = re.sub(r"【[^】]*】", "", text)
-            text = text.replace("†", "")
-            # Нормализуем лишние пробелы
-            text = re.sub(r"[ \t]+", " ", text)
-            text = re.sub(r"\s*\n\s*\n\s*", "\n\n", text).strip()
-            return text
-        except Exception:
-            return text
-
     async def _send_checklist(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Надёжная отправка чек-листа пользователю с красивым именем файла."""
         if not getattr(Config, 'CHECKLIST_URL', None):
@@ -133,26 +218,36 @@ class SynaplinkBot:
         chat_id = update.effective_chat.id
         url = Config.CHECKLIST_URL
         logger.info(f"📄 CHECKLIST_URL={url}")
-        caption = "В знак благодарности отправляем вам наш гайд «Как игры помогают выявить лидеров в команде»."
+        caption = CHECKLIST_CAPTION
+        # Попытка 0: файл уже загружен в Telegram — отправляем по file_id без передачи байтов
+        file_id = self.media_cache.get(url)
+        if file_id:
+            try:
+                await context.bot.send_document(chat_id=chat_id, document=file_id, caption=caption)
+                logger.info("✅ Чек-лист отправлен по file_id")
+                return
+            except Exception as e:
+                logger.warning(f"file_id чек-листа больше не действителен: {e}")
+                await self.media_cache.invalidate(url)
         # Попытка A: сразу отправить как документ по прямой ссылке (пусть Telegram скачивает сам)
         try:
-            await context.bot.send_document(chat_id=chat_id, document=self._gdrive_to_direct(url), caption=caption)
+            message = await context.bot.send_document(chat_id=chat_id, document=self._gdrive_to_direct(url), caption=caption)
+            await self._remember_file_id(url, None, message)
             logger.info("✅ Чек-лист отправлен Telegram по URL (прямая загрузка)")
             return
         except Exception as e:
             logger.warning(f"Не удалось отправить документ по URL напрямую: {e}")
         # Попытка B: скачать и отправить байтами, проверив сигнатуру PDF
         try:
-            direct = self._gdrive_to_direct(url)
-            resp = requests.get(direct, timeout=30)
-            content_type = resp.headers.get('Content-Type', '')
-            if resp.status_code == 200 and resp.content and (b'%PDF' in resp.content[:8] or 'pdf' in content_type.lower()):
-                buf = BytesIO(resp.content)
-                buf.name = "Как игры помогают выявить лидеров в команде.pdf"
-                await context.bot.send_document(chat_id=chat_id, document=buf, caption=caption)
+            asset = await self._fetch_media(url, expect_pdf=True)
+            if asset:
+                with asset.open() as document:
+                    message = await context.bot.send_document(
+                        chat_id=chat_id, document=document, filename=CHECKLIST_FILENAME, caption=caption
+                    )
+                await self._remember_file_id(url, asset.sha256, message)
                 logger.info("✅ Чек-лист отправлен как байты (PDF)")
                 return
-            logger.warning(f"Не удалось скачать валидный PDF: HTTP {resp.status_code}, Content-Type={content_type}")
         except Exception as e:
             logger.warning(f"Ошибка скачивания чек-листа: {e}")
         # Попытка C: отправляем текстом ссылку (чтобы пользователь точно получил доступ)
@@ -162,16 +257,84 @@ class SynaplinkBot:
         except Exception as e:
             logger.error(f"❌ Не удалось отправить чек-лист ни одним способом: {e}")
 
+    async def _fetch_media(self, source: str, expect_pdf: bool = False) -> Optional[CachedAsset]:
+        """Возвращает медиа из дискового кэша (URL) или локального файла, не блокируя event loop."""
+        if not source.startswith('http'):
+            path = Path(source)
+            return CachedAsset(path, await asyncio.to_thread(file_sha256, path))
+        asset = await self.asset_fetcher.fetch(self._gdrive_to_direct(source))
+        if asset is None:
+            return None
+        if expect_pdf:
+            head = await asyncio.to_thread(asset.head)
+            if not (b'%PDF' in head or 'pdf' in asset.content_type.lower()):
+                logger.warning(f"Не удалось скачать валидный PDF: Content-Type={asset.content_type}")
+                return None
+        return asset
+
+    async def _remember_file_id(self, url: str, sha256: Optional[str], message) -> None:
+        """Сохраняет file_id только что отправленного фото/документа для повторных отправок."""
+        try:
+            if getattr(message, 'photo', None):
+                file_id = message.photo[-1].file_id
+            elif getattr(message, 'document', None):
+                file_id = message.document.file_id
+            else:
+                return
+            await self.media_cache.put(url, sha256, file_id)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить file_id для {url}: {e}")
+
+    async def _preupload_media(self) -> None:
+        """Заранее загружает логотип и чек-лист в Telegram, чтобы /start отправлял их по file_id.
+
+        Файлы отправляются в служебный чат и сразу удаляются из него: file_id при этом
+        остаётся действительным. Если содержимое не изменилось (тот же хэш), загрузки нет.
+        """
+        chat_id = Config.MEDIA_CACHE_CHAT_ID or Config.WORKING_CHAT_ID
+        if not chat_id:
+            return
+        bot = self.application.bot
+        assets = [
+            (Config.LOGO_IMAGE_URL, False),
+            (getattr(Config, 'CHECKLIST_URL', None), True),
+        ]
+        for url, is_document in assets:
+            if not url:
+                continue
+            try:
+                asset = await self._fetch_media(url, expect_pdf=is_document)
+                if not asset:
+                    continue
+                if self.media_cache.get(url, asset.sha256):
+                    logger.info(f"Media cache: {url} уже загружен в Telegram")
+                    continue
+                with asset.open() as media:
+                    if is_document:
+                        message = await bot.send_document(
+                            chat_id=chat_id, document=media, filename=CHECKLIST_FILENAME, disable_notification=True
+                        )
+                    else:
+                        message = await bot.send_photo(chat_id=chat_id, photo=media, disable_notification=True)
+                await self._remember_file_id(url, asset.sha256, message)
+                logger.info(f"Media cache: {url} предзагружен в Telegram")
+                try:
+                    await bot.delete_message(chat_id=chat_id, message_id=message.message_id)
+                except Exception:
+                    pass
+            except Exception as e:
+                logger.warning(f"Media cache: не удалось предзагрузить {url}: {e}")
+
+    @logged_update
+    @timed_handler
+    @pins_user_data
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start - показывает стартовое меню и отправляет чек-лист"""
-        logger.info("🚀 Команда /start вызвана!")
+        logger.debug("🚀 Команда /start вызвана!")
         user_id = update.effective_user.id if update.effective_user else None
-        self.user_states[user_id] = "start"
+        context.user_data['state'] = "start"
         # Добавляем пользователя в подписчики (для рассылки)
-        try:
-            self.openai_client.add_subscriber(update.effective_chat.id)
-        except Exception:
-            pass
+        await self._ensure_subscribed(update, context, force=True)
 
         # 1) Баннер
         try:
@@ -189,17 +352,25 @@ class SynaplinkBot:
 
         # 4) Сразу начинаем диалог — ассистент первым
         try:
-            self.user_states[user_id] = "chatting"
+            context.user_data['state'] = "chatting"
             initial_message = (
                 "Начни общение как вежливый консультант FriendEvent. Веди себя естественно как человек, "
                 "опираясь на свою базу знаний. Поздоровайся, узнай контекст и потребности. Когда появится готовность, "
                 "оформи финальный блок заявки по шаблону с контактами."
             )
-            assistant_reply = await asyncio.to_thread(self.openai_client.send_message, user_id, initial_message)
-            if update.message:
-                await update.message.reply_text(self._strip_markdown(assistant_reply))
-            elif update.callback_query and update.callback_query.message:
-                await update.callback_query.message.reply_text(self._strip_markdown(assistant_reply))
+
+            async def greet(text: str) -> None:
+                assistant_reply = await self.openai_client.send_message(user_id, text)
+                if update.message:
+                    await update.message.reply_text(assistant_reply)
+                elif update.callback_query and update.callback_query.message:
+                    await update.callback_query.message.reply_text(assistant_reply)
+
+            # Если ассистент уже отвечает этому пользователю, второй ран в thread не запускаем
+            if self.turn_queue.is_active(user_id):
+                logger.info(f"Ран пользователя {user_id} уже активен — приветствие ассистента пропущено")
+            else:
+                await self.turn_queue.submit(user_id, initial_message, greet)
         except Exception as e:
             logger.error(f"Ошибка старта первичного сообщения ассистента: {e}")
     
@@ -209,23 +380,27 @@ class SynaplinkBot:
             logger.info(f"🖼️ Попытка отправить логотип: {Config.LOGO_IMAGE_URL}")
             welcome_caption = "Спасибо, что проявили интерес к FriendEvent!"
 
-            if Config.LOGO_IMAGE_URL.startswith('http'):
-                # Если это URL, загружаем изображение
-                logger.info("📥 Загрузка логотипа по URL")
-                response = requests.get(self._gdrive_to_direct(Config.LOGO_IMAGE_URL))
-                if response.status_code == 200:
-                    photo = BytesIO(response.content)
-                    await update.message.reply_photo(photo=photo, caption=welcome_caption)
-                    logger.info("✅ Логотип отправлен по URL")
-                else:
-                    logger.warning(f"⚠️ Ошибка загрузки логотипа: {response.status_code}")
-                    await update.message.reply_text("🏢 FriendEvent")
+            # Логотип уже загружен в Telegram — отправляем по file_id
+            file_id = self.media_cache.get(Config.LOGO_IMAGE_URL)
+            if file_id:
+                try:
+                    await update.message.reply_photo(photo=file_id, caption=welcome_caption)
+                    logger.info("✅ Логотип отправлен по file_id")
+                    return
+                except Exception as e:
+                    logger.warning(f"file_id логотипа больше не действителен: {e}")
+                    await self.media_cache.invalidate(Config.LOGO_IMAGE_URL)
+
+            # Иначе загружаем по URL или из файла
+            logger.info("📥 Загрузка логотипа")
+            asset = await self._fetch_media(Config.LOGO_IMAGE_URL)
+            if asset:
+                with asset.open() as photo:
+                    message = await update.message.reply_photo(photo=photo, caption=welcome_caption)
+                await self._remember_file_id(Config.LOGO_IMAGE_URL, asset.sha256, message)
+                logger.info("✅ Логотип отправлен")
             else:
-                # Если это путь к файлу
-                logger.info("📁 Загрузка логотипа из файла")
-                with open(Config.LOGO_IMAGE_URL, 'rb') as photo:
-                    await update.message.reply_photo(photo=photo, caption=welcome_caption)
-                logger.info("✅ Логотип отправлен из файла")
+                await update.message.reply_text("🏢 FriendEvent")
         except Exception as e:
             logger.error(f"❌ Ошибка при отправке логотипа: {e}")
             await update.message.reply_text("🏢 FriendEvent")
@@ -248,14 +423,15 @@ class SynaplinkBot:
             logger.warning(f'Не удалось проверить подписку пользователя {user_id}: {e}')
             return False
 
+    @logged_update
+    @timed_handler
+    @pins_user_data
     async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик нажатий на inline кнопки"""
-        logger.info("🔘 button_callback вызван!")
         query = update.callback_query
-        logger.info(f"🔘 CallbackQuery получен: {query.data}")
         await query.answer()
         user_id = query.from_user.id
-        logger.info(f"🔘 Обработка кнопки: {query.data} от пользователя {user_id}")
+        logger.debug(f"🔘 Обработка кнопки: {query.data} от пользователя {user_id}")
         if query.data == "start_chat":
             # Больше не проверяем подписку — сразу начинаем диалог
             logger.info(f"✅ Запуск диалога для пользователя {user_id}")
@@ -270,13 +446,18 @@ class SynaplinkBot:
         """Начинает диалог с ассистентом"""
         user_id = query.from_user.id
         # Меняем состояние пользователя
-        self.user_states[user_id] = "chatting"
+        context.user_data['state'] = "chatting"
         # Больше не показываем никаких кнопок
         reply_markup = None
         # Отправляем служебный стартовый сигнал ассистенту
         try:
             initial_message = "Начни диалог от имени FriendEvent: представься, попроси имя и цель."
-            _ = await asyncio.to_thread(self.openai_client.send_message, user_id, initial_message)
+
+            async def prime(text: str) -> None:
+                _ = await self.openai_client.send_message(user_id, text)
+
+            if not self.turn_queue.is_active(user_id):
+                await self.turn_queue.submit(user_id, initial_message, prime)
             # Обновлённое приветственное сообщение без упоминания подписки
             welcome_message = (
                 "Я готов помочь с вашим событием: подскажем формат, площадку и смету. "
@@ -296,76 +477,120 @@ class SynaplinkBot:
         user_id = query.from_user.id
         
         # Сбрасываем разговор в OpenAI
-        self.openai_client.reset_conversation(user_id)
+        await self.openai_client.reset_conversation(user_id)
         
         # Возвращаемся к стартовому меню
-        self.user_states[user_id] = "start"
+        context.user_data['state'] = "start"
         
         await query.edit_message_text(
             "🔄 Разговор сброшен!\n\n"
             "Нажмите /start для начала нового диалога."
         )
     
+    @logged_update
+    @timed_handler
+    @pins_user_data
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик текстовых сообщений от пользователя"""
-        logger.info("📩 handle_message вызван!")
         user_id = update.effective_user.id if update.effective_user else None
         message_text = update.message.text if update.message else None
-        logger.info(f"Пользователь: {user_id}, текст: {message_text}")
+        log_payload(logger, f"Сообщение пользователя {user_id}", message_text)
 
-        # Если состояние отсутствует или не 'chatting' (серверлесс среда может терять память),
-        # автоматически переводим пользователя в режим общения
-        if user_id not in self.user_states or self.user_states[user_id] != "chatting":
-            self.user_states[user_id] = "chatting"
-            # Добавляем пользователя в подписчики
-            try:
-                self.openai_client.add_subscriber(update.effective_chat.id)
-            except Exception:
-                pass
+        # Пишущий без /start пользователь сразу переводится в режим общения;
+        # состояние хранится в persistence и переживает перезапуск
+        if context.user_data.get('state') != "chatting":
+            context.user_data['state'] = "chatting"
+        await self._ensure_subscribed(update, context)
+
+        # Отправляем сообщение ассистенту OpenAI; пока идёт ран, новые сообщения
+        # пользователя копятся и уходят одним ходом после него
+        await self.turn_queue.submit(
+            user_id, message_text, lambda text: self._answer(update, context, user_id, text)
+        )
+
+    async def _ensure_subscribed(self, update: Update, context: ContextTypes.DEFAULT_TYPE, force: bool = False) -> None:
+        """Добавляет чат в подписчики; повторные SADD отсекает фильтр OpenAIClient.add_subscriber (кроме force)."""
+        if not update.effective_chat:
+            return
+        # Отметка в user_data не сбрасывалась при удалении чата из подписчиков
+        context.user_data.pop('subscribed', None)
+        await self.openai_client.add_subscriber(update.effective_chat.id, force=force)
 
-        # Отправляем сообщение ассистенту OpenAI
+    async def _answer(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, message_text: str):
+        """Отправляет текст ассистенту и доставляет ответ пользователю (один ход диалога)"""
         try:
-            if update.message:
-                await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-            response = await asyncio.to_thread(self.openai_client.send_message, user_id, message_text)
-            logger.info(f"Diag: thread_id={self.openai_client.get_thread_id(user_id)}")
-            logger.info(f"Ответ ассистента: {response}")
-            # Проверяем, содержит ли ответ ассистента финальный блок заявки
-            is_final = self._contains_final_application(response)
-            logger.info(f"Результат проверки финального блока: {is_final}")
-            if is_final:
-                logger.info("Пробую отправить заявку в рабочий чат...")
-                await self._send_application_to_working_chat(context, response, user_id)
-                if update.message:
-                    await update.message.reply_text(self._strip_markdown(response))
+            placeholder = None
+            shown_text = ""
+            if Config.STREAM_REPLIES and update.message:
+                with stage('openai'):
+                    placeholder, shown_text, response = await self._stream_assistant_reply(update, user_id, message_text)
             else:
                 if update.message:
+                    with stage('typing'):
+                        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+                with stage('openai'):
+                    response = await self.openai_client.send_message(user_id, message_text)
+            logger.debug(f"Diag: thread_id={self.openai_client.get_thread_id(user_id)}")
+            log_payload(logger, "Ответ ассистента", response)
+            # Ответ уже очищен от разметки в OpenAIClient (text_pipeline);
+            # финальный блок заявки разбирается за один проход
+            lead = parse_lead(response)
+            if lead is not None and lead.is_complete:
+                logger.info("✅ Найден финальный блок заявки, отправляю в рабочий чат...")
+                LEADS.labels('detected').inc()
+                with stage('lead'):
+                    await self._send_application_to_working_chat(context, lead, user_id)
+            elif lead is not None:
+                logger.info(f"❌ Блок заявки неполный, нет полей: {', '.join(lead.missing)}")
+            with stage('reply'):
+                if placeholder is not None:
+                    await self._finish_streamed_reply(update, placeholder, shown_text, response)
+                elif update.message:
                     await update.message.reply_text(response)
         except Exception as e:
+            ERRORS.labels('answer').inc()
             logger.error(f"Ошибка при обработке сообщения: {e}")
             if update.message:
                 await update.message.reply_text(
                     "Извините, произошла ошибка. Попробуйте позже или используйте /reset для сброса."
                 )
-    
 
-    
-    def _contains_final_application(self, text: str) -> bool:
-        """Проверяет, содержит ли текст финальный блок заявки по шаблону"""
-        logger.info(f"Проверка на финальный блок. Текст ассистента:\n{text}")
-        if not text:
-            logger.info("❌ Текст пустой — не заявка")
-            return False
-        if "[Заявка в рабочий чат]" not in text:
-            logger.info("❌ Нет заголовка [Заявка в рабочий чат] — не заявка")
-            return False
-        required_fields = ["Имя:", "Телефон:", "Телеграм:", "Запрос:"]
-        for field in required_fields:
-            if field not in text:
-                logger.info(f"❌ Нет поля {field} — не заявка")
-                return False
-        logger.info("✅ Найден валидный финальный блок заявки!")
-        return True
+    async def _stream_assistant_reply(self, update: Update, user_id: int, message_text: str):
+        """Показывает ответ ассистента по мере генерации, редактируя сообщение-заглушку.
+
+        Правки отправляются не чаще Config.STREAM_EDIT_INTERVAL секунд, чтобы не упираться
+        в лимиты Telegram на редактирование.
+        Возвращает (заглушка, последний показанный текст, итоговый ответ).
+        """
+        placeholder = await update.message.reply_text("…")
+        shown = {"text": "", "at": 0.0}
+
+        async def on_partial(text: str) -> None:
+            now = time.monotonic()
+            if not text or text == shown["text"] or now - shown["at"] < Config.STREAM_EDIT_INTERVAL:
+                return
+            shown["at"] = now
+            try:
+                await placeholder.edit_text(text[:TELEGRAM_MESSAGE_LIMIT])
+                shown["text"] = text
+            except Exception as e:
+                logger.warning(f"Не удалось обновить сообщение при стриминге: {e}")
+
+        response = await self.openai_client.send_message_stream(user_id, message_text, on_partial)
+        return placeholder, shown["text"], response
+
+    async def _finish_streamed_reply(self, update: Update, placeholder, shown_text: str, text: str) -> None:
+        """Заменяет заглушку итоговым текстом; остаток длинного ответа досылает отдельными сообщениями."""
+        head, rest = text[:TELEGRAM_MESSAGE_LIMIT], text[TELEGRAM_MESSAGE_LIMIT:]
+        if head and head != shown_text:
+            try:
+                await placeholder.edit_text(head)
+            except Exception as e:
+                logger.warning(f"Не удалось завершить стриминг правкой, отправляем новым сообщением: {e}")
+                await update.message.reply_text(head)
+        while rest:
+            await update.message.reply_text(rest[:TELEGRAM_MESSAGE_LIMIT])
+            rest = rest[TELEGRAM_MESSAGE_LIMIT:]
     
 
     
@@ -374,71 +599,51 @@ class SynaplinkBot:
         from datetime import datetime
         return datetime.now().strftime("%d.%m.%Y %H:%M:%S")
     
-    async def _send_application_to_working_chat(self, context: ContextTypes.DEFAULT_TYPE, application_text: str, user_id: int):
-        """Отправляет заявку в рабочий чат"""
+    async def _send_application_to_working_chat(self, context: ContextTypes.DEFAULT_TYPE, lead: Lead, user_id: int):
+        """Отправляет заявку в рабочий чат и ставит её в очередь записи в Google Sheets"""
         try:
-            # Просто пересылаем блок заявки без изменений
-            working_chat_message = (
-                f"🚨 НОВАЯ ЗАЯВКА ОТ ПОЛЬЗОВАТЕЛЯ {user_id}\n\n"
-                f"{application_text}"
-            )
-            
-            # Отправляем в рабочий чат
             await context.bot.send_message(
                 chat_id=Config.WORKING_CHAT_ID,
-                text=working_chat_message
+                text=format_lead_for_working_chat(lead, user_id)
             )
-            
+            LEADS.labels('working_chat').inc()
             logger.info(f"Заявка от пользователя {user_id} отправлена в рабочий чат {Config.WORKING_CHAT_ID}")
-
-            # Пишем в Google Sheets (порядок колонок: Имя, Телефон, Телеграм, Запрос)
-            try:
-                name = self._extract_field(application_text, 'Имя:')
-                phone = self._extract_field(application_text, 'Телефон:')
-                tg = self._extract_field(application_text, 'Телеграм:')
-                req = self._extract_field(application_text, 'Запрос:')
-                _ = append_lead_row([name, phone, tg, req])
-            except Exception as e:
-                logger.warning(f"Sheets: не удалось записать лид: {e}")
-            
         except Exception as e:
+            ERRORS.labels('working_chat').inc()
             logger.error(f"Ошибка при отправке заявки в рабочий чат: {e}")
-            # Пытаемся отправить простой текст в случае ошибки
-            try:
-                simple_message = f"🚨 НОВАЯ ЗАЯВКА ОТ ПОЛЬЗОВАТЕЛЯ {user_id}\n\n{application_text}"
-                await context.bot.send_message(
-                    chat_id=Config.WORKING_CHAT_ID,
-                    text=simple_message
-                )
-                logger.info(f"Заявка отправлена простым текстом")
-            except Exception as e2:
-                logger.error(f"Критическая ошибка при отправке заявки: {e2}")
 
-    def _extract_field(self, text: str, marker: str) -> str:
+        # Пишем в Google Sheets независимо от рабочего чата
         try:
-            # Берём часть после маркера до конца строки
-            if marker in text:
-                part = text.split(marker, 1)[1]
-                return part.split('\n', 1)[0].strip()
-        except Exception:
-            pass
-        return ''
+            row = lead.sheet_row()
+            if self.lead_outbox:
+                # Быстрая локальная запись; в Sheets лид уйдёт из фонового воркера
+                await self.lead_outbox.put(row)
+            else:
+                _ = append_lead_row(row)
+        except Exception as e:
+            logger.warning(f"Sheets: не удалось записать лид: {e}")
     
+    @logged_update
+    @timed_handler
+    @pins_user_data
     async def reset_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /reset - сбрасывает разговор"""
         user_id = update.effective_user.id
         
         # Сбрасываем разговор в OpenAI
-        self.openai_client.reset_conversation(user_id)
+        await self.openai_client.reset_conversation(user_id)
         
         # Сбрасываем состояние пользователя
-        self.user_states[user_id] = "start"
+        context.user_data['state'] = "start"
         
         await update.message.reply_text(
             "🔄 Разговор сброшен!\n\n"
             "Используйте /start для начала нового диалога."
         )
 
+    @logged_update
+    @timed_handler
+    @pins_user_data
     async def broadcast_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Админ-команда для массовой рассылки: /broadcast текст"""
         user_id = update.effective_user.id if update.effective_user else 0
@@ -449,17 +654,20 @@ class SynaplinkBot:
         if not text:
             await update.message.reply_text("Использование: /broadcast текст сообщения")
             return
-        subs = self.openai_client.get_all_subscribers()
-        sent = 0
-        failed = 0
-        for chat_id in subs:
-            try:
-                await context.bot.send_message(chat_id=int(chat_id), text=text)
-                sent += 1
-                await asyncio.sleep(0.06)
-            except Exception:
-                failed += 1
-        await update.message.reply_text(f"Отправлено: {sent}, ошибок: {failed}")
+        total = await self.openai_client.count_subscribers()
+        broadcaster = Broadcaster(context.bot, prune=self.openai_client.prune_subscribers)
+        await update.message.reply_text(f"Рассылка запущена: получателей {total if total is not None else '?'}")
+
+        async def run_broadcast():
+            # Подписчики читаются страницами SSCAN параллельно с отправкой
+            stats = await broadcaster.run(self.openai_client.aiter_subscribers(), text, total=total)
+            await update.message.reply_text(
+                f"Отправлено: {stats.sent}, ошибок: {stats.failed}, удалено недоступных: {stats.pruned} "
+                f"(за {stats.elapsed:.0f}с, {stats.rate:.1f} msg/s)"
+            )
+
+        # Рассылка идёт в фоне, чтобы не блокировать обработку других апдейтов
+        context.application.create_task(run_broadcast(), update=update)
     
     def run(self):
         """Запускает бота"""
@@ -506,6 +714,9 @@ class SynaplinkBot:
             logger.error(f"📡 Ответ сервера: {context.error.response}")
 
 if __name__ == "__main__":
+    # Логирование настраивается при запуске, а не при импорте модуля (как в run_bot.py)
+    from logging_setup import setup_logging
+    setup_logging()
     # Создаем и запускаем бота
     bot = SynaplinkBot()
     bot.run()
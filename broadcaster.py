@@ -0,0 +1,306 @@
+"""
+Движок массовой рассылки
+Отправляет сообщения подписчикам параллельно, соблюдая лимиты Telegram
+"""
+
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from typing import AsyncIterable, Awaitable, Callable, Dict, Iterable, List, Optional, Union
+
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from config import Config
+from metrics import BROADCAST_DELIVERIES
+
+logger = logging.getLogger(__name__)
+
+# Минимальный интервал между сообщениями в один чат (лимит Telegram ~1 msg/s на чат)
+PER_CHAT_INTERVAL = 1.0
+# Сколько раз повторяем отправку в один чат при 429 и сетевых ошибках
+MAX_ATTEMPTS = 3
+# Недоступные чаты удаляются из подписчиков пачками такого размера
+PRUNE_BATCH = 100
+# При таком числе записей о последней отправке из них убираются устаревшие
+LAST_SENT_SWEEP_SIZE = 1024
+
+
+class TokenBucket:
+    """Глобальный лимит скорости: не больше rate отправок в секунду с запасом capacity."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def drain(self) -> None:
+        """Обнуляет запас токенов (после 429 не отправляем «накопленную» пачку разом)."""
+        self._tokens = 0
+        self._updated = time.monotonic()
+
+
+class BroadcastStats:
+    """Прогресс рассылки: счётчики, скорость и оценка оставшегося времени."""
+
+    def __init__(self, total: Optional[int] = None):
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.pruned = 0
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def rate(self) -> float:
+        """Доставок в секунду."""
+        elapsed = self.elapsed
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        """Оценка оставшегося времени в секундах (None, если неизвестно)."""
+        if self.finished_at is not None:
+            return 0.0
+        if self.total is None or self.rate <= 0:
+            return None
+        return max(self.total - self.done, 0) / self.rate
+
+    def as_dict(self) -> dict:
+        eta = self.eta
+        return {
+            "total": self.total,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "pruned": self.pruned,
+            "elapsed_sec": round(self.elapsed, 1),
+            "rate_per_sec": round(self.rate, 2),
+            "eta_sec": round(eta, 1) if eta is not None else None,
+            "finished": self.finished_at is not None,
+        }
+
+    def summary(self) -> str:
+        eta = self.eta
+        eta_text = f"{eta:.0f}с" if eta is not None else "?"
+        total = self.total if self.total is not None else "?"
+        return (
+            f"{self.done}/{total}: отправлено {self.sent}, ошибок {self.failed}, "
+            f"{self.rate:.1f} msg/s, осталось ~{eta_text}"
+        )
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    value = error.retry_after
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class Broadcaster:
+    """Параллельная рассылка с глобальным token bucket и общей паузой по 429.
+
+    Несколько отправителей берут получателей из общей очереди. Если Telegram
+    отвечает 429 с retry_after, пауза применяется ко всем отправителям сразу,
+    а не к одному чату. Чаты, где бот заблокирован или которых больше нет,
+    передаются в prune пачками, чтобы следующие рассылки их не касались.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        rate: Optional[float] = None,
+        concurrency: Optional[int] = None,
+        progress_interval: float = 10.0,
+        prune: Optional[Callable[[List[int]], Awaitable[int]]] = None,
+    ):
+        self.bot = bot
+        self.prune = prune
+        self._dead: List[int] = []
+        self.bucket = TokenBucket(rate or Config.BROADCAST_RATE)
+        self.concurrency = concurrency or Config.BROADCAST_CONCURRENCY
+        self.progress_interval = progress_interval
+        self._paused_until = 0.0
+        self._last_sent: Dict[int, float] = {}
+        self._sweep_at = LAST_SENT_SWEEP_SIZE
+
+    async def run(
+        self,
+        chat_ids: Union[Iterable, AsyncIterable],
+        text: str,
+        total: Optional[int] = None,
+        stats: Optional[BroadcastStats] = None,
+        on_progress: Optional[Callable[[BroadcastStats], None]] = None,
+    ) -> BroadcastStats:
+        """
+        Рассылает text всем получателям из chat_ids
+
+        Args:
+            chat_ids: Итерируемый (в т.ч. асинхронно) набор chat_id
+            text: Текст сообщения
+            total: Общее число получателей, если известно (для ETA)
+            stats: Объект прогресса, который нужно обновлять (для опроса извне)
+            on_progress: Вызывается с текущей статистикой каждые progress_interval секунд
+
+        Returns:
+            BroadcastStats: Итоговая статистика рассылки
+        """
+        stats = stats or BroadcastStats(total)
+        if stats.total is None:
+            stats.total = total
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 4)
+
+        # SSCAN может вернуть элемент повторно (особенно при SREM во время обхода):
+        # каждому чату отправляем один раз
+        seen = set()
+
+        async def put(chat_id):
+            chat_id = int(chat_id)
+            if chat_id in seen:
+                return
+            seen.add(chat_id)
+            await queue.put(chat_id)
+
+        async def produce():
+            if hasattr(chat_ids, '__aiter__'):
+                async for chat_id in chat_ids:
+                    await put(chat_id)
+            else:
+                for chat_id in chat_ids:
+                    await put(chat_id)
+
+        async def consume():
+            while True:
+                chat_id = await queue.get()
+                try:
+                    if await self._deliver(chat_id, text, stats):
+                        stats.sent += 1
+                        BROADCAST_DELIVERIES.labels('sent').inc()
+                    else:
+                        stats.failed += 1
+                        BROADCAST_DELIVERIES.labels('failed').inc()
+                        if len(self._dead) >= PRUNE_BATCH:
+                            await self._flush_dead(stats)
+                finally:
+                    queue.task_done()
+
+        async def report():
+            while True:
+                await asyncio.sleep(self.progress_interval)
+                logger.info(f"📣 Рассылка: {stats.summary()}")
+                if on_progress:
+                    on_progress(stats)
+
+        workers = [asyncio.create_task(consume()) for _ in range(self.concurrency)]
+        reporter = asyncio.create_task(report())
+        try:
+            await produce()
+            await queue.join()
+        finally:
+            for task in workers + [reporter]:
+                task.cancel()
+            await asyncio.gather(*workers, reporter, return_exceptions=True)
+            await self._flush_dead(stats)
+            stats.finished_at = time.monotonic()
+        logger.info(f"📣 Рассылка завершена: {stats.summary()}")
+        if on_progress:
+            on_progress(stats)
+        return stats
+
+    async def _deliver(self, chat_id: int, text: str, stats: BroadcastStats) -> bool:
+        """Отправляет одно сообщение с учётом лимитов; True при успехе."""
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            await self._wait_turn(chat_id)
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                return True
+            except RetryAfter as e:
+                # Пауза для всех отправителей: лимит у Telegram общий на бота
+                delay = _retry_after_seconds(e) + 0.5
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                self.bucket.drain()
+                stats.retries += 1
+                BROADCAST_DELIVERIES.labels('retry_after').inc()
+                logger.warning(f"📣 Рассылка: 429 от Telegram, пауза {delay:.1f}с для всех отправителей")
+            except Forbidden as e:
+                # Бот заблокирован или удалён из чата — повтор не поможет
+                logger.debug(f"📣 Рассылка: чат {chat_id} недоступен: {e}")
+                self._dead.append(chat_id)
+                return False
+            except BadRequest as e:
+                logger.debug(f"📣 Рассылка: чат {chat_id} отклонил сообщение: {e}")
+                if 'chat not found' in str(e).lower():
+                    self._dead.append(chat_id)
+                return False
+            except NetworkError as e:
+                stats.retries += 1
+                logger.warning(f"📣 Рассылка: сетевая ошибка для {chat_id} (попытка {attempt}): {e}")
+                await asyncio.sleep(attempt)
+            except Exception as e:
+                logger.warning(f"📣 Рассылка: ошибка отправки в {chat_id}: {e}")
+                return False
+        return False
+
+    async def _flush_dead(self, stats: BroadcastStats) -> None:
+        """Удаляет накопленные недоступные чаты из подписчиков одним вызовом prune."""
+        if not self._dead:
+            return
+        batch, self._dead = self._dead, []
+        if not self.prune:
+            return
+        try:
+            pruned = await self.prune(batch)
+            stats.pruned += pruned
+            BROADCAST_DELIVERIES.labels('pruned').inc(pruned)
+        except Exception as e:
+            logger.warning(f"📣 Рассылка: не удалось удалить недоступные чаты: {e}")
+
+    async def _wait_turn(self, chat_id: int) -> None:
+        """Ждёт окончания общей паузы, лимита на чат и свободного токена."""
+        while True:
+            delay = self._paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            last = self._last_sent.get(chat_id)
+            if last is not None:
+                delay = last + PER_CHAT_INTERVAL - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await self.bucket.acquire()
+            # Пока ждали чат или токен, другой отправитель мог получить 429:
+            # тогда токен пропадает, и ждём паузу вместе со всеми
+            if self._paused_until <= time.monotonic():
+                break
+        self._last_sent[chat_id] = time.monotonic()
+        if len(self._last_sent) >= self._sweep_at:
+            self._forget_idle_chats()
+
+    def _forget_idle_chats(self) -> None:
+        """Убирает чаты, лимит на которые уже истёк: иначе словарь растёт на всю рассылку."""
+        cutoff = time.monotonic() - PER_CHAT_INTERVAL
+        self._last_sent = {chat_id: at for chat_id, at in self._last_sent.items() if at > cutoff}
+        self._sweep_at = max(LAST_SENT_SWEEP_SIZE, 2 * len(self._last_sent))
@@ -14,10 +14,18 @@ class Config:
 	
 	# Telegram Bot Token
 	TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+
+	# Размер пула HTTP-соединений к Telegram Bot API (переиспользуется между апдейтами)
+	TELEGRAM_POOL_SIZE = int(os.getenv('TELEGRAM_POOL_SIZE', '64'))
+	# Адрес Bot API без /bot<token> (опционально: локальный Bot API сервер или эмулятор в бенчмарках)
+	TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL')
 	
 	# OpenAI API Key
 	OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
+	# Адрес OpenAI API (опционально: прокси или эмулятор Assistants API в бенчмарках)
+	OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')
+
 	# OpenAI Organization ID (опционально)
 	OPENAI_ORG_ID = os.getenv('OPENAI_ORG_ID')
 
@@ -26,6 +34,14 @@ class Config:
 	
 	# OpenAI Assistant ID
 	OPENAI_ASSISTANT_ID = os.getenv('OPENAI_ASSISTANT_ID')
+
+	# Время жизни кэша метаданных ассистента (секунды)
+	ASSISTANT_META_TTL = float(os.getenv('ASSISTANT_META_TTL', '3600'))
+
+	# Стриминг ответов ассистента: заглушка в чате редактируется по мере генерации
+	STREAM_REPLIES = os.getenv('STREAM_REPLIES', 'false').lower() in ('1', 'true', 'yes')
+	# Минимальный интервал между правками сообщения при стриминге (секунды)
+	STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))
 	
 	# Telegram Channel Link
 	TELEGRAM_CHANNEL_LINK = os.getenv('TELEGRAM_CHANNEL_LINK')
@@ -39,19 +55,87 @@ class Config:
 	# Checklist file URL (PDF)
 	CHECKLIST_URL = os.getenv('CHECKLIST_URL')
 
+	# Кэш file_id медиа: чат для предзагрузки (по умолчанию рабочий), ключ Redis и файл без Redis
+	MEDIA_CACHE_CHAT_ID = os.getenv('MEDIA_CACHE_CHAT_ID')
+	MEDIA_CACHE_KEY = os.getenv('MEDIA_CACHE_KEY', 'b2bbot:media:file_ids')
+	MEDIA_CACHE_PATH = os.getenv('MEDIA_CACHE_PATH', 'data/media_file_ids.json')
+	# Таймаут скачивания логотипа/чек-листа (секунды)
+	MEDIA_DOWNLOAD_TIMEOUT = float(os.getenv('MEDIA_DOWNLOAD_TIMEOUT', '15'))
+	# Дисковый кэш скачанных медиа и интервал повторной проверки через ETag (секунды)
+	ASSET_CACHE_DIR = os.getenv('ASSET_CACHE_DIR', 'data/assets')
+	ASSET_CACHE_MAX_AGE = float(os.getenv('ASSET_CACHE_MAX_AGE', '300'))
+
+	# Логирование: уровень, формат ('text' или 'json'), файл с ротацией по размеру ('' — только консоль)
+	LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+	LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+	LOG_FILE = os.getenv('LOG_FILE', 'logs/bot.log')
+	LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+	LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+	# Тексты пользователей и ответы ассистента в логе: доля апдейтов (0..1) и максимум символов (0 — без обрезки)
+	LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '1.0'))
+	LOG_PAYLOAD_MAX_CHARS = int(os.getenv('LOG_PAYLOAD_MAX_CHARS', '500'))
+
+	# Порт HTTP-сервера метрик Prometheus в режиме polling (в режиме webhook — эндпоинт /metrics)
+	METRICS_PORT = int(os.getenv('METRICS_PORT') or 0) or None
+
 	# Секрет для Telegram Webhook (опционально, для проверки заголовка X-Telegram-Bot-Api-Secret-Token)
 	TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET')
 
+	# Polling: сколько апдейтов обрабатывается одновременно (апдейты одного чата — по порядку)
+	POLLING_CONCURRENCY = int(os.getenv('POLLING_CONCURRENCY', '32'))
+
+	# Фоновая обработка апдейтов вебхука: число воркеров, оно же предел одновременно обрабатываемых апдейтов
+	# (0 — обработка внутри HTTP-запроса) и общий размер очереди.
+	# Не включайте на serverless: фоновые задачи там не живут после ответа
+	WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '0'))
+	WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+
+	# Защита от повторной доставки апдейтов: префикс ключей update_id в Redis, их TTL (секунды)
+	# и размер локального буфера последних update_id
+	UPDATE_DEDUP_PREFIX = os.getenv('UPDATE_DEDUP_PREFIX', 'b2bbot:update:')
+	UPDATE_DEDUP_TTL = int(os.getenv('UPDATE_DEDUP_TTL', '900'))
+	UPDATE_DEDUP_LOCAL_SIZE = int(os.getenv('UPDATE_DEDUP_LOCAL_SIZE', '10000'))
+
 	# Redis URL для сохранения thread_id (опционально, рекомендуется для serverless)
 	REDIS_URL = os.getenv('REDIS_URL')
 	REDIS_PREFIX = os.getenv('REDIS_PREFIX', 'b2bbot:thread:')
+	# Максимум соединений в общем пуле redis.asyncio на процесс
+	REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', '50'))
+	# Срок хранения thread_id в Redis (секунды, продлевается при каждом чтении)
+	THREAD_TTL = int(os.getenv('THREAD_TTL', str(7 * 24 * 3600)))
+	# Локальный кэш thread_id: максимум записей и срок жизни записи (секунды)
+	THREAD_CACHE_SIZE = int(os.getenv('THREAD_CACHE_SIZE', '10000'))
+	THREAD_CACHE_TTL = float(os.getenv('THREAD_CACHE_TTL', '3600'))
+
+	# Lease пользователя в Redis на время хода диалога (несколько воркеров/узлов): префикс ключей,
+	# срок lease (секунды, продлевается в фоне; 0 — без блокировки) и максимальное ожидание
+	USER_LOCK_PREFIX = os.getenv('USER_LOCK_PREFIX', 'b2bbot:lock:user:')
+	USER_LOCK_TTL = float(os.getenv('USER_LOCK_TTL', '30'))
+	USER_LOCK_WAIT = float(os.getenv('USER_LOCK_WAIT', '120'))
+
+	# Состояние пользователей (user_data) в Redis: префикс ключей и срок хранения (секунды)
+	USER_STATE_PREFIX = os.getenv('USER_STATE_PREFIX', 'b2bbot:user:')
+	USER_STATE_TTL = int(os.getenv('USER_STATE_TTL', str(30 * 24 * 3600)))
+	# Размер и срок жизни (секунды) in-process кэша состояний, интервал пакетной записи в Redis
+	USER_STATE_CACHE_SIZE = int(os.getenv('USER_STATE_CACHE_SIZE', '10000'))
+	USER_STATE_CACHE_TTL = float(os.getenv('USER_STATE_CACHE_TTL', '600'))
+	USER_STATE_FLUSH_INTERVAL = float(os.getenv('USER_STATE_FLUSH_INTERVAL', '5'))
 
 	# Ключ множества подписчиков для рассылки
 	SUBS_SET_KEY = os.getenv('SUBS_SET_KEY', 'b2bbot:subs')
+	# Локальный фильтр известных подписчиков: максимум записей и срок жизни (секунды).
+	# Фильтр свой у каждого процесса: чат, удалённый из подписчиков в другом воркере,
+	# до истечения TTL снова добавится только через /start
+	SUBS_FILTER_SIZE = int(os.getenv('SUBS_FILTER_SIZE', '200000'))
+	SUBS_FILTER_TTL = float(os.getenv('SUBS_FILTER_TTL', '3600'))
 
 	# Секрет для ручного вызова рассылки через HTTP (защита эндпоинта)
 	BROADCAST_SECRET = os.getenv('BROADCAST_SECRET')
 
+	# Лимиты рассылки: глобальная скорость (сообщений/с) и число параллельных отправок
+	BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '30'))
+	BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '20'))
+
 	# Админы, кому разрешена рассылка через /broadcast (CSV user_id)
 	BROADCAST_ADMIN_IDS = os.getenv('BROADCAST_ADMIN_IDS', '')
 
@@ -60,6 +144,13 @@ class Config:
 	GOOGLE_SHEETS_SHEET_NAME = os.getenv('GOOGLE_SHEETS_SHEET_NAME', 'leads')
 	# JSON сервисного аккаунта как Base64 или как сырая строка
 	GOOGLE_SHEETS_CREDENTIALS = os.getenv('GOOGLE_SHEETS_CREDENTIALS')
+	# Адрес эмулятора Sheets API v4 (только для бенчмарков): строки пишутся туда без авторизации
+	GOOGLE_SHEETS_ENDPOINT = os.getenv('GOOGLE_SHEETS_ENDPOINT')
+	# Пакетная запись лидов: размер пачки и максимальная задержка перед записью (секунды)
+	SHEETS_BATCH_SIZE = int(os.getenv('SHEETS_BATCH_SIZE', '20'))
+	SHEETS_FLUSH_INTERVAL = float(os.getenv('SHEETS_FLUSH_INTERVAL', '5'))
+	# Локальный outbox лидов (SQLite). На serverless укажите путь в /tmp
+	LEAD_OUTBOX_PATH = os.getenv('LEAD_OUTBOX_PATH', 'data/lead_outbox.sqlite3')
 
 	@classmethod
 	def is_admin(cls, user_id: int) -> bool:
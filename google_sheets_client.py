@@ -1,12 +1,15 @@
 import json
+import atexit
 import base64
 import logging
+import threading
 from typing import Optional, List
 
 import gspread  # type: ignore[reportMissingImports]
 from google.oauth2.service_account import Credentials  # type: ignore[reportMissingImports]
 
 from config import Config
+from metrics import ERRORS, SHEETS_APPEND, observe_time
 
 logger = logging.getLogger(__name__)
 
@@ -32,23 +35,153 @@ def _load_credentials_from_env() -> Optional[Credentials]:
         return None
 
 
-def append_lead_row(values: List[str]) -> bool:
-    """Добавляет строку лида в лист. values должны соответствовать порядку колонок.
-    Возвращает True при успехе.
+def sheets_configured() -> bool:
+    """Настроена ли запись в Sheets: креды сервисного аккаунта или адрес эмулятора."""
+    return bool(Config.GOOGLE_SHEETS_CREDENTIALS or Config.GOOGLE_SHEETS_ENDPOINT)
+
+
+class _EmulatorWorksheet:
+    """Лист в эмуляторе Sheets API v4 (GOOGLE_SHEETS_ENDPOINT): тот же values.append, без OAuth."""
+
+    def __init__(self, endpoint: str, spreadsheet_id: str, sheet_name: str):
+        import requests
+
+        self._session = requests.Session()
+        self._url = f"{endpoint.rstrip('/')}/v4/spreadsheets/{spreadsheet_id}/values/{sheet_name}!A1:append"
+
+    def append_rows(self, rows: List[List[str]], value_input_option: str = 'RAW') -> None:
+        response = self._session.post(
+            self._url,
+            params={'valueInputOption': value_input_option},
+            json={'values': rows},
+            timeout=10,
+        )
+        response.raise_for_status()
+
+
+class LeadSheetWriter:
+    """Долгоживущий писатель лидов в Google Sheets.
+
+    Креды, авторизованный клиент gspread (с его access token) и handle листа
+    создаются один раз и переиспользуются. Строки копятся в буфере и уходят
+    одним append_rows, когда набирается batch_size строк или проходит
+    flush_interval секунд — запись идёт в фоновом потоке, а не у вызывающего.
     """
-    try:
-        creds = _load_credentials_from_env()
-        if not creds:
+
+    def __init__(self, batch_size: Optional[int] = None, flush_interval: Optional[float] = None):
+        self.batch_size = batch_size or Config.SHEETS_BATCH_SIZE
+        self.flush_interval = flush_interval or Config.SHEETS_FLUSH_INTERVAL
+        self._buffer: List[List[str]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._creds: Optional[Credentials] = None
+        self._client = None
+        self._worksheet = None
+        self._thread: Optional[threading.Thread] = None
+        # Счётчики для оценки эффекта батчинга
+        self.rows_written = 0
+        self.batches_written = 0
+
+    def append(self, values: List[str]) -> bool:
+        """Ставит строку в буфер. Возвращает False, если запись в Sheets не настроена."""
+        if not sheets_configured():
             logger.warning("Sheets: креды не заданы — пропускаем запись")
             return False
-        client = gspread.authorize(creds)
-        sh = client.open_by_key(Config.GOOGLE_SHEETS_SPREADSHEET_ID)
-        ws = sh.worksheet(Config.GOOGLE_SHEETS_SHEET_NAME)
-        ws.append_row(values, value_input_option='USER_ENTERED')
-        logger.info("Sheets: строка добавлена")
+        with self._lock:
+            self._buffer.append(list(values))
+            full = len(self._buffer) >= self.batch_size
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
         return True
-    except Exception as e:
-        logger.error(f"Sheets: ошибка записи: {e}")
-        return False
 
+    def flush(self) -> bool:
+        """Записывает все накопленные строки одним запросом. True при успехе (или пустом буфере)."""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return True
+            try:
+                self.append_rows(rows)
+                return True
+            except Exception as e:
+                logger.error(f"Sheets: ошибка записи пачки из {len(rows)} строк: {e}")
+                # Возвращаем строки в начало буфера — попробуем в следующий раз
+                with self._lock:
+                    self._buffer = rows + self._buffer
+                return False
 
+    def append_rows(self, rows: List[List[str]]) -> None:
+        """Синхронно пишет строки одним вызовом API (исключение при ошибке)."""
+        try:
+            with observe_time(SHEETS_APPEND):
+                ws = self._get_worksheet()
+                ws.append_rows(rows, value_input_option='USER_ENTERED')
+        except Exception:
+            ERRORS.labels('sheets').inc()
+            # Handle листа мог устареть (переименование, отозванный доступ) — пересоздадим
+            self._worksheet = None
+            raise
+        self.rows_written += len(rows)
+        self.batches_written += 1
+        logger.info(f"Sheets: добавлено строк: {len(rows)}")
+
+    def _get_worksheet(self):
+        if self._worksheet is not None:
+            return self._worksheet
+        if Config.GOOGLE_SHEETS_ENDPOINT:
+            self._worksheet = _EmulatorWorksheet(
+                Config.GOOGLE_SHEETS_ENDPOINT,
+                Config.GOOGLE_SHEETS_SPREADSHEET_ID or 'local',
+                Config.GOOGLE_SHEETS_SHEET_NAME,
+            )
+            return self._worksheet
+        if self._client is None:
+            if self._creds is None:
+                self._creds = _load_credentials_from_env()
+                if not self._creds:
+                    raise RuntimeError("Sheets: креды не заданы или некорректны")
+            self._client = gspread.authorize(self._creds)
+        sh = self._client.open_by_key(Config.GOOGLE_SHEETS_SPREADSHEET_ID)
+        self._worksheet = sh.worksheet(Config.GOOGLE_SHEETS_SHEET_NAME)
+        return self._worksheet
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="sheets-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+_writer: Optional[LeadSheetWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_lead_writer() -> LeadSheetWriter:
+    """Возвращает общий на процесс LeadSheetWriter."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = LeadSheetWriter()
+                # Дописываем остаток буфера при штатном завершении процесса
+                atexit.register(_writer.flush)
+    return _writer
+
+
+def append_lead_row(values: List[str]) -> bool:
+    """Добавляет строку лида в лист. values должны соответствовать порядку колонок.
+    Строка буферизуется и записывается пачкой в фоне; возвращает True, если принята.
+    """
+    return get_lead_writer().append(values)
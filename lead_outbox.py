@@ -0,0 +1,221 @@
+"""
+Надёжная очередь (outbox) лидов для Google Sheets
+Лид сначала сохраняется в локальный SQLite-файл, а фоновый воркер
+переносит его в таблицу с повторами и экспоненциальной паузой
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from config import Config
+from google_sheets_client import get_lead_writer, sheets_configured
+from metrics import LEADS
+
+logger = logging.getLogger(__name__)
+
+# Пауза между повторами записи: RETRY_BASE_DELAY * 2^попытка, но не больше RETRY_MAX_DELAY
+RETRY_BASE_DELAY = 5.0
+RETRY_MAX_DELAY = 600.0
+# На сколько секунд взятая в отправку пачка скрыта от других процессов;
+# если процесс упал до ack/retry_later, записи снова станут доступны
+CLAIM_TIMEOUT = 120.0
+
+
+class LeadOutbox:
+    """Очередь лидов в SQLite: переживает перезапуск процесса и недоступность Sheets.
+
+    Файл могут открывать несколько процессов одного узла (воркеры uvicorn):
+    fetch_due забирает записи атомарно, так что каждый лид отправляет один процесс.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = Path(path or Config.LEAD_OUTBOX_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS leads (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS leads_due ON leads (next_attempt_at)")
+
+    def put(self, values: List[str]) -> int:
+        """Сохраняет строку лида; возвращает id записи."""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO leads (payload, created_at, next_attempt_at) VALUES (?, ?, ?)",
+                (json.dumps(values, ensure_ascii=False), now, now),
+            )
+            return cur.lastrowid
+
+    def fetch_due(self, limit: int) -> List[Tuple[int, List[str], int]]:
+        """
+        Забирает до limit записей, которые пора отправить: (id, значения, попыток)
+
+        Выборка и сдвиг next_attempt_at на CLAIM_TIMEOUT идут в одной транзакции
+        BEGIN IMMEDIATE, поэтому другой процесс с тем же файлом эти записи не получит.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, payload, attempts FROM leads WHERE next_attempt_at <= ? ORDER BY id LIMIT ?",
+                    (now, limit),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE leads SET next_attempt_at = ? WHERE id = ?",
+                    [(now + CLAIM_TIMEOUT, row[0]) for row in rows],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [(row_id, json.loads(payload), attempts) for row_id, payload, attempts in rows]
+
+    def ack(self, ids: List[int]) -> None:
+        """Удаляет успешно записанные лиды."""
+        if not ids:
+            return
+        with self._lock:
+            self._conn.executemany("DELETE FROM leads WHERE id = ?", [(i,) for i in ids])
+
+    def retry_later(self, ids: List[int], attempts: int, error: str) -> float:
+        """Откладывает записи с экспоненциальной паузой; возвращает паузу в секундах."""
+        delay = min(RETRY_BASE_DELAY * (2 ** attempts), RETRY_MAX_DELAY)
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE leads SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                [(time.time() + delay, error[:500], i) for i in ids],
+            )
+        return delay
+
+    def summary(self) -> Tuple[int, Optional[float]]:
+        """Число незаписанных лидов и время создания самого старого (None, если очередь пуста)."""
+        with self._lock:
+            count, oldest = self._conn.execute("SELECT COUNT(*), MIN(created_at) FROM leads").fetchone()
+        return count, oldest
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class LeadOutboxWorker:
+    """Фоновый воркер: переносит лиды из outbox в Google Sheets пачками.
+
+    Запись в Sheets выполняется в пуле потоков, поэтому event loop бота
+    не ждёт ответа Google.
+    """
+
+    def __init__(self, outbox: LeadOutbox, batch_size: Optional[int] = None, poll_interval: float = 5.0):
+        self.outbox = outbox
+        self.batch_size = batch_size or Config.SHEETS_BATCH_SIZE
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # Счётчики для метрик
+        self.delivered = 0
+        self.failures = 0
+        # Глубина очереди по последнему опросу SQLite воркером: сборщик метрик
+        # читает её без запроса к базе и без блокировки outbox в event loop
+        self._depth = 0
+        self._oldest_at: Optional[float] = None
+
+    async def put(self, values: List[str]) -> bool:
+        """Сохраняет лид в outbox и будит воркер. False, если запись в Sheets не настроена."""
+        if not sheets_configured():
+            logger.warning("Sheets: креды не заданы — пропускаем запись")
+            return False
+        await asyncio.to_thread(self.outbox.put, values)
+        self._depth += 1
+        if self._oldest_at is None:
+            self._oldest_at = time.time()
+        self._wakeup.set()
+        return True
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def stats(self) -> dict:
+        """Актуальные счётчики: перед ответом перечитывает глубину очереди из SQLite."""
+        await self._refresh()
+        return self.snapshot()
+
+    def snapshot(self) -> dict:
+        """Счётчики по последнему опросу воркера, без обращения к SQLite (для сборщика метрик)."""
+        oldest_age = max(time.time() - self._oldest_at, 0.0) if self._oldest_at is not None else 0.0
+        return {
+            "depth": self._depth,
+            "oldest_age_sec": round(oldest_age, 1),
+            "delivered": self.delivered,
+            "failures": self.failures,
+        }
+
+    async def _refresh(self) -> None:
+        self._depth, self._oldest_at = await asyncio.to_thread(self.outbox.summary)
+
+    async def _run(self) -> None:
+        logger.info("Outbox: воркер лидов запущен")
+        while True:
+            try:
+                drained = await self._drain_once()
+                await self._refresh()
+            except Exception as e:
+                logger.error(f"Outbox: ошибка воркера: {e}")
+                drained = False
+            if drained:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _drain_once(self) -> bool:
+        """Отправляет одну пачку; True, если пачка была записана (возможно, есть ещё)."""
+        batch = await asyncio.to_thread(self.outbox.fetch_due, self.batch_size)
+        if not batch:
+            return False
+        ids = [row_id for row_id, _, _ in batch]
+        rows = [values for _, values, _ in batch]
+        try:
+            await asyncio.to_thread(get_lead_writer().append_rows, rows)
+        except Exception as e:
+            self.failures += 1
+            attempts = max(attempts for _, _, attempts in batch)
+            delay = await asyncio.to_thread(self.outbox.retry_later, ids, attempts, str(e))
+            logger.warning(f"Outbox: не удалось записать {len(rows)} лидов, повтор через {delay:.0f}с: {e}")
+            return False
+        await asyncio.to_thread(self.outbox.ack, ids)
+        self.delivered += len(rows)
+        LEADS.labels('sheets').inc(len(rows))
+        return True
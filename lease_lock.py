@@ -0,0 +1,197 @@
+"""
+Распределённая блокировка на время хода диалога (lease с fencing token)
+Не даёт двум воркерам или узлам одновременно запускать раны в thread
+одного пользователя. Lease истекает сам, если процесс-владелец пропал, и
+продлевается в фоне, пока ход идёт. Каждый захват получает монотонно
+растущий fencing token: записи, сделанные с устаревшим токеном, отклоняются
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from config import Config
+from metrics import USER_LOCK_WAIT
+
+logger = logging.getLogger(__name__)
+
+# SET NX PX и выдача fencing token одной атомарной операцией: токен получает
+# только тот, кто захватил lease, поэтому следующий владелец всегда получает больший
+_ACQUIRE = """
+if redis.call('set', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    local token = redis.call('incr', KEYS[2])
+    redis.call('pexpire', KEYS[2], ARGV[3])
+    return token
+end
+return 0
+"""
+
+_EXTEND = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Запись значения, только если с момента захвата lease никто другой его не получал
+_FENCED_SET = """
+if redis.call('get', KEYS[2]) == ARGV[1] then
+    redis.call('set', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+# Сколько хранится счётчик fencing token (мс): дольше любого хода диалога
+_FENCE_TTL_MS = 7 * 24 * 3600 * 1000
+
+
+class LeaseTimeout(Exception):
+    """Lease не удалось получить за отведённое время: ход идёт в другом воркере."""
+
+
+class Lease:
+    """Захваченный lease: ключ, случайное значение владельца и fencing token."""
+
+    def __init__(self, key: str, fence_key: str, value: str, token: int, ttl: float):
+        self.key = key
+        self.fence_key = fence_key
+        self.value = value
+        self.token = token
+        self.ttl = ttl
+        self.lost = False
+        self._expires_at = time.monotonic() + ttl
+
+    def renewed(self) -> None:
+        self._expires_at = time.monotonic() + self.ttl
+
+    @property
+    def valid(self) -> bool:
+        """Lease всё ещё наш (по локальным часам и последнему продлению)."""
+        return not self.lost and time.monotonic() < self._expires_at
+
+
+class RedisLeaseLock:
+    """Lease-блокировки по имени ресурса (user_id) в Redis.
+
+    hold() ждёт lease не дольше wait_timeout, продлевает его каждые ttl/3 и
+    освобождает на выходе только если он всё ещё принадлежит этому владельцу.
+    """
+
+    def __init__(
+        self,
+        redis,
+        prefix: Optional[str] = None,
+        ttl: Optional[float] = None,
+        wait_timeout: Optional[float] = None,
+    ):
+        self._redis = redis
+        self.prefix = prefix or Config.USER_LOCK_PREFIX
+        self.ttl = ttl or Config.USER_LOCK_TTL
+        self.wait_timeout = wait_timeout if wait_timeout is not None else Config.USER_LOCK_WAIT
+        self._acquire = redis.register_script(_ACQUIRE)
+        self._extend = redis.register_script(_EXTEND)
+        self._release = redis.register_script(_RELEASE)
+        self._fenced_set = redis.register_script(_FENCED_SET)
+        # Счётчики для метрик
+        self.acquired = 0
+        self.contended = 0
+        self.timeouts = 0
+        self.lost = 0
+        self.fenced_rejects = 0
+
+    def _keys(self, name: str):
+        key = f"{self.prefix}{name}"
+        return key, f"{key}:fence"
+
+    async def acquire(self, name: str) -> Lease:
+        """Ждёт и захватывает lease (LeaseTimeout, если не успели за wait_timeout)."""
+        key, fence_key = self._keys(name)
+        value = uuid.uuid4().hex
+        ttl_ms = int(self.ttl * 1000)
+        started = time.monotonic()
+        delay = 0.05
+        while True:
+            token = await self._acquire(keys=[key, fence_key], args=[value, ttl_ms, _FENCE_TTL_MS])
+            if token:
+                waited = time.monotonic() - started
+                USER_LOCK_WAIT.observe(waited)
+                self.acquired += 1
+                if waited > 0.001:
+                    self.contended += 1
+                return Lease(key, fence_key, value, int(token), self.ttl)
+            if time.monotonic() - started >= self.wait_timeout:
+                self.timeouts += 1
+                raise LeaseTimeout(f"lease {key} занят дольше {self.wait_timeout:.0f}с")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+    async def release(self, lease: Lease) -> None:
+        try:
+            await self._release(keys=[lease.key], args=[lease.value])
+        except Exception as e:
+            # Lease истечёт сам через ttl
+            logger.warning(f"Lease: не удалось освободить {lease.key}: {e}")
+
+    async def _keep_alive(self, lease: Lease) -> None:
+        ttl_ms = int(self.ttl * 1000)
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                if not await self._extend(keys=[lease.key], args=[lease.value, ttl_ms]):
+                    lease.lost = True
+                    self.lost += 1
+                    logger.warning(f"Lease: {lease.key} потерян (истёк или перехвачен другим воркером)")
+                    return
+                lease.renewed()
+            except Exception as e:
+                logger.warning(f"Lease: не удалось продлить {lease.key}: {e}")
+
+    @asynccontextmanager
+    async def keep(self, lease: Lease):
+        """Продлевает уже захваченный lease на время блока и освобождает его на выходе."""
+        keeper = asyncio.create_task(self._keep_alive(lease))
+        try:
+            yield lease
+        finally:
+            keeper.cancel()
+            await self.release(lease)
+
+    @asynccontextmanager
+    async def hold(self, name: str):
+        """Захватывает lease и держит его на время блока."""
+        lease = await self.acquire(name)
+        async with self.keep(lease):
+            yield lease
+
+    async def fenced_set(self, lease: Lease, key: str, value: str, ttl: int) -> bool:
+        """
+        Записывает значение, только если lease не перехватил более новый владелец
+
+        Returns:
+            bool: False если токен устарел и запись отклонена
+        """
+        if await self._fenced_set(keys=[key, lease.fence_key], args=[lease.token, value, ttl]):
+            return True
+        self.fenced_rejects += 1
+        logger.warning(f"Lease: запись {key} с устаревшим fencing token {lease.token} отклонена")
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "acquired": self.acquired,
+            "contended": self.contended,
+            "timeouts": self.timeouts,
+            "lost": self.lost,
+            "fenced_rejects": self.fenced_rejects,
+        }
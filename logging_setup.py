@@ -0,0 +1,251 @@
+"""
+Настройка логирования бота
+Записи уходят в очередь и пишутся на диск/в консоль фоновым потоком
+(QueueHandler/QueueListener), файл ротируется по размеру. Каждая запись
+получает correlation id текущего апдейта; по завершении обработки апдейта
+пишется одна сводная запись с временем этапов. Тексты пользователей и ответы
+ассистента логируются с сэмплированием и обрезкой
+"""
+
+import atexit
+import copy
+import functools
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import time
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_correlation_id: ContextVar[str] = ContextVar('correlation_id', default='-')
+_stages: ContextVar[Optional[Dict[str, float]]] = ContextVar('log_stages', default=None)
+_queue_wait: ContextVar[Optional[float]] = ContextVar('queue_wait', default=None)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(correlation_id)s] %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет к записи correlation id текущего апдейта.
+
+    Стоит на QueueHandler, то есть срабатывает в потоке, где запись создана:
+    в потоке QueueListener значения contextvars уже недоступны.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = _correlation_id.get()
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который не склеивает traceback с текстом сообщения.
+
+    Стандартный prepare() форматирует запись целиком в msg и очищает exc_info,
+    из-за чего в JSON traceback попадал внутрь 'msg'. Здесь traceback
+    сохраняется отдельно в exc_text (сами объекты кадров в поток логирования
+    не передаются), и форматтер обработчика выводит его как обычно.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _stop_listener() -> None:
+    """Останавливает поток логирования при выходе (регистрируется в atexit один раз)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def logging_configured() -> bool:
+    """True, если setup_logging уже вызывался в этом процессе."""
+    return _listener is not None
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись; поля из extra={'fields': {...}} добавляются как есть."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': self.formatTime(record, DATE_FORMAT),
+            'level': record.levelname,
+            'logger': record.name,
+            'correlation_id': getattr(record, 'correlation_id', '-'),
+            'msg': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        elif record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(
+    level: Optional[str] = None,
+    fmt: Optional[str] = None,
+    log_file: Optional[str] = None,
+) -> logging.Logger:
+    """
+    Настраивает корневой логгер: очередь в памяти, запись на диск и в консоль в отдельном потоке
+
+    Args:
+        level: Уровень логирования (по умолчанию Config.LOG_LEVEL)
+        fmt: 'text' или 'json' (по умолчанию Config.LOG_FORMAT)
+        log_file: Путь к файлу с ротацией; '' — только консоль (по умолчанию Config.LOG_FILE)
+
+    Returns:
+        logging.Logger: Корневой логгер
+    """
+    global _listener
+    level = (level or Config.LOG_LEVEL).upper()
+    fmt = fmt or Config.LOG_FORMAT
+    log_file = Config.LOG_FILE if log_file is None else log_file
+
+    formatter = JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT, DATE_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        Path(log_file).parent.mkdir(parents=True, exist_ok=True)
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file,
+            maxBytes=Config.LOG_MAX_BYTES,
+            backupCount=Config.LOG_BACKUP_COUNT,
+            encoding='utf-8',
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    if _listener is None:
+        atexit.register(_stop_listener)
+    else:
+        _listener.stop()
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(queue_handler)
+    root_logger.setLevel(level)
+
+    # Уровень для сторонних библиотек
+    logging.getLogger('telegram').setLevel(logging.WARNING)
+    logging.getLogger('openai').setLevel(logging.WARNING)
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    return root_logger
+
+
+@contextmanager
+def update_context(correlation_id: str, **fields):
+    """Контекст обработки апдейта: correlation id и сводная запись с временем этапов."""
+    id_token = _correlation_id.set(correlation_id)
+    stages: Dict[str, float] = {}
+    stages_token = _stages.set(stages)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        total_ms = round((time.perf_counter() - started) * 1000, 1)
+        queue_wait = _queue_wait.get()
+        if queue_wait is not None:
+            fields['queue_wait_ms'] = round(queue_wait * 1000, 1)
+        logger.info(
+            f"update handled in {total_ms} ms {stages}",
+            extra={'fields': {**fields, 'duration_ms': total_ms, 'stages': stages}},
+        )
+        _stages.reset(stages_token)
+        _correlation_id.reset(id_token)
+
+
+def note_queue_wait(seconds: float) -> None:
+    """Запоминает время апдейта в очереди; попадёт в сводную запись update_context."""
+    _queue_wait.set(seconds)
+
+
+@contextmanager
+def stage(name: str):
+    """Замеряет этап обработки апдейта (мс); повторные замеры этапа суммируются."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages = _stages.get()
+        if stages is not None:
+            elapsed = (time.perf_counter() - started) * 1000
+            stages[name] = round(stages.get(name, 0.0) + elapsed, 1)
+
+
+def logged_update(func: Callable) -> Callable:
+    """Декоратор обработчика PTB: открывает update_context по update_id апдейта."""
+
+    @functools.wraps(func)
+    async def wrapper(self, update, context, *args, **kwargs):
+        update_id = getattr(update, 'update_id', None)
+        user = getattr(update, 'effective_user', None)
+        with update_context(
+            str(update_id) if update_id is not None else '-',
+            handler=func.__name__,
+            user_id=user.id if user else None,
+        ):
+            return await func(self, update, context, *args, **kwargs)
+
+    return wrapper
+
+
+def payload(text: Optional[str]) -> Optional[str]:
+    """
+    Текст для лога с учётом сэмплирования и обрезки
+
+    Решение о сэмплировании принимается по correlation id, поэтому текст
+    пользователя и ответ ассистента одного апдейта логируются вместе.
+
+    Returns:
+        Обрезанный до LOG_PAYLOAD_MAX_CHARS текст или None, если апдейт не попал в выборку
+    """
+    if text is None:
+        return None
+    rate = Config.LOG_PAYLOAD_SAMPLE_RATE
+    if rate < 1.0:
+        correlation_id = _correlation_id.get()
+        if correlation_id != '-':
+            bucket = zlib.crc32(correlation_id.encode()) % 10000 / 10000
+        else:
+            bucket = random.random()
+        if bucket >= rate:
+            return None
+    limit = Config.LOG_PAYLOAD_MAX_CHARS
+    if limit and len(text) > limit:
+        return f"{text[:limit]}… (+{len(text) - limit})"
+    return text
+
+
+def log_payload(log: logging.Logger, label: str, text: Optional[str]) -> None:
+    """Пишет текст в лог на уровне INFO, если он прошёл сэмплирование."""
+    shown = payload(text)
+    if shown is not None:
+        log.info(f"{label}: {shown}", extra={'fields': {'chars': len(text)}})
@@ -0,0 +1,77 @@
+"""
+Кэш file_id медиа, уже загруженных в Telegram
+Логотип и чек-лист загружаются один раз, дальше отправляются по file_id
+"""
+
+import asyncio
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class FileIdCache:
+    """Хранит file_id по URL источника и хэшу содержимого.
+
+    Записи держатся в памяти процесса и дублируются в Redis (хэш MEDIA_CACHE_KEY,
+    общий пул redis.asyncio), а без Redis — в JSON-файл на диске. Чтение при
+    отправке не ходит в сеть; load() вызывается один раз при старте бота.
+    """
+
+    def __init__(self, redis=None, path: Optional[str] = None):
+        self._redis = redis
+        self._path = Path(path or Config.MEDIA_CACHE_PATH)
+        self._entries: Dict[str, dict] = {}
+
+    def get(self, url: str, sha256: Optional[str] = None) -> Optional[str]:
+        """Возвращает file_id для URL. Если передан хэш, запись должна ему соответствовать."""
+        entry = self._entries.get(url)
+        if not entry:
+            return None
+        if sha256 is not None and entry.get('sha256') != sha256:
+            return None
+        return entry.get('file_id')
+
+    async def put(self, url: str, sha256: Optional[str], file_id: str) -> None:
+        entry = {'sha256': sha256, 'file_id': file_id}
+        self._entries[url] = entry
+        await self._store(url, entry)
+
+    async def invalidate(self, url: str) -> None:
+        if self._entries.pop(url, None) is not None:
+            await self._store(url, None)
+
+    async def load(self) -> None:
+        try:
+            if self._redis:
+                raw = await self._redis.hgetall(Config.MEDIA_CACHE_KEY) or {}
+                self._entries.update({url: json.loads(value) for url, value in raw.items()})
+            elif self._path.exists():
+                text = await asyncio.to_thread(self._path.read_text, encoding='utf-8')
+                self._entries.update(json.loads(text))
+            if self._entries:
+                logger.info(f"Media cache: загружено file_id: {len(self._entries)}")
+        except Exception as e:
+            logger.warning(f"Media cache: не удалось загрузить кэш file_id: {e}")
+
+    async def _store(self, url: str, entry: Optional[dict]) -> None:
+        try:
+            if self._redis:
+                if entry is None:
+                    await self._redis.hdel(Config.MEDIA_CACHE_KEY, url)
+                else:
+                    await self._redis.hset(Config.MEDIA_CACHE_KEY, url, json.dumps(entry))
+            else:
+                await asyncio.to_thread(self._write_file, json.dumps(self._entries, ensure_ascii=False))
+        except Exception as e:
+            logger.warning(f"Media cache: не удалось сохранить file_id: {e}")
+
+    def _write_file(self, payload: str) -> None:
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self._path.with_suffix('.tmp')
+        tmp.write_text(payload, encoding='utf-8')
+        tmp.replace(self._path)
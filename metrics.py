@@ -0,0 +1,217 @@
+"""
+Метрики Prometheus
+Гистограммы задержек внешних зависимостей (OpenAI, Telegram, Sheets, Redis),
+время обработки апдейтов и счётчики лидов, ошибок и доставок рассылки.
+Без пакета prometheus_client все метрики превращаются в заглушки
+"""
+
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+try:
+    from prometheus_client import (  # type: ignore[reportMissingImports]
+        CONTENT_TYPE_LATEST,
+        REGISTRY,
+        Counter,
+        Gauge,
+        Histogram,
+        generate_latest,
+        start_http_server,
+    )
+    from prometheus_client.core import GaugeMetricFamily  # type: ignore[reportMissingImports]
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+    CONTENT_TYPE_LATEST = 'text/plain; version=0.0.4; charset=utf-8'
+
+    class _NoopMetric:
+        """Заглушка метрики: принимает те же вызовы и ничего не делает."""
+
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def labels(self, *args, **kwargs):
+            return self
+
+        def observe(self, value: float) -> None:
+            pass
+
+        def inc(self, value: float = 1) -> None:
+            pass
+
+        def dec(self, value: float = 1) -> None:
+            pass
+
+    Counter = Gauge = Histogram = _NoopMetric
+
+
+# Границы корзин для быстрых вызовов (Redis, Telegram) и для ранов ассистента
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SLOW_BUCKETS = (0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 13.0, 20.0, 30.0, 60.0)
+
+OPENAI_RUN_QUEUE_WAIT = Histogram(
+    'b2bbot_openai_run_queue_wait_seconds',
+    'Время от создания рана до начала его выполнения',
+    buckets=SLOW_BUCKETS,
+)
+OPENAI_RUN_DURATION = Histogram(
+    'b2bbot_openai_run_duration_seconds',
+    'Время от запуска рана до финального статуса',
+    ['mode', 'status'],
+    buckets=SLOW_BUCKETS,
+)
+OPENAI_RUN_POLLS = Histogram(
+    'b2bbot_openai_run_polls',
+    'Число запросов runs.retrieve за один ран',
+    buckets=(0, 1, 2, 3, 5, 8, 13, 20, 30),
+)
+TELEGRAM_REQUEST = Histogram(
+    'b2bbot_telegram_request_seconds',
+    'Время запроса к Bot API',
+    ['method'],
+    buckets=FAST_BUCKETS + (5.0, 10.0, 30.0),
+)
+SHEETS_APPEND = Histogram(
+    'b2bbot_sheets_append_seconds',
+    'Время пакетной записи строк в Google Sheets',
+    buckets=SLOW_BUCKETS,
+)
+REDIS_COMMAND = Histogram(
+    'b2bbot_redis_command_seconds',
+    'Время команды или pipeline Redis',
+    ['command'],
+    buckets=FAST_BUCKETS,
+)
+USER_LOCK_WAIT = Histogram(
+    'b2bbot_user_lock_wait_seconds',
+    'Ожидание lease пользователя перед ходом диалога (ход в другом воркере)',
+    buckets=FAST_BUCKETS + (5.0, 10.0, 30.0, 60.0),
+)
+UPDATE_HANDLING = Histogram(
+    'b2bbot_update_handling_seconds',
+    'Полное время обработки апдейта обработчиком',
+    ['handler'],
+    buckets=SLOW_BUCKETS,
+)
+UPDATE_QUEUE_WAIT = Histogram(
+    'b2bbot_update_queue_wait_seconds',
+    'Время апдейта в очереди до начала обработки (webhook — пул воркеров, polling — очередь чата и лимит)',
+    ['source'],
+    buckets=FAST_BUCKETS + (5.0, 10.0, 30.0),
+)
+HANDLERS_IN_FLIGHT = Gauge('b2bbot_handlers_in_flight', 'Обработчики, выполняющиеся прямо сейчас', ['handler'])
+LEADS = Counter('b2bbot_leads_total', 'Заявки, найденные в ответах ассистента', ['destination'])
+ERRORS = Counter('b2bbot_errors_total', 'Ошибки по компонентам', ['component'])
+UPDATE_DUPLICATES = Counter('b2bbot_update_duplicates_total', 'Повторно доставленные апдейты, пропущенные без обработки', ['source'])
+BROADCAST_DELIVERIES = Counter('b2bbot_broadcast_deliveries_total', 'Результаты доставки рассылки', ['result'])
+
+
+@contextmanager
+def observe_time(histogram, *labels):
+    """Замеряет время блока и записывает его в гистограмму (с метками, если заданы)."""
+    target = histogram.labels(*labels) if labels else histogram
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        target.observe(time.perf_counter() - started)
+
+
+def timed_handler(func: Callable) -> Callable:
+    """Декоратор обработчика PTB: время обработки, число одновременных вызовов и ошибки по имени обработчика."""
+    name = func.__name__
+
+    in_flight = HANDLERS_IN_FLIGHT.labels(name)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        in_flight.inc()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            ERRORS.labels(name).inc()
+            raise
+        finally:
+            in_flight.dec()
+            UPDATE_HANDLING.labels(name).observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+class InstrumentedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest, который пишет время каждого вызова Bot API в гистограмму по имени метода."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        with observe_time(TELEGRAM_REQUEST, api_method):
+            return await super().do_request(url, method, *args, **kwargs)
+
+
+if PROMETHEUS_AVAILABLE:
+    class _StatsCollector:
+        """Отдаёт при каждом опросе текущие значения внутренних счётчиков (stats()-словарей)."""
+
+        def __init__(self, name: str, source: Callable[[], Dict[str, float]]):
+            self.name = name
+            self.source = source
+
+        def collect(self):
+            try:
+                stats = self.source()
+            except Exception as e:
+                logger.warning(f"Metrics: не удалось собрать {self.name}: {e}")
+                return
+            for key, value in _flatten(stats):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                yield GaugeMetricFamily(f"b2bbot_{self.name}_{key}", f"{self.name}: {key}", value=value)
+
+
+def _flatten(stats: dict, prefix: str = ''):
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}_")
+        else:
+            yield f"{prefix}{key}", value
+
+
+_registered_stats: Dict[str, object] = {}
+
+
+def register_stats(name: str, source: Callable[[], Dict[str, float]]) -> None:
+    """Экспортирует словарь счётчиков source() как набор метрик b2bbot_<name>_<ключ>."""
+    if not PROMETHEUS_AVAILABLE:
+        return
+    previous = _registered_stats.pop(name, None)
+    if previous is not None:
+        REGISTRY.unregister(previous)
+    collector = _StatsCollector(name, source)
+    REGISTRY.register(collector)
+    _registered_stats[name] = collector
+
+
+def render() -> bytes:
+    """Текущие метрики в текстовом формате Prometheus."""
+    if not PROMETHEUS_AVAILABLE:
+        return b"# prometheus_client is not installed\n"
+    return generate_latest(REGISTRY)
+
+
+def start_metrics_server(port: Optional[int]) -> bool:
+    """Поднимает HTTP-сервер /metrics на порту (режим polling). False, если метрики недоступны."""
+    if not port:
+        return False
+    if not PROMETHEUS_AVAILABLE:
+        logger.warning("Metrics: METRICS_PORT задан, но prometheus_client не установлен")
+        return False
+    start_http_server(int(port))
+    logger.info(f"📈 Метрики доступны на порту {port} (/metrics)")
+    return True
@@ -4,24 +4,84 @@
 """
 
 import openai
-from openai import OpenAI
+from openai import AsyncOpenAI
 from config import Config
 import logging
 import asyncio
-from typing import Optional
+import json
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, List, Optional
 from pathlib import Path
-import re
 
-# Настраиваем логирование
-logging.basicConfig(level=logging.INFO)
+from application_handler import parse_lead
+from lease_lock import Lease, LeaseTimeout, RedisLeaseLock
+from lru_cache import LRUTTLCache
+from redis_pool import get_redis
+from metrics import ERRORS, OPENAI_RUN_DURATION, OPENAI_RUN_POLLS, OPENAI_RUN_QUEUE_WAIT
+from text_pipeline import StreamingReplyCleaner, clean_reply, message_text
+
 logger = logging.getLogger(__name__)
 
+# Статусы рана, при которых продолжаем опрос
+RUN_PENDING_STATUSES = ('queued', 'in_progress', 'cancelling')
+# Адаптивный опрос статуса рана: короткие раны не ждут лишнюю секунду,
+# длинные не тратят лишние запросы
+RUN_POLL_INITIAL_DELAY = 0.2
+RUN_POLL_BACKOFF = 1.5
+RUN_POLL_MAX_DELAY = 2.0
+
+# Размер страницы SSCAN при обходе подписчиков
+SUBS_SCAN_BATCH = 1000
+
+# Адрес OpenAI API, если OPENAI_BASE_URL не задан
+DEFAULT_OPENAI_BASE_URL = "https://api.openai.com/v1"
+
+# Кэш метаданных ассистентов на процесс: assistant_id -> (время загрузки, метаданные)
+_assistant_meta_cache: dict = {}
+_assistant_meta_refreshing: set = set()
+
+
+class TurnStats:
+    """Счётчик запросов к Assistants API и тайминги рана за один ход диалога."""
+
+    def __init__(self, mode: str = 'poll'):
+        self.calls: Counter = Counter()
+        self.mode = mode
+        self.started_at = time.monotonic()
+        self.queue_wait: Optional[float] = None
+        self.run_status: Optional[str] = None
+
+    def lock_acquired(self) -> None:
+        """Начинает отсчёт хода заново: ожидание lease не считается временем рана."""
+        self.started_at = time.monotonic()
+
+    def run_started(self) -> None:
+        """Отмечает момент, когда ран вышел из очереди OpenAI (первый раз)."""
+        if self.queue_wait is None:
+            self.queue_wait = time.monotonic() - self.started_at
+
+    def count(self, endpoint: str) -> None:
+        self.calls[endpoint] += 1
+
+    @property
+    def total(self) -> int:
+        return sum(self.calls.values())
+
+    def summary(self) -> str:
+        details = ', '.join(f"{name}={n}" for name, n in sorted(self.calls.items()))
+        return f"api_calls={self.total} ({details})"
+
+
 class OpenAIClient:
     """Класс для работы с OpenAI API"""
     
     def __init__(self):
         """Инициализация клиента OpenAI с поддержкой org/project"""
-        client_kwargs = {"api_key": Config.OPENAI_API_KEY}
+        # Адрес передаётся всегда: иначе AsyncOpenAI сам прочитает OPENAI_BASE_URL из окружения,
+        # и пустое значение из .env превратится в base_url ''
+        client_kwargs = {"api_key": Config.OPENAI_API_KEY, "base_url": Config.OPENAI_BASE_URL or DEFAULT_OPENAI_BASE_URL}
         api_key = Config.OPENAI_API_KEY or ""
         use_project_scoped_key = isinstance(api_key, str) and api_key.startswith("sk-proj-")
         # Если ключ проектный (sk-proj-), не передаем organization: это может вызывать 401
@@ -38,49 +98,212 @@ class OpenAIClient:
                 logger.warning(
                     "OPENAI_PROJECT_ID выглядит некорректно (ожидается 'proj_*'). Параметр project не будет передан."
                 )
-        self.client = OpenAI(**client_kwargs)
+        # Асинхронный клиент для диалогов: ожидание ответа не занимает поток из пула,
+        # параллельные разговоры ограничены только числом соединений
+        self.client = AsyncOpenAI(**client_kwargs)
         self.assistant_id = Config.OPENAI_ASSISTANT_ID
-        self.threads = {}
-        self._redis = self._init_redis()
-        # Диагностика: убеждаемся, что используем именно ваш ассистент
+        # user_id -> thread_id: ограниченный LRU/TTL-кэш перед Redis
+        self.threads = LRUTTLCache(Config.THREAD_CACHE_SIZE, Config.THREAD_CACHE_TTL)
+        # Счётчики промахов локального кэша, найденных/не найденных в Redis
+        self.thread_redis_hits = 0
+        self.thread_redis_misses = 0
+        # Счётчики запросов к Assistants API: за последний ход и накопительно
+        self.last_turn_stats: Optional[TurnStats] = None
+        self.api_calls_total: Counter = Counter()
+        self.turns_total = 0
+        # Общий на процесс пул redis.asyncio (None без REDIS_URL)
+        self._redis = get_redis()
+        self._meta_task: Optional[asyncio.Task] = None
+        # Lease пользователя на время хода: раны одного thread не пересекаются между воркерами
+        self._user_locks = RedisLeaseLock(self._redis) if self._redis and Config.USER_LOCK_TTL > 0 else None
+        # Локальный фильтр уже известных подписчиков: повторный SADD не отправляется
+        self._subs_filter = LRUTTLCache(Config.SUBS_FILTER_SIZE, Config.SUBS_FILTER_TTL)
+        self.subs_writes = 0
+        self.subs_writes_avoided = 0
+        # Диагностика: убеждаемся, что используем именно ваш ассистент.
+        # Метаданные берутся из кэша, обновление идёт в фоне и не блокирует запрос
+        self._ensure_assistant_meta()
+        # Не переопределяем инструкции ассистента — используем то, что задано у ассистента в OpenAI
+        # self.instructions = None  # Я вот тут убрал
+        
+    # ===== Метаданные ассистента =====
+    def get_assistant_meta(self) -> Optional[dict]:
+        """Возвращает закэшированные метаданные ассистента (или None, если их ещё нет)."""
+        cached = _assistant_meta_cache.get(self.assistant_id)
+        return cached[1] if cached else None
+
+    def _ensure_assistant_meta(self) -> None:
+        """Запускает фоновое обновление метаданных, если кэш в процессе устарел."""
+        if not self.assistant_id:
+            return
+        cached = _assistant_meta_cache.get(self.assistant_id)
+        if cached and time.monotonic() - cached[0] < Config.ASSISTANT_META_TTL:
+            return
+        if self.assistant_id in _assistant_meta_refreshing:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне event loop (конструктор) — обновим при первом запросе
+            return
+        _assistant_meta_refreshing.add(self.assistant_id)
+        self._meta_task = loop.create_task(self._refresh_assistant_meta())
+
+    async def _refresh_assistant_meta(self) -> None:
+        """Загружает метаданные ассистента из Redis или API и кладёт их в кэш (фоновая задача)."""
         try:
-            a = self.client.beta.assistants.retrieve(self.assistant_id)
-            tools_list = getattr(a, 'tools', []) or []
-            tools_names = [getattr(t, 'type', str(t)) for t in tools_list]
-            has_instructions = bool(getattr(a, 'instructions', '') or '')
+            meta = await self._load_assistant_meta_from_redis()
+            if meta is None:
+                a = await self.client.beta.assistants.retrieve(self.assistant_id)
+                tools_list = getattr(a, 'tools', []) or []
+                meta = {
+                    "id": a.id,
+                    "name": getattr(a, 'name', '') or '',
+                    "model": getattr(a, 'model', '') or '',
+                    "tools": [getattr(t, 'type', str(t)) for t in tools_list],
+                    "instructions": bool(getattr(a, 'instructions', '') or ''),
+                }
+                await self._save_assistant_meta_to_redis(meta)
+            _assistant_meta_cache[self.assistant_id] = (time.monotonic(), meta)
             logger.info(
-                f"Assistant bound: id={a.id}, name={getattr(a, 'name', '')}, model={getattr(a, 'model', '')}, "
-                f"tools={tools_names}, instructions={'yes' if has_instructions else 'no'}"
+                f"Assistant bound: id={meta['id']}, name={meta['name']}, model={meta['model']}, "
+                f"tools={meta['tools']}, instructions={'yes' if meta['instructions'] else 'no'}"
             )
         except Exception as e:
             logger.warning(f"Не удалось получить метаданные ассистента: {e}")
-        # Не переопределяем инструкции ассистента — используем то, что задано у ассистента в OpenAI
-        # self.instructions = None  # Я вот тут убрал
-        
-    def create_thread(self, user_id: int):
+        finally:
+            _assistant_meta_refreshing.discard(self.assistant_id)
+
+    def _assistant_meta_key(self) -> Optional[str]:
+        if not self._redis:
+            return None
+        prefix = getattr(Config, 'REDIS_PREFIX', 'b2bbot:thread:')
+        return f"{prefix}assistant:{self.assistant_id}"
+
+    async def _load_assistant_meta_from_redis(self) -> Optional[dict]:
+        key = self._assistant_meta_key()
+        if key:
+            try:
+                raw = await self._redis.get(key)
+                if raw:
+                    return json.loads(raw)
+            except Exception as e:
+                logger.warning(f"Redis load assistant meta error: {e}")
+        return None
+
+    async def _save_assistant_meta_to_redis(self, meta: dict) -> None:
+        key = self._assistant_meta_key()
+        if key:
+            try:
+                await self._redis.set(key, json.dumps(meta), ex=int(Config.ASSISTANT_META_TTL))
+            except Exception as e:
+                logger.warning(f"Redis save assistant meta error: {e}")
+
+    async def create_thread(self, user_id: int):
         """Создает новый thread для пользователя"""
         try:
-            thread = self.client.beta.threads.create()
-            self.threads[user_id] = thread.id
-            self._save_thread_id(user_id, thread.id)
+            thread = await self.client.beta.threads.create()
+            self.threads.put(user_id, thread.id)
+            await self._save_thread_id(user_id, thread.id)
             logger.info(f"Создан новый thread {thread.id} для пользователя {user_id}")
             return thread.id
         except Exception as e:
             logger.error(f"Ошибка при создании thread: {e}")
             raise
     
-    def get_or_create_thread(self, user_id: int):
+    async def get_or_create_thread(self, user_id: int):
         """Получает существующий thread или создает новый"""
-        if user_id in self.threads:
-            return self.threads[user_id]
-        # Пытаемся прочитать из Redis
-        cached = self._load_thread_id(user_id)
-        if cached:
-            self.threads[user_id] = cached
-            return cached
-        return self.create_thread(user_id)
-    
-    def send_message(self, user_id: int, message: str):
+        thread_id = await self._lookup_thread(user_id)
+        if thread_id:
+            return thread_id
+        return await self.create_thread(user_id)
+
+    async def _lookup_thread(self, user_id: int) -> Optional[str]:
+        """Возвращает известный thread_id пользователя (память, затем Redis) без создания нового."""
+        thread_id = self.threads.get(user_id)
+        if thread_id:
+            return thread_id
+        # Промах локального кэша: читаем из Redis и продлеваем TTL ключа
+        thread_id = await self._load_thread_id(user_id)
+        if thread_id:
+            self.thread_redis_hits += 1
+            self.threads.put(user_id, thread_id)
+        elif self._redis:
+            self.thread_redis_misses += 1
+        return thread_id
+
+    async def _remember_thread(self, user_id: int, thread_id: str, lease: Optional[Lease] = None) -> None:
+        self.threads.put(user_id, thread_id)
+        await self._save_thread_id(user_id, thread_id, lease)
+        logger.info(f"Создан новый thread {thread_id} для пользователя {user_id}")
+
+    @asynccontextmanager
+    async def _user_lease(self, user_id: int):
+        """Lease пользователя на время хода (None, если Redis не настроен или недоступен)."""
+        if self._user_locks is None:
+            yield None
+            return
+        try:
+            lease = await self._user_locks.acquire(str(user_id))
+        except LeaseTimeout:
+            raise
+        except Exception as e:
+            # Redis недоступен: в пределах процесса ходы всё равно сериализует UserTurnQueue
+            logger.warning(f"Lease: Redis недоступен, ход пользователя {user_id} без блокировки: {e}")
+            yield None
+            return
+        async with self._user_locks.keep(lease):
+            yield lease
+
+    def _check_lease(self, lease: Optional[Lease]) -> None:
+        """Не запускаем ран, если lease уже потерян: ход мог начать другой воркер."""
+        if lease is not None and not lease.valid:
+            raise LeaseTimeout(f"lease {lease.key} потерян до запуска рана")
+
+    async def _start_run(self, user_id: int, message: str, stats: "TurnStats", lease: Optional[Lease] = None):
+        """Запускает ран с сообщением пользователя за один запрос к API.
+
+        Для нового пользователя thread создаётся вместе с раном (threads.create_and_run),
+        для существующего сообщение передаётся в runs.create через additional_messages.
+        """
+        thread_id = await self._lookup_thread(user_id)
+        self._check_lease(lease)
+        if thread_id:
+            stats.count('runs.create')
+            run = await self.client.beta.threads.runs.create(
+                thread_id=thread_id,
+                assistant_id=self.assistant_id,
+                additional_messages=[{"role": "user", "content": message}],
+            )
+        else:
+            stats.count('threads.create_and_run')
+            run = await self.client.beta.threads.create_and_run(
+                assistant_id=self.assistant_id,
+                thread={"messages": [{"role": "user", "content": message}]},
+            )
+            await self._remember_thread(user_id, run.thread_id, lease)
+        return run
+
+    async def _wait_for_run(self, run, stats: "TurnStats"):
+        """Ожидает завершения рана с адаптивной паузой между опросами статуса."""
+        delay = RUN_POLL_INITIAL_DELAY
+        if run.status != 'queued':
+            stats.run_started()
+        while run.status in RUN_PENDING_STATUSES:
+            await asyncio.sleep(delay)
+            delay = min(delay * RUN_POLL_BACKOFF, RUN_POLL_MAX_DELAY)
+            stats.count('runs.retrieve')
+            run = await self.client.beta.threads.runs.retrieve(
+                thread_id=run.thread_id,
+                run_id=run.id
+            )
+            logger.debug(f"OpenAI: run status={run.status}")
+            if run.status != 'queued':
+                stats.run_started()
+        stats.run_status = run.status
+        return run
+
+    async def send_message(self, user_id: int, message: str):
         """
         Отправляет сообщение ассистенту и получает ответ
         
@@ -91,64 +314,143 @@ class OpenAIClient:
         Returns:
             str: Ответ ассистента
         """
+        self._ensure_assistant_meta()
+        stats = TurnStats()
         try:
-            thread_id = self.get_or_create_thread(user_id)
-            logger.info(f"OpenAI: send_message user={user_id} thread={thread_id}")
-            
-            # Добавляем сообщение пользователя в thread
-            self.client.beta.threads.messages.create(
-                thread_id=thread_id,
-                role="user",
-                content=message
-            )
-            logger.info("OpenAI: user message appended to thread")
-            
-            # Запускаем ассистента
-            # Жёстко отключаем инструкции ассистента на время выполнения ран
-            run = self.client.beta.threads.runs.create(
-                thread_id=thread_id,
-                assistant_id=self.assistant_id,
-                # instructions="" # Я вот тут убрал
-            )
-            logger.info(f"OpenAI: run created id={run.id}")
-            
-            # Ждем завершения выполнения
-            while True:
-                run_status = self.client.beta.threads.runs.retrieve(
-                    thread_id=thread_id,
-                    run_id=run.id
-                )
-                logger.info(f"OpenAI: run status={run_status.status}")
-                if run_status.status == 'completed':
-                    break
-                elif run_status.status == 'failed':
-                    logger.error(f"Ошибка выполнения ассистента: {run_status.last_error}")
+            # Ход целиком под lease пользователя: параллельный ход в другом воркере ждёт
+            async with self._user_lease(user_id) as lease:
+                stats.lock_acquired()
+                # Добавляем сообщение пользователя и запускаем ассистента одним запросом
+                run = await self._start_run(user_id, message, stats, lease)
+                logger.info(f"OpenAI: send_message user={user_id} thread={run.thread_id} run={run.id}")
+
+                run = await self._wait_for_run(run, stats)
+                if run.status != 'completed':
+                    logger.error(f"Ошибка выполнения ассистента: status={run.status} error={run.last_error}")
                     return "Извините, произошла ошибка. Попробуйте позже."
-                
-                import time
-                time.sleep(1)
-            
-            # Получаем ответ ассистента
-            messages = self.client.beta.threads.messages.list(thread_id=thread_id, order="desc", limit=10)
-            logger.info(f"OpenAI: messages fetched count={len(messages.data)}")
+
+                # Получаем ответ ассистента именно этого рана
+                stats.count('messages.list')
+                messages = await self.client.beta.threads.messages.list(
+                    thread_id=run.thread_id, run_id=run.id, order="desc", limit=1
+                )
             
-            # Ищем последнее сообщение ассистента
-            for msg in messages.data:
-                if msg.role == "assistant":
-                    # Собираем плоский текст без аннотаций/цитат
-                    content = self._extract_text_without_annotations(msg)
-                    content = self._strip_markdown_simple(content)
-                    preview = (content[:200] + "…") if len(content) > 200 else content
-                    logger.info(f"OpenAI: assistant reply preview=\n{preview}")
-                    if self._is_application(content):
-                        return self._format_application(content)
-                    return content
+                # Ищем последнее сообщение ассистента
+                for msg in messages.data:
+                    if msg.role == "assistant":
+                        return self._finalize_reply(msg)
             
-            return "Извините, не удалось получить ответ от ассистента."
+                return "Извините, не удалось получить ответ от ассистента."
             
         except Exception as e:
+            ERRORS.labels('openai').inc()
             logger.error(f"Ошибка при отправке сообщения: {e}")
             return "Произошла ошибка. Попробуйте позже."
+        finally:
+            self._record_turn(user_id, stats)
+
+    async def send_message_stream(
+        self,
+        user_id: int,
+        message: str,
+        on_partial: Callable[[str], Awaitable[None]],
+    ) -> str:
+        """
+        Отправляет сообщение ассистенту и получает ответ в режиме стриминга
+        
+        Args:
+            user_id: ID пользователя Telegram
+            message: Текст сообщения пользователя
+            on_partial: Корутина, которая получает очищенный текст ответа по мере генерации
+            
+        Returns:
+            str: Итоговый ответ ассистента (как у send_message)
+        """
+        self._ensure_assistant_meta()
+        stats = TurnStats(mode='stream')
+        try:
+            async with self._user_lease(user_id) as lease:
+                stats.lock_acquired()
+                thread_id = await self._lookup_thread(user_id)
+                self._check_lease(lease)
+                logger.info(f"OpenAI: send_message_stream user={user_id} thread={thread_id}")
+                user_message = {"role": "user", "content": message}
+                if thread_id:
+                    stats.count('runs.stream')
+                    manager = self.client.beta.threads.runs.stream(
+                        thread_id=thread_id,
+                        assistant_id=self.assistant_id,
+                        additional_messages=[user_message],
+                    )
+                else:
+                    stats.count('threads.create_and_run_stream')
+                    manager = self.client.beta.threads.create_and_run_stream(
+                        assistant_id=self.assistant_id,
+                        thread={"messages": [user_message]},
+                    )
+
+                cleaner = StreamingReplyCleaner()
+                async with manager as stream:
+                    async for event in stream:
+                        if event.event == 'thread.run.created' and not thread_id:
+                            thread_id = event.data.thread_id
+                            await self._remember_thread(user_id, thread_id, lease)
+                        elif event.event == 'thread.run.in_progress':
+                            stats.run_started()
+                        elif event.event == 'thread.run.completed':
+                            stats.run_status = 'completed'
+                        elif event.event == 'thread.message.created':
+                            cleaner.reset()
+                        elif event.event == 'thread.message.delta':
+                            for block in getattr(event.data.delta, 'content', None) or []:
+                                if getattr(block, 'type', '') != 'text' or not getattr(block, 'text', None):
+                                    continue
+                                cleaner.feed(block.text.value or '', block.text.annotations or [])
+                            try:
+                                await on_partial(cleaner.text())
+                            except Exception as e:
+                                logger.warning(f"OpenAI: on_partial error: {e}")
+                        elif event.event in ('thread.run.failed', 'thread.run.expired', 'thread.run.cancelled'):
+                            stats.run_status = event.event.rsplit('.', 1)[-1]
+                            logger.error(f"Ошибка выполнения ассистента: {getattr(event.data, 'last_error', None)}")
+                            return "Извините, произошла ошибка. Попробуйте позже."
+                    final_messages = await stream.get_final_messages()
+
+                # Итоговый текст собираем по финальному сообщению — так же, как в send_message
+                for msg in reversed(final_messages):
+                    if msg.role == "assistant":
+                        return self._finalize_reply(msg)
+
+                return "Извините, не удалось получить ответ от ассистента."
+
+        except Exception as e:
+            ERRORS.labels('openai').inc()
+            logger.error(f"Ошибка при потоковой отправке сообщения: {e}")
+            return "Произошла ошибка. Попробуйте позже."
+        finally:
+            self._record_turn(user_id, stats)
+
+    def _record_turn(self, user_id: int, stats: "TurnStats") -> None:
+        """Сохраняет счётчики запросов к API за ход и добавляет их к общим."""
+        self.last_turn_stats = stats
+        self.api_calls_total.update(stats.calls)
+        self.turns_total += 1
+        if stats.queue_wait is not None:
+            OPENAI_RUN_QUEUE_WAIT.observe(stats.queue_wait)
+        if stats.run_status is not None:
+            OPENAI_RUN_DURATION.labels(stats.mode, stats.run_status).observe(time.monotonic() - stats.started_at)
+        if stats.mode == 'poll' and stats.run_status is not None:
+            OPENAI_RUN_POLLS.observe(stats.calls['runs.retrieve'])
+        logger.info(f"OpenAI: turn user={user_id} {stats.summary()}")
+
+    def _finalize_reply(self, msg) -> str:
+        """Превращает сообщение ассистента в итоговый текст ответа пользователю."""
+        # Плоский текст без аннотаций; заявка проверяется до очистки, чтобы
+        # очистка и компактное форматирование заявки прошли за один проход
+        raw = message_text(msg)
+        lead = parse_lead(raw)
+        content = clean_reply(raw, compact=lead is not None and lead.is_complete)
+        return content
     
     def _load_prompt_instructions(self) -> str:
         """Читает инструкции из файла config/prompt.md (если есть)."""
@@ -161,102 +463,41 @@ class OpenAIClient:
             logger.warning(f"Не удалось загрузить config/prompt.md: {e}")
         return ""
 
-    def _extract_text_without_annotations(self, message) -> str:
-        """Возвращает объединённый текст всех частей контента без citation/markdown артефактов."""
-        try:
-            parts = []
-            for item in getattr(message, 'content', []) or []:
-                if getattr(item, 'type', '') == 'text' and getattr(item, 'text', None):
-                    text_value = getattr(item.text, 'value', '') or ''
-                    annotations = getattr(item.text, 'annotations', []) or []
-                    # Удаляем диапазоны, помеченные аннотациями (file_citation, file_path)
-                    try:
-                        # Индексы аннотаций относятся к текущему text_value
-                        for ann in sorted(annotations, key=lambda a: getattr(a, 'start_index', 0), reverse=True):
-                            start = getattr(ann, 'start_index', None)
-                            end = getattr(ann, 'end_index', None)
-                            if start is not None and end is not None and 0 <= start <= end <= len(text_value):
-                                text_value = text_value[:start] + text_value[end:]
-                    except Exception:
-                        pass
-                    parts.append(text_value)
-            combined = ''.join(parts)
-            # Удаляем возможные маркеры цитат вида 【...】 и символ †
-            combined = re.sub(r"【[^】]*】", "", combined)
-            combined = combined.replace("†", "")
-            return combined.strip()
-        except Exception:
-            # Фолбэк: берём первое текстовое содержимое как есть
-            try:
-                return message.content[0].text.value if message.content else ""
-            except Exception:
-                return ""
-
-    def _strip_markdown_simple(self, text: str) -> str:
-        """Убирает базовую Markdown-разметку (жирный/курсив/код/ссылки)."""
-        if not text:
-            return text
-        try:
-            # Ссылки [текст](url) -> текст
-            text = re.sub(r"\[([^\]]+)\]\(([^)]+)\)", r"\1", text)
-            # Блок/инлайн код
-            text = re.sub(r"`{1,3}([\s\S]*?)`{1,3}", r"\1", text)
-            # Жирный/курсив на * и _ (многострочно)
-            text = re.sub(r"\*\*([\s\S]*?)\*\*", r"\1", text)
-            text = re.sub(r"\*([\s\S]*?)\*", r"\1", text)
-            text = re.sub(r"__([\s\S]*?)__", r"\1", text)
-            text = re.sub(r"_([\s\S]*?)_", r"\1", text)
-            # На случай одиночных маркеров — просто убрать символы
-            text = text.replace("**", "")
-            text = text.replace("*", "")
-            return text
-        except Exception:
-            return text
-
     def _default_instructions(self) -> str:
         return ""
     
-    def _is_application(self, content: str) -> bool:
-        """Проверяет, содержит ли сообщение заявку"""
-        application_indicators = [
-            "[Заявка в рабочий чат]",
-            "Имя:",
-            "Телефон:",
-            "Email:",
-            "Запрос:"
-        ]
-        
-        return all(indicator in content for indicator in application_indicators)
-    
-    def _format_application(self, content: str) -> str:
-        """Форматирует заявку для отправки в рабочий чат"""
-        # Убираем лишние пробелы и форматируем
-        lines = content.strip().split('\n')
-        formatted_lines = []
-        
-        for line in lines:
-            line = line.strip()
-            if line:
-                formatted_lines.append(line)
-        
-        return '\n'.join(formatted_lines)
-    
-    def reset_conversation(self, user_id: int):
+    async def reset_conversation(self, user_id: int):
         """Сбрасывает разговор для пользователя"""
-        if user_id in self.threads:
-            del self.threads[user_id]
+        if self.threads.pop(user_id) is not None:
             logger.info(f"Разговор сброшен для пользователя {user_id}")
-        self._delete_thread_id(user_id)
+        await self._delete_thread_id(user_id)
 
     def get_thread_id(self, user_id: int) -> str | None:
         """Возвращает текущий thread_id пользователя, если он есть."""
-        return self.threads.get(user_id)
+        return self.threads.peek(user_id)
+
+    def stats(self) -> dict:
+        """Накопительные счётчики клиента (для метрик)."""
+        return {
+            "turns": self.turns_total,
+            "api_calls": dict(self.api_calls_total),
+            "thread_cache": self.thread_cache_stats(),
+            "subscriber_filter": self.subscriber_filter_stats(),
+            "user_lock": self._user_locks.stats() if self._user_locks else {},
+        }
 
-    def get_last_assistant_message(self, user_id: int) -> str:
+    def thread_cache_stats(self) -> dict:
+        """Счётчики кэша thread_id для подбора THREAD_CACHE_SIZE/THREAD_CACHE_TTL."""
+        stats = self.threads.stats()
+        stats["redis_hits"] = self.thread_redis_hits
+        stats["redis_misses"] = self.thread_redis_misses
+        return stats
+
+    async def get_last_assistant_message(self, user_id: int) -> str:
         """Возвращает последний ответ ассистента в thread пользователя (для диагностики)."""
         try:
-            thread_id = self.get_or_create_thread(user_id)
-            messages = self.client.beta.threads.messages.list(thread_id=thread_id)
+            thread_id = await self.get_or_create_thread(user_id)
+            messages = await self.client.beta.threads.messages.list(thread_id=thread_id)
             for msg in messages.data:
                 if msg.role == "assistant":
                     return msg.content[0].text.value if msg.content else ""
@@ -266,69 +507,144 @@ class OpenAIClient:
             return ""
 
     # ===== Redis helpers =====
-    def _init_redis(self):
-        try:
-            from redis import Redis  # type: ignore[reportMissingImports]
-            if getattr(Config, 'REDIS_URL', None):
-                return Redis.from_url(Config.REDIS_URL, decode_responses=True)
-        except Exception as e:
-            logger.warning(f"Redis не инициализирован: {e}")
-        return None
-
     def _redis_key(self, user_id: int) -> Optional[str]:
         if not self._redis:
             return None
         prefix = getattr(Config, 'REDIS_PREFIX', 'b2bbot:thread:')
         return f"{prefix}{user_id}"
 
-    def _save_thread_id(self, user_id: int, thread_id: str) -> None:
+    async def _save_thread_id(self, user_id: int, thread_id: str, lease: Optional[Lease] = None) -> None:
         key = self._redis_key(user_id)
         if key:
             try:
-                # TTL 7 дней
-                self._redis.set(key, thread_id, ex=7*24*3600)
+                if lease is not None and self._user_locks is not None:
+                    # Запись только с актуальным fencing token: воркер с истёкшим lease не перезапишет thread
+                    await self._user_locks.fenced_set(lease, key, thread_id, int(Config.THREAD_TTL))
+                    return
+                await self._redis.set(key, thread_id, ex=int(Config.THREAD_TTL))
             except Exception as e:
                 logger.warning(f"Redis save thread_id error: {e}")
 
+    async def _load_thread_id(self, user_id: int) -> Optional[str]:
+        key = self._redis_key(user_id)
+        if key:
+            try:
+                # Чтение и продление TTL одним round trip: активный диалог не истекает
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    pipe.get(key)
+                    pipe.expire(key, int(Config.THREAD_TTL))
+                    thread_id, _ = await pipe.execute()
+                return thread_id
+            except Exception as e:
+                logger.warning(f"Redis load thread_id error: {e}")
+        return None
+
+    async def _delete_thread_id(self, user_id: int) -> None:
+        key = self._redis_key(user_id)
+        if key:
+            try:
+                await self._redis.delete(key)
+            except Exception as e:
+                logger.warning(f"Redis delete thread_id error: {e}")
+
     # Подписчики рассылки
-    def add_subscriber(self, chat_id: int) -> None:
+    def _subs_key(self) -> str:
+        return getattr(Config, 'SUBS_SET_KEY', 'b2bbot:subs')
+
+    async def add_subscriber(self, chat_id: int, force: bool = False) -> bool:
+        """
+        Добавляет чат в подписчики
+
+        Фильтр локален для процесса: после удаления чата в другом воркере он
+        ещё до SUBS_FILTER_TTL считает чат подписанным. force (для /start)
+        пишет в Redis в обход фильтра, чтобы вернувшийся пользователь
+        гарантированно снова попал в рассылку.
+
+        Returns:
+            bool: True, если чат уже подписан или запись в Redis прошла
+        """
         if not self._redis:
-            return
+            return False
+        chat_id = int(chat_id)
+        if not force and chat_id in self._subs_filter:
+            self.subs_writes_avoided += 1
+            return True
         try:
-            self._redis.sadd(getattr(Config, 'SUBS_SET_KEY', 'b2bbot:subs'), str(chat_id))
+            await self._redis.sadd(self._subs_key(), str(chat_id))
+            self.subs_writes += 1
+            self._subs_filter.put(chat_id, True)
+            return True
         except Exception as e:
             logger.warning(f"Redis add_subscriber error: {e}")
+            return False
 
-    def remove_subscriber(self, chat_id: int) -> None:
-        if not self._redis:
-            return
+    async def warm_subscriber_filter(self) -> int:
+        """Заполняет локальный фильтр подписчиков из Redis (SSCAN); возвращает число загруженных."""
+        loaded = 0
+        async for chat_id in self.aiter_subscribers():
+            if loaded >= self._subs_filter.maxsize:
+                break
+            self._subs_filter.put(int(chat_id), True)
+            loaded += 1
+        if loaded:
+            logger.info(f"Redis: фильтр подписчиков прогрет, чатов: {loaded}")
+        return loaded
+
+    def subscriber_filter_stats(self) -> dict:
+        return {
+            "size": len(self._subs_filter),
+            "writes": self.subs_writes,
+            "writes_avoided": self.subs_writes_avoided,
+        }
+
+    async def remove_subscriber(self, chat_id: int) -> None:
+        await self.remove_subscribers([chat_id])
+
+    async def remove_subscribers(self, chat_ids) -> int:
+        """Удаляет пачку подписчиков одним SREM; возвращает число удалённых."""
+        if not self._redis or not chat_ids:
+            return 0
+        for chat_id in chat_ids:
+            self._subs_filter.pop(int(chat_id))
         try:
-            self._redis.srem(getattr(Config, 'SUBS_SET_KEY', 'b2bbot:subs'), str(chat_id))
+            return await self._redis.srem(self._subs_key(), *[str(c) for c in chat_ids])
         except Exception as e:
-            logger.warning(f"Redis remove_subscriber error: {e}")
+            logger.warning(f"Redis remove_subscribers error: {e}")
+            return 0
 
-    def get_all_subscribers(self):
+    async def prune_subscribers(self, chat_ids) -> int:
+        """Удаляет недоступные чаты из подписчиков (для движка рассылки)."""
+        removed = await self.remove_subscribers(chat_ids)
+        if removed:
+            logger.info(f"Redis: удалено недоступных подписчиков: {removed}")
+        return removed
+
+    async def count_subscribers(self) -> Optional[int]:
         if not self._redis:
-            return []
+            return 0
         try:
-            return list(self._redis.smembers(getattr(Config, 'SUBS_SET_KEY', 'b2bbot:subs')))
+            return await self._redis.scard(self._subs_key())
         except Exception as e:
-            logger.warning(f"Redis get_all_subscribers error: {e}")
-            return []
+            logger.warning(f"Redis count_subscribers error: {e}")
+            return None
 
-    def _load_thread_id(self, user_id: int) -> Optional[str]:
-        key = self._redis_key(user_id)
-        if key:
+    async def aiter_subscribers(self, batch_size: int = SUBS_SCAN_BATCH):
+        """Постранично обходит множество подписчиков через SSCAN (без загрузки целиком).
+        Страницы отдаются по мере получения, поэтому рассылка начинается сразу."""
+        if not self._redis:
+            return
+        key = self._subs_key()
+        cursor = 0
+        while True:
             try:
-                return self._redis.get(key)
+                cursor, page = await self._redis.sscan(key, cursor=cursor, count=batch_size)
             except Exception as e:
-                logger.warning(f"Redis load thread_id error: {e}")
-        return None
+                logger.warning(f"Redis aiter_subscribers error: {e}")
+                return
+            for chat_id in page:
+                yield chat_id
+            if not cursor:
+                return
 
-    def _delete_thread_id(self, user_id: int) -> None:
-        key = self._redis_key(user_id)
-        if key:
-            try:
-                self._redis.delete(key)
-            except Exception as e:
-                logger.warning(f"Redis delete thread_id error: {e}")
+    async def get_all_subscribers(self) -> List[str]:
+        return [chat_id async for chat_id in self.aiter_subscribers()]
@@ -0,0 +1,268 @@
+"""
+Хранение состояния пользователей (context.user_data) в Redis
+Реализация BasePersistence из python-telegram-bot: ленивое чтение при первом
+апдейте пользователя, LRU-фронт в памяти процесса и пакетная запись изменений
+"""
+
+import asyncio
+import functools
+import json
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from telegram.ext import Application, BasePersistence, PersistenceInput
+
+from config import Config
+from lru_cache import LRUTTLCache
+
+logger = logging.getLogger(__name__)
+
+
+# Отметка во фронте: данные пользователя в памяти, сохранённая версия неизвестна
+_UNKNOWN = ''
+
+
+def _encode(data: dict) -> str:
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+
+
+class RedisPersistence(BasePersistence):
+    """Persistence только для user_data.
+
+    - При старте ничего не загружается: данные пользователя читаются из Redis
+      в refresh_user_data при его первом апдейте или после выгрузки из памяти.
+    - LRU-фронт хранит последнее сохранённое состояние: повторные апдейты
+      пользователя не ходят в Redis, а неизменённые данные не перезаписываются.
+    - Изменения копятся в памяти (последняя версия на пользователя) и раз в
+      flush_interval пишутся одним pipeline.
+    - У пользователей, вытесненных из фронта, user_data очищается и при
+      следующем апдейте перечитывается из Redis, поэтому в памяти процесса
+      остаются данные не больше чем cache_size пользователей. Пока обработчик
+      пользователя выполняется (pinned), его данные не трогаются.
+    """
+
+    def __init__(
+        self,
+        redis=None,
+        cache_size: Optional[int] = None,
+        cache_ttl: Optional[float] = None,
+        flush_interval: Optional[float] = None,
+    ):
+        flush_interval = flush_interval or Config.USER_STATE_FLUSH_INTERVAL
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=flush_interval,
+        )
+        self._redis = redis
+        self._front = LRUTTLCache(cache_size or Config.USER_STATE_CACHE_SIZE, cache_ttl or Config.USER_STATE_CACHE_TTL)
+        # user_id -> закодированное состояние для записи (None — удалить)
+        self._dirty: Dict[int, Optional[str]] = {}
+        # user_id -> число выполняющихся обработчиков пользователя
+        self._pinned: Counter = Counter()
+        self.flush_interval = flush_interval
+        self._application: Optional[Application] = None
+        self._task: Optional[asyncio.Task] = None
+        # Счётчики для метрик
+        self.loads = 0
+        self.writes = 0
+        self.writes_skipped = 0
+        self.writes_coalesced = 0
+        self.flushes = 0
+
+    def _key(self, user_id: int) -> str:
+        return f"{Config.USER_STATE_PREFIX}{user_id}"
+
+    # ===== user_data =====
+    async def get_user_data(self) -> Dict[int, dict]:
+        # Ленивая загрузка: данные пользователя читаются при его первом апдейте
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        persisted = self._front.get(user_id)
+        if persisted is not None:
+            # get не продлевает TTL, а активный пользователь не должен вытесняться по нему
+            self._front.put(user_id, persisted)
+            return
+        if user_data or user_id in self._dirty:
+            # Данные уже в памяти процесса и могут быть новее Redis — не перечитываем;
+            # сохранённая версия неизвестна, поэтому следующее обновление будет записано
+            self._front.put(user_id, _UNKNOWN)
+            return
+        encoded = await self._load(user_id)
+        if encoded is not None:
+            user_data.clear()
+            user_data.update(json.loads(encoded))
+        self._front.put(user_id, encoded if encoded is not None else _encode(user_data))
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        encoded = _encode(data)
+        persisted = self._front.peek(user_id)
+        if encoded == persisted and user_id not in self._dirty:
+            self.writes_skipped += 1
+            return
+        if persisted is None and not data:
+            # Пустые данные пользователя, выгруженного из памяти, — не затираем Redis
+            self.writes_skipped += 1
+            return
+        if user_id in self._dirty:
+            self.writes_coalesced += 1
+        self._dirty[user_id] = encoded
+        self._front.put(user_id, encoded)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._dirty[user_id] = None
+        self._front.pop(user_id)
+
+    async def flush(self) -> None:
+        """Записывает накопленные изменения одним pipeline."""
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        if not self._redis:
+            return
+        try:
+            await self._write(batch)
+            self.flushes += 1
+            self.writes += len(batch)
+        except Exception as e:
+            logger.warning(f"Persistence: не удалось записать состояние {len(batch)} пользователей: {e}")
+            # Вернём в очередь то, что не успело измениться заново
+            for user_id, encoded in batch.items():
+                self._dirty.setdefault(user_id, encoded)
+
+    async def _load(self, user_id: int) -> Optional[str]:
+        if not self._redis:
+            return None
+        try:
+            self.loads += 1
+            return await self._redis.get(self._key(user_id))
+        except Exception as e:
+            logger.warning(f"Persistence: не удалось прочитать состояние {user_id}: {e}")
+            return None
+
+    async def _write(self, batch: Dict[int, Optional[str]]) -> None:
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for user_id, encoded in batch.items():
+                if encoded is None:
+                    pipe.delete(self._key(user_id))
+                else:
+                    pipe.set(self._key(user_id), encoded, ex=int(Config.USER_STATE_TTL))
+            await pipe.execute()
+
+    # ===== фоновая запись и ограничение памяти =====
+    @contextmanager
+    def pinned(self, user_id: int):
+        """Пока блок выполняется, user_data пользователя не очищается."""
+        self._pinned[user_id] += 1
+        try:
+            yield
+        finally:
+            self._pinned[user_id] -= 1
+            if self._pinned[user_id] <= 0:
+                del self._pinned[user_id]
+            # Изменения обработчика PTB сохранит позже: до этого пользователь должен
+            # остаться во фронте, даже если его запись истекла, пока шёл обработчик
+            self._front.put(user_id, self._front.peek(user_id, _UNKNOWN))
+
+    def start(self, application: Application) -> None:
+        self._application = application
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                self._evict_idle()
+            except Exception as e:
+                logger.error(f"Persistence: ошибка фоновой записи: {e}")
+
+    def _evict_idle(self) -> int:
+        """Очищает в памяти Application user_data пользователей, которых нет во фронте.
+
+        Словари остаются на месте пустыми: refresh_user_data перечитает их из
+        Redis при следующем апдейте, а update_user_data не запишет пустые данные
+        вытесненного пользователя поверх сохранённых.
+        """
+        if self._application is None:
+            return 0
+        evicted = 0
+        for user_id, data in self._application.user_data.items():
+            if not data or user_id in self._front or user_id in self._dirty or user_id in self._pinned:
+                continue
+            data.clear()
+            evicted += 1
+        return evicted
+
+    def stats(self) -> dict:
+        return {
+            "cache": self._front.stats(),
+            "dirty": len(self._dirty),
+            "loads": self.loads,
+            "writes": self.writes,
+            "writes_skipped": self.writes_skipped,
+            "writes_coalesced": self.writes_coalesced,
+            "flushes": self.flushes,
+        }
+
+    # ===== остальные данные не хранятся =====
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+
+def pins_user_data(func: Callable) -> Callable:
+    """Декоратор обработчика PTB: пока он выполняется, user_data пользователя не выгружается из памяти."""
+
+    @functools.wraps(func)
+    async def wrapper(self, update, context, *args, **kwargs):
+        user = getattr(update, 'effective_user', None)
+        persistence = getattr(context.application, 'persistence', None)
+        if user is None or not isinstance(persistence, RedisPersistence):
+            return await func(self, update, context, *args, **kwargs)
+        with persistence.pinned(user.id):
+            return await func(self, update, context, *args, **kwargs)
+
+    return wrapper
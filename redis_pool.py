@@ -0,0 +1,84 @@
+"""
+Общий на процесс асинхронный клиент Redis
+Все модули (thread_id, подписчики, состояние пользователей, кэш медиа)
+используют один пул соединений redis.asyncio
+"""
+
+import logging
+
+from config import Config
+from metrics import REDIS_COMMAND, observe_time
+
+logger = logging.getLogger(__name__)
+
+_client = None
+
+
+def get_redis():
+    """
+    Возвращает общий клиент redis.asyncio, создавая пул при первом обращении
+
+    Соединения открываются лениво, при первой команде, поэтому вызов безопасен
+    вне event loop (например, в конструкторе бота).
+
+    Returns:
+        redis.asyncio.Redis или None, если REDIS_URL не задан или пакет недоступен
+    """
+    global _client
+    if _client is not None or not Config.REDIS_URL:
+        return _client
+    try:
+        from redis.asyncio import ConnectionPool  # type: ignore[reportMissingImports]
+
+        pool = ConnectionPool.from_url(
+            Config.REDIS_URL,
+            decode_responses=True,
+            max_connections=Config.REDIS_MAX_CONNECTIONS,
+        )
+        _client = _instrumented_client_class()(connection_pool=pool)
+        logger.info(f"Redis: общий пул соединений создан (max_connections={Config.REDIS_MAX_CONNECTIONS})")
+    except Exception as e:
+        logger.warning(f"Redis не инициализирован: {e}")
+        _client = None
+    return _client
+
+
+def _instrumented_client_class():
+    """Клиент redis.asyncio, который пишет время команд и pipeline в метрики."""
+    from redis.asyncio import Redis  # type: ignore[reportMissingImports]
+    from redis.asyncio.client import Pipeline  # type: ignore[reportMissingImports]
+
+    class InstrumentedPipeline(Pipeline):
+        async def execute(self, raise_on_error: bool = True):
+            with observe_time(REDIS_COMMAND, 'PIPELINE'):
+                return await super().execute(raise_on_error)
+
+    class InstrumentedRedis(Redis):
+        async def execute_command(self, *args, **options):
+            with observe_time(REDIS_COMMAND, str(args[0]).upper() if args else '?'):
+                return await super().execute_command(*args, **options)
+
+        def pipeline(self, transaction: bool = True, shard_hint=None):
+            return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+    return InstrumentedRedis
+
+
+def forget_redis() -> None:
+    """Забывает общий клиент, не закрывая его: соединения привязаны к уже завершённому event loop."""
+    global _client
+    _client = None
+
+
+async def close_redis() -> None:
+    """Закрывает общий пул (при остановке процесса)."""
+    global _client
+    client, _client = _client, None
+    if client is None:
+        return
+    try:
+        await client.aclose()
+        # Клиент, созданный с готовым connection_pool, сам пул не закрывает
+        await client.connection_pool.disconnect()
+    except Exception as e:
+        logger.warning(f"Redis: ошибка при закрытии пула: {e}")
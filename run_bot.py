@@ -15,37 +15,9 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent))
 
 def setup_logging():
-    """Настраивает логирование для бота"""
-    # Создаем директорию для логов если её нет
-    log_dir = Path("logs")
-    log_dir.mkdir(exist_ok=True)
-    
-    # Настраиваем форматирование
-    log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    date_format = '%Y-%m-%d %H:%M:%S'
-    
-    # Настраиваем логирование в файл
-    file_handler = logging.FileHandler(log_dir / "bot.log", encoding='utf-8')
-    file_handler.setLevel(logging.INFO)
-    file_handler.setFormatter(logging.Formatter(log_format, date_format))
-    
-    # Настраиваем логирование в консоль
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    console_handler.setFormatter(logging.Formatter(log_format, date_format))
-    
-    # Настраиваем корневой логгер
-    root_logger = logging.getLogger()
-    root_logger.setLevel(logging.INFO)
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(console_handler)
-    
-    # Устанавливаем уровень для сторонних библиотек
-    logging.getLogger('telegram').setLevel(logging.WARNING)
-    logging.getLogger('openai').setLevel(logging.WARNING)
-    logging.getLogger('httpx').setLevel(logging.WARNING)
-    
-    return root_logger
+    """Настраивает логирование для бота (очередь, ротация файла, формат из конфигурации)"""
+    from logging_setup import setup_logging as configure_logging
+    return configure_logging()
 
 def check_environment():
     """Проверяет наличие необходимых переменных окружения (Railway: только лог)"""
@@ -129,6 +101,11 @@ def main():
         
         logger.info("🤖 Создание экземпляра бота...")
         bot = SynaplinkBot()
+
+        # Эндпоинт /metrics на отдельном порту (если задан METRICS_PORT)
+        from config import Config
+        from metrics import start_metrics_server
+        start_metrics_server(Config.METRICS_PORT)
         
         logger.info("🚀 Запуск бота...")
         logger.info("📱 Бот готов к работе!")
@@ -5,10 +5,11 @@
 
 import os
 import sys
-from unittest.mock import Mock, patch
+import asyncio
+from unittest.mock import Mock, AsyncMock, patch
 from config import Config
 from openai_client import OpenAIClient
-from application_handler import ApplicationHandler
+from application_handler import ApplicationHandler, parse_lead
 
 def test_config():
     """Тестирует загрузку конфигурации"""
@@ -83,6 +84,23 @@ def test_application_handler():
         is_valid, message = handler.validate_application(valid_application)
         print(f"✅ Валидация заявки: {is_valid} - {message}")
         
+        # Тест 5: Финальный блок заявки по шаблону промпта
+        lead = parse_lead(
+            "Спасибо!\n[Заявка в рабочий чат]\n**Имя:** Иван\nТелефон: +7 999 123-45-67\n"
+            "Телеграм: @ivan_petrov\nEmail: -\nЗапрос: стратегическая сессия"
+        )
+        assert lead is not None and lead.is_complete
+        assert lead.sheet_row() == ['Иван', '+7 999 123-45-67', '@ivan_petrov', 'стратегическая сессия']
+        assert lead.email == ''
+        assert parse_lead("Имя: Иван\nТелефон: 1") is None
+        # Заглушка в обязательном поле не делает заявку неполной (клиент только с телефоном)
+        phone_only = parse_lead(
+            "[Заявка в рабочий чат]\nИмя: Анна\nТелефон: +7 900 000-00-00\nТелеграм: -\nEmail: нет\nЗапрос: аудит"
+        )
+        assert phone_only.is_complete and phone_only.telegram == '-' and phone_only.email == ''
+        assert parse_lead(valid_application).missing == ['telegram']
+        print("✅ Финальный блок заявки разобран")
+        
         return True
         
     except Exception as e:
@@ -95,10 +113,15 @@ def test_openai_client_mock():
     
     try:
         # Полностью мокаем OpenAI клиент
-        with patch('openai.OpenAI') as mock_openai_class:
-            # Создаем мок-клиент
+        with patch('openai_client.AsyncOpenAI') as mock_openai_class:
+            # Создаем мок-клиент (асинхронные методы API)
             mock_client = Mock()
             mock_openai_class.return_value = mock_client
+            mock_client.beta.threads.create = AsyncMock()
+            mock_client.beta.threads.messages.create = AsyncMock()
+            mock_client.beta.threads.runs.create = AsyncMock()
+            mock_client.beta.threads.runs.retrieve = AsyncMock()
+            mock_client.beta.threads.messages.list = AsyncMock()
             
             # Мокаем создание thread
             mock_thread = Mock()
@@ -112,18 +135,24 @@ def test_openai_client_mock():
             # Мокаем запуск ассистента
             mock_run = Mock()
             mock_run.id = "test_run_456"
+            mock_run.thread_id = "test_thread_123"
+            mock_run.status = 'queued'
             mock_client.beta.threads.runs.create.return_value = mock_run
             
             # Мокаем статус выполнения
             mock_run_status = Mock()
             mock_run_status.status = 'completed'
+            mock_run_status.id = "test_run_456"
+            mock_run_status.thread_id = "test_thread_123"
             mock_client.beta.threads.runs.retrieve.return_value = mock_run_status
             
             # Мокаем получение сообщений
             mock_assistant_message = Mock()
             mock_assistant_message.role = "assistant"
             mock_content = Mock()
+            mock_content.type = "text"
             mock_content.text.value = "Привет! Я Саня, ваш ассистент."
+            mock_content.text.annotations = []
             mock_assistant_message.content = [mock_content]
             
             mock_messages = Mock()
@@ -136,13 +165,15 @@ def test_openai_client_mock():
                     client = OpenAIClient()
                     
                     # Тестируем создание thread
-                    thread_id = client.create_thread(12345)
+                    thread_id = asyncio.run(client.create_thread(12345))
                     assert thread_id == "test_thread_123"
                     print("✅ Thread создается корректно")
                     
                     # Тестируем отправку сообщения
-                    response = client.send_message(12345, "Привет!")
+                    response = asyncio.run(client.send_message(12345, "Привет!"))
                     assert "Саня" in response
+                    # Ход укладывается в runs.create + runs.retrieve + messages.list
+                    assert client.last_turn_stats.total == 3
                     print("✅ Сообщения обрабатываются корректно")
             
             return True
@@ -151,6 +182,204 @@ def test_openai_client_mock():
         print(f"❌ Ошибка в клиенте OpenAI: {e}")
         return False
 
+def _text_update(update_id, chat_id):
+    """Апдейт с текстовым сообщением для тестов очередей."""
+    from telegram import Update
+    user = {"id": chat_id, "is_bot": False, "first_name": "Test"}
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": str(update_id),
+            "chat": {"id": chat_id, "type": "private"}, "from": user,
+        },
+    }, None)
+
+def test_update_worker_pool():
+    """Тестирует пул воркеров вебхука: предел параллельности и порядок внутри чата"""
+    print("\n🧪 Тестирование пула воркеров вебхука...")
+    from update_queue import UpdateWorkerPool, release_chat_order
+
+    async def scenario():
+        running = 0
+        peak = 0
+        handled = {}
+
+        async def process(update):
+            nonlocal running, peak
+            handled.setdefault(update.effective_chat.id, []).append(update.update_id)
+            # Как UserTurnQueue: ход зафиксирован, чат отпущен, ран ещё идёт
+            release_chat_order()
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        pool = UpdateWorkerPool(process, workers=2, queue_size=1000)
+        pool.start()
+        update_id = 0
+        for _ in range(3):
+            for chat_id in range(1, 31):
+                update_id += 1
+                assert pool.submit(_text_update(update_id, chat_id))
+        await pool.stop(timeout=10)
+        return peak, handled, pool.stats()
+
+    peak, handled, stats = asyncio.run(scenario())
+    assert peak <= 2, f"одновременно выполнялось {peak} апдейтов при пределе 2"
+    assert stats["processed"] == 90 and stats["in_flight"] == 0
+    for chat_id, update_ids in handled.items():
+        assert update_ids == sorted(update_ids), f"нарушен порядок в чате {chat_id}: {update_ids}"
+    print(f"✅ Пул: не больше {peak} апдейтов одновременно, порядок в чатах сохранён")
+
+    async def backpressure():
+        started = asyncio.Event()
+        blocked = asyncio.Event()
+
+        async def process(update):
+            started.set()
+            await blocked.wait()
+
+        pool = UpdateWorkerPool(process, workers=1, queue_size=2)
+        pool.start()
+        assert pool.submit(_text_update(1, 1))
+        await started.wait()
+        # Слот занят: следующие апдейты копятся в очереди, пока она не заполнится
+        accepted = [pool.submit(_text_update(i, i)) for i in range(2, 6)]
+        blocked.set()
+        await pool.stop(timeout=10)
+        return accepted
+
+    assert asyncio.run(backpressure()) == [True, True, False, False]
+    print("✅ Пул: при заполненной очереди submit возвращает False")
+    return True
+
+def test_chat_ordered_processing():
+    """Тестирует порядок апдейтов внутри чата в polling-процессоре и в пуле без release_chat_order"""
+    print("\n🧪 Тестирование порядка апдейтов внутри чата...")
+    from update_queue import ChatOrderedUpdateProcessor, UpdateWorkerPool
+
+    def tracker():
+        state = {"running": 0, "peak": 0, "active": set(), "overlaps": 0, "handled": {}}
+
+        async def process(update):
+            chat_id = update.effective_chat.id
+            if chat_id in state["active"]:
+                state["overlaps"] += 1
+            state["active"].add(chat_id)
+            state["handled"].setdefault(chat_id, []).append(update.update_id)
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+            await asyncio.sleep(0.005)
+            state["running"] -= 1
+            state["active"].discard(chat_id)
+
+        return state, process
+
+    def check(state, limit, name):
+        assert state["overlaps"] == 0, f"{name}: апдейты одного чата выполнялись одновременно"
+        assert 1 < state["peak"] <= limit, f"{name}: одновременно {state['peak']} при пределе {limit}"
+        for chat_id, update_ids in state["handled"].items():
+            assert update_ids == sorted(update_ids), f"{name}: нарушен порядок в чате {chat_id}: {update_ids}"
+        assert sum(len(v) for v in state["handled"].values()) == 60
+
+    updates = [_text_update(i, i % 10 + 1) for i in range(1, 61)]
+
+    async def polling():
+        state, process = tracker()
+        processor = ChatOrderedUpdateProcessor(max_running=3)
+        await asyncio.gather(*(processor.process_update(u, process(u)) for u in updates))
+        return state
+
+    check(asyncio.run(polling()), 3, "polling")
+    print("✅ ChatOrderedUpdateProcessor: чаты параллельно, внутри чата по порядку")
+
+    async def pool():
+        state, process = tracker()
+        workers = UpdateWorkerPool(process, workers=4, queue_size=1000)
+        workers.start()
+        for update in updates:
+            assert workers.submit(update)
+        await workers.stop(timeout=10)
+        return state
+
+    check(asyncio.run(pool()), 4, "webhook")
+    print("✅ UpdateWorkerPool: апдейт чата не начинается, пока не закончен предыдущий")
+    return True
+
+async def _lua_redis():
+    """Redis с поддержкой Lua: TEST_REDIS_URL или fakeredis[lua]; None, если нет ни того, ни другого."""
+    url = os.getenv('TEST_REDIS_URL')
+    try:
+        if url:
+            from redis.asyncio import Redis
+            client = Redis.from_url(url, decode_responses=True)
+        else:
+            import fakeredis
+            client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        await client.eval("return 1", 0)
+        return client
+    except Exception:
+        return None
+
+def test_lease_lock():
+    """Тестирует lease пользователя: захват, таймаут, продление и fencing token (Lua-скрипты)"""
+    print("\n🧪 Тестирование lease-блокировки пользователя...")
+    from lease_lock import LeaseTimeout, RedisLeaseLock
+
+    async def scenario():
+        redis = await _lua_redis()
+        if redis is None:
+            return None
+        prefix = f"test:lock:{os.getpid()}:"
+        owner = RedisLeaseLock(redis, prefix=prefix, ttl=0.3, wait_timeout=2)
+        other = RedisLeaseLock(redis, prefix=prefix, ttl=0.3, wait_timeout=0.1)
+
+        # Захват и таймаут ожидания
+        lease = await owner.acquire('user')
+        try:
+            await other.acquire('user')
+            raise AssertionError("lease захвачен дважды")
+        except LeaseTimeout:
+            pass
+        assert other.stats()["timeouts"] == 1
+        await owner.release(lease)
+        second = await other.acquire('user')
+        assert second.token > lease.token, "fencing token не вырос"
+        await other.release(second)
+
+        # Продление: hold() держит lease дольше ttl, пока блок выполняется
+        async with owner.hold('long') as held:
+            await asyncio.sleep(0.5)
+            assert held.valid
+            try:
+                await other.acquire('long')
+                raise AssertionError("продлеваемый lease перехвачен")
+            except LeaseTimeout:
+                pass
+        assert await redis.get(f"{prefix}long") is None, "lease не освобождён"
+
+        # Fencing: после истечения lease старый владелец не может ни писать, ни снять чужой lease
+        stale = await owner.acquire('fenced')
+        await asyncio.sleep(0.4)
+        assert not stale.valid
+        fresh = await other.acquire('fenced')
+        assert not await owner.fenced_set(stale, f"{prefix}thread", 'stale', 60)
+        assert await other.fenced_set(fresh, f"{prefix}thread", 'fresh', 60)
+        assert await redis.get(f"{prefix}thread") == 'fresh'
+        await owner.release(stale)
+        assert await redis.get(f"{prefix}fenced") == fresh.value, "старый владелец снял чужой lease"
+        await other.release(fresh)
+        await redis.delete(*[f"{prefix}{k}" for k in ('user:fence', 'long:fence', 'fenced:fence', 'thread')])
+        return owner.stats()
+
+    stats = asyncio.run(scenario())
+    if stats is None:
+        print("⚠️  Redis с Lua недоступен (задайте TEST_REDIS_URL или pip install \"fakeredis[lua]\") — пропущено")
+        return True
+    assert stats["fenced_rejects"] == 1
+    print("✅ Lease: таймаут, продление и fencing token работают")
+    return True
+
 def run_all_tests():
     """Запускает все тесты"""
     print("🚀 Запуск тестов для бота Synaplink...\n")
@@ -158,7 +387,10 @@ def run_all_tests():
     tests = [
         ("Конфигурация", test_config),
         ("Обработчик заявок", test_application_handler),
-        ("Клиент OpenAI", test_openai_client_mock)
+        ("Клиент OpenAI", test_openai_client_mock),
+        ("Пул воркеров вебхука", test_update_worker_pool),
+        ("Порядок апдейтов в чате", test_chat_ordered_processing),
+        ("Lease пользователя", test_lease_lock),
     ]
     
     passed = 0
@@ -0,0 +1,157 @@
+"""
+Постобработка текста ответов ассистента
+Удаление аннотаций и цитат Retrieval, Markdown-разметки и нормализация
+пробелов за один проход по тексту с заранее скомпилированными шаблонами
+"""
+
+import re
+from typing import Iterable, List, Tuple
+
+# Все конструкции, которые нужно убрать или заменить, в одной регулярке.
+# Порядок альтернатив важен: на одной позиции выигрывает первая подходящая.
+# Опережающая проверка отсекает обычные символы и одиночные пробелы до перебора
+# альтернатив — без неё движок пробует все ветки на каждой позиции текста.
+_MARKUP_RE = re.compile(
+    r"(?=[【†\[`*_\n\t]| [ \t\n])(?:"
+    r"(?P<cite>【[^】]*】)"
+    r"|(?P<dagger>†)"
+    r"|\[(?P<link>[^\]]+)\]\([^)]+\)"
+    r"|(?P<fence>`{1,3})(?P<code>[\s\S]*?)(?P=fence)"
+    r"|\*\*(?P<bold>[\s\S]*?)\*\*"
+    r"|__(?P<ubold>[\s\S]*?)__"
+    r"|\*(?P<em>[^*\n]+?)\*"
+    # _курсив_ только на границах слов, чтобы не ломать ivan_petrov и @user_name
+    r"|(?<!\w)_(?P<uem>[^_\n]+?)_(?!\w)"
+    r"|(?P<stray>\*+)"
+    r"|(?P<nl>[ \t]*\n(?:[ \t]*\n)*[ \t]*)"
+    r"|(?P<spaces>[ \t]{2,}|\t)"
+    r")"
+)
+
+def _replace(match: "re.Match", compact: bool = False) -> str:
+    kind = match.lastgroup
+    if kind in ('cite', 'dagger', 'stray'):
+        return ''
+    if kind == 'spaces':
+        return ' '
+    if kind == 'nl':
+        # Несколько переводов строки — абзац; в компактном режиме пустые строки убираются
+        if compact or match.group('nl').count('\n') == 1:
+            return '\n'
+        return '\n\n'
+    if kind == 'fence' or kind == 'code':
+        return match.group('code')
+    # link, bold, em и т.п.: содержимое остаётся и само может содержать разметку
+    inner = match.group(kind)
+    if not _MARKUP_RE.search(inner):
+        return inner
+    return _MARKUP_RE.sub(_replace_compact if compact else _replace, inner)
+
+
+def _replace_compact(match: "re.Match") -> str:
+    return _replace(match, compact=True)
+
+
+def clean_reply(text: str, compact: bool = False) -> str:
+    """
+    Очищает ответ ассистента за один проход
+
+    Убирает цитаты 【…】 и †, ссылки [текст](url) заменяет текстом, снимает
+    жирный/курсив/код, схлопывает пробелы и пустые строки.
+
+    Args:
+        text: Исходный текст
+        compact: Убрать пустые строки и отступы (для блока заявки)
+
+    Returns:
+        str: Очищенный текст
+    """
+    if not text:
+        return text
+    return _MARKUP_RE.sub(_replace_compact if compact else _replace, text).strip()
+
+
+def strip_annotations(text: str, ranges: Iterable[Tuple[int, int]]) -> str:
+    """Вырезает из текста диапазоны аннотаций (start, end) за один проход."""
+    parts: List[str] = []
+    pos = 0
+    for start, end in sorted(ranges):
+        if start < pos or end > len(text) or start > end:
+            continue
+        parts.append(text[pos:start])
+        pos = end
+    parts.append(text[pos:])
+    return ''.join(parts)
+
+
+def _annotation_ranges(annotations) -> List[Tuple[int, int]]:
+    ranges = []
+    for ann in annotations or []:
+        start = getattr(ann, 'start_index', None)
+        end = getattr(ann, 'end_index', None)
+        if start is not None and end is not None and 0 <= start <= end:
+            ranges.append((start, end))
+    return ranges
+
+
+def message_text(message) -> str:
+    """Возвращает объединённый текст всех текстовых частей сообщения Assistants API без аннотаций."""
+    parts = []
+    for item in getattr(message, 'content', []) or []:
+        if getattr(item, 'type', '') == 'text' and getattr(item, 'text', None):
+            text_value = getattr(item.text, 'value', '') or ''
+            # Индексы аннотаций (file_citation, file_path) относятся к text_value
+            parts.append(strip_annotations(text_value, _annotation_ranges(getattr(item.text, 'annotations', None))))
+    return ''.join(parts)
+
+
+class StreamingReplyCleaner:
+    """Инкрементальная очистка растущего текста ответа при стриминге.
+
+    Уже завершённые абзацы (до последней пустой строки вне блока кода) очищаются
+    один раз и больше не пересчитываются; при каждом обновлении заново
+    обрабатывается только незавершённый хвост.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self._raw = ''
+        self._ranges: List[Tuple[int, int]] = []
+        self._committed_raw = 0
+        self._committed_text = ''
+
+    def feed(self, delta: str, annotations=()) -> None:
+        """Добавляет фрагмент текста и аннотации (индексы — в полном тексте сообщения)."""
+        self._raw += delta
+        self._ranges.extend(r for r in _annotation_ranges(annotations) if r[0] < r[1])
+        self._commit()
+
+    def text(self) -> str:
+        """Текущий очищенный текст для показа пользователю."""
+        tail = self._clean(self._committed_raw, len(self._raw))
+        # Незакрытая цитата 【… в хвосте ещё не может быть удалена регуляркой — прячем её
+        cut = tail.rfind('【')
+        if cut != -1 and '】' not in tail[cut:]:
+            tail = tail[:cut].rstrip()
+        if self._committed_text and tail:
+            return f"{self._committed_text}\n\n{tail}"
+        return self._committed_text or tail
+
+    def _commit(self) -> None:
+        boundary = self._raw.rfind('\n\n', self._committed_raw)
+        if boundary == -1:
+            return
+        segment = self._raw[self._committed_raw:boundary]
+        # Не фиксируем абзацы внутри незакрытого блока кода или цитаты
+        if segment.count('```') % 2 or segment.count('【') != segment.count('】'):
+            return
+        cleaned = self._clean(self._committed_raw, boundary)
+        if cleaned:
+            self._committed_text = f"{self._committed_text}\n\n{cleaned}" if self._committed_text else cleaned
+        self._committed_raw = boundary + 2
+
+    def _clean(self, start: int, end: int) -> str:
+        ranges = [(s - start, e - start) for s, e in self._ranges if start <= s and e <= end]
+        return clean_reply(strip_annotations(self._raw[start:end], ranges))
@@ -0,0 +1,92 @@
+"""
+Очередь ходов диалога по пользователям
+Не допускает параллельных ранов в одном thread и склеивает сообщения,
+пришедшие, пока ассистент ещё отвечает
+"""
+
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from update_queue import release_chat_order
+
+logger = logging.getLogger(__name__)
+
+TurnHandler = Callable[[str], Awaitable[None]]
+
+
+class _PendingTurn:
+    """Сообщения пользователя, накопленные за время активного рана."""
+
+    def __init__(self):
+        self.texts: List[str] = []
+        self.handler: Optional[TurnHandler] = None
+
+
+class UserTurnQueue:
+    """Сериализует ходы диалога для каждого пользователя.
+
+    Пока у пользователя идёт ран, новые сообщения не отправляются ассистенту,
+    а буферизуются; после завершения рана они уходят одним сообщением
+    в одном дополнительном ране. Все операции выполняются в одном event loop,
+    поэтому блокировки не нужны: между проверкой и изменением состояния нет await.
+    """
+
+    def __init__(self, separator: str = "\n"):
+        self.separator = separator
+        self._active: Dict[int, _PendingTurn] = {}
+        # Счётчики для оценки эффекта склейки
+        self.turns_started = 0
+        self.messages_coalesced = 0
+        self.followup_turns = 0
+
+    def is_active(self, user_id: int) -> bool:
+        return user_id in self._active
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self._active),
+            "turns_started": self.turns_started,
+            "messages_coalesced": self.messages_coalesced,
+            "followup_turns": self.followup_turns,
+        }
+
+    async def submit(self, user_id: int, text: str, handler: TurnHandler) -> bool:
+        """
+        Выполняет ход пользователя или откладывает его до конца активного рана
+
+        Args:
+            user_id: ID пользователя Telegram
+            text: Текст для ассистента
+            handler: Корутина, которая отправляет текст ассистенту и доставляет ответ
+
+        Returns:
+            bool: True если ход выполнен этим вызовом, False если сообщение буферизовано
+        """
+        pending = self._active.get(user_id)
+        if pending is not None:
+            pending.texts.append(text)
+            # Отложенные сообщения доставляются обработчиком последнего из них
+            pending.handler = handler
+            self.messages_coalesced += 1
+            release_chat_order()
+            logger.info(f"TurnQueue: сообщение пользователя {user_id} отложено до конца рана ({len(pending.texts)} в буфере)")
+            return False
+
+        pending = self._active[user_id] = _PendingTurn()
+        self.turns_started += 1
+        # Ход зарегистрирован: следующие сообщения чата можно принимать, они лягут в буфер
+        release_chat_order()
+        try:
+            while True:
+                await handler(text)
+                if not pending.texts:
+                    break
+                text = self.separator.join(pending.texts)
+                handler = pending.handler or handler
+                logger.info(f"TurnQueue: отправляем {len(pending.texts)} отложенных сообщений пользователя {user_id} одним ходом")
+                pending.texts = []
+                pending.handler = None
+                self.followup_turns += 1
+        finally:
+            self._active.pop(user_id, None)
+        return True
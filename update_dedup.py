@@ -0,0 +1,97 @@
+"""
+Защита от повторной обработки апдейтов
+Telegram повторяет доставку вебхука, если не дождался ответа; по update_id
+повтор отбрасывается до вызова обработчиков: Redis SET NX с коротким TTL
+(общий для всех процессов) и кольцевой буфер в памяти процесса
+"""
+
+import logging
+from collections import deque
+from typing import Optional
+
+from config import Config
+from metrics import UPDATE_DUPLICATES
+from redis_pool import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class _RecentIds:
+    """Кольцевой буфер последних update_id с проверкой принадлежности за O(1)."""
+
+    def __init__(self, size: int):
+        self._order: deque = deque()
+        self._ids: set = set()
+        self.size = size
+
+    def add(self, update_id: int) -> bool:
+        """Добавляет id; False, если он уже был в буфере."""
+        if update_id in self._ids:
+            return False
+        self._ids.add(update_id)
+        self._order.append(update_id)
+        if len(self._order) > self.size:
+            self._ids.discard(self._order.popleft())
+        return True
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+
+class UpdateDeduplicator:
+    """Отмечает update_id как обработанный и сообщает о повторах.
+
+    Сначала проверяется локальный буфер (повтор чаще всего приходит в тот же
+    процесс, и Redis не нужен), затем SET NX в Redis. Если Redis не настроен
+    или недоступен, работает только локальный буфер.
+    """
+
+    def __init__(self, redis=None, ttl: Optional[int] = None, local_size: Optional[int] = None):
+        self._redis = redis if redis is not None else get_redis()
+        self.ttl = ttl or Config.UPDATE_DEDUP_TTL
+        self._recent = _RecentIds(local_size or Config.UPDATE_DEDUP_LOCAL_SIZE)
+        # Счётчики для метрик
+        self.checked = 0
+        self.duplicates = 0
+        self.redis_errors = 0
+
+    def _key(self, update_id: int) -> str:
+        return f"{Config.UPDATE_DEDUP_PREFIX}{update_id}"
+
+    async def seen(self, update_id: Optional[int]) -> bool:
+        """
+        Отмечает апдейт и проверяет, не обрабатывался ли он раньше
+
+        Args:
+            update_id: update_id из тела вебхука (None — апдейт не проверяется)
+
+        Returns:
+            bool: True если это повтор и апдейт нужно пропустить
+        """
+        if update_id is None:
+            return False
+        self.checked += 1
+        if not self._recent.add(update_id):
+            return self._duplicate(update_id, 'local')
+        if self._redis:
+            try:
+                if not await self._redis.set(self._key(update_id), 1, nx=True, ex=self.ttl):
+                    return self._duplicate(update_id, 'redis')
+            except Exception as e:
+                self.redis_errors += 1
+                logger.warning(f"Dedup: Redis недоступен, проверка только по локальному буферу: {e}")
+        return False
+
+    def _duplicate(self, update_id: int, source: str) -> bool:
+        self.duplicates += 1
+        UPDATE_DUPLICATES.labels(source).inc()
+        logger.info(f"Dedup: повтор апдейта {update_id} ({source}) пропущен")
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+            "redis_errors": self.redis_errors,
+            "local_size": len(self._recent),
+        }
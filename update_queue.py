@@ -0,0 +1,289 @@
+"""
+Параллельная обработка апдейтов с сохранением порядка внутри чата
+Вебхук может только проверить и поставить апдейт в очередь, а обработчики
+выполняет пул воркеров в том же процессе (UpdateWorkerPool); в режиме polling
+тот же порядок обеспечивает ChatOrderedUpdateProcessor.
+
+Следующий апдейт чата начинает обработку, когда предыдущий закончен или
+зафиксировал своё место в очереди ходов (release_chat_order из UserTurnQueue):
+так длинный ран ассистента не задерживает чат целиком, а сообщения, пришедшие
+во время рана, по-прежнему склеиваются в один ход
+"""
+
+import asyncio
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from logging_setup import note_queue_wait
+from metrics import ERRORS, UPDATE_QUEUE_WAIT
+
+logger = logging.getLogger(__name__)
+
+UpdateProcessor = Callable[[Update], Awaitable[None]]
+
+_chat_release: ContextVar[Optional[asyncio.Event]] = ContextVar('chat_release', default=None)
+
+
+def release_chat_order() -> None:
+    """Отпускает очередь чата: следующий апдейт этого чата можно начинать обрабатывать."""
+    event = _chat_release.get()
+    if event is not None:
+        event.set()
+
+
+async def run_in_chat_order(coroutine: Awaitable[Any]) -> "asyncio.Task":
+    """
+    Запускает обработку апдейта отдельной задачей и ждёт, пока она не отпустит очередь чата
+
+    Returns:
+        asyncio.Task: Задача обработки (может ещё выполняться)
+    """
+    released = asyncio.Event()
+    token = _chat_release.set(released)
+    try:
+        # Задача копирует контекст вместе с событием release
+        task = asyncio.ensure_future(coroutine)
+    finally:
+        _chat_release.reset(token)
+    waiter = asyncio.ensure_future(released.wait())
+    try:
+        await asyncio.wait({task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        waiter.cancel()
+    return task
+
+
+def _chat_key(update: object) -> Hashable:
+    if isinstance(update, Update):
+        chat = update.effective_chat
+        user = update.effective_user
+        return chat.id if chat else user.id if user else update.update_id
+    return id(update)
+
+
+class _ChatLocks:
+    """Блокировки по чатам, которые удаляются, когда их никто не ждёт."""
+
+    def __init__(self):
+        self._locks: Dict[Hashable, list] = {}
+
+    async def acquire(self, key: Hashable) -> None:
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self._unref(key)
+            raise
+
+    def release(self, key: Hashable) -> None:
+        self._locks[key][0].release()
+        self._unref(key)
+
+    def _unref(self, key: Hashable) -> None:
+        entry = self._locks[key]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._locks[key]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Обработка апдейтов polling параллельно, но по порядку внутри каждого чата.
+
+    Одновременно выполняются не больше max_running апдейтов. Семафор PTB
+    (max_concurrent_updates) считает и апдейты, ждущие своей очереди в чате,
+    поэтому он шире: иначе несколько сообщений одного чата заняли бы все слоты.
+    """
+
+    # Сколько апдейтов может ждать своей очереди на один выполняющийся
+    PENDING_PER_SLOT = 4
+
+    def __init__(self, max_running: int):
+        super().__init__(max_concurrent_updates=max(1, max_running) * self.PENDING_PER_SLOT)
+        self.max_running = max(1, max_running)
+        self._running = asyncio.Semaphore(self.max_running)
+        self._chats = _ChatLocks()
+        # Счётчики для метрик
+        self.running = 0
+        self.processed = 0
+        self.last_wait = 0.0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = _chat_key(update)
+        enqueued_at = time.monotonic()
+        await self._chats.acquire(key)
+        chat_locked = True
+        try:
+            async with self._running:
+                self.last_wait = time.monotonic() - enqueued_at
+                UPDATE_QUEUE_WAIT.labels('polling').observe(self.last_wait)
+                note_queue_wait(self.last_wait)
+                self.running += 1
+                try:
+                    task = await run_in_chat_order(coroutine)
+                    self._chats.release(key)
+                    chat_locked = False
+                    await task
+                finally:
+                    self.running -= 1
+                    self.processed += 1
+        finally:
+            if chat_locked:
+                self._chats.release(key)
+
+    def stats(self) -> dict:
+        return {
+            "max_running": self.max_running,
+            "running": self.running,
+            "in_flight": self.current_concurrent_updates,
+            "chats": len(self._chats),
+            "processed": self.processed,
+            "last_wait_seconds": round(self.last_wait, 3),
+        }
+
+
+class UpdateWorkerPool:
+    """Пул воркеров вебхука с отдельной очередью на каждого.
+
+    Шард выбирается по chat_id (или user_id, если чата нет), так что апдейты
+    одного чата начинают обрабатываться по порядку, а разные чаты — параллельно.
+    Воркер берёт следующий апдейт, как только текущий отпустил очередь чата,
+    но одновременно выполняются не больше workers апдейтов на весь пул: слот
+    занят, пока обработка не закончится (как _running в ChatOrderedUpdateProcessor).
+    Если очередь шарда заполнена, submit возвращает False, и вызывающий
+    обрабатывает апдейт сам (естественное обратное давление); порядок сообщений
+    чата в этом случае уже не гарантируется, поэтому очередь стоит держать с запасом.
+    """
+
+    def __init__(self, process: UpdateProcessor, workers: int, queue_size: int = 1000):
+        self.process = process
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self._in_flight: Set[asyncio.Task] = set()
+        self._running = asyncio.Semaphore(self.workers)
+        # Счётчики для метрик
+        self.enqueued = 0
+        self.processed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.last_wait = 0.0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self) -> None:
+        if self.running:
+            return
+        # Размер очереди делится между шардами
+        shard_size = max(1, self.queue_size // self.workers)
+        self._queues = [asyncio.Queue(maxsize=shard_size) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._worker(q)) for q in self._queues]
+        logger.info(f"UpdateWorkerPool: запущено воркеров: {self.workers}, очередь: {self.queue_size}")
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Дожидается обработки уже принятых апдейтов (не дольше timeout) и останавливает воркеры."""
+        if not self.running:
+            return
+
+        async def drain() -> None:
+            await asyncio.gather(*(q.join() for q in self._queues))
+            if self._in_flight:
+                await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+        try:
+            await asyncio.wait_for(drain(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"UpdateWorkerPool: не дождались обработки {self.depth() + len(self._in_flight)} апдейтов")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, update: Update) -> bool:
+        """
+        Ставит апдейт в очередь своего шарда без ожидания
+
+        Returns:
+            bool: True если апдейт принят, False если пул не запущен или очередь шарда заполнена
+        """
+        if not self.running:
+            return False
+        queue = self._queues[_chat_key(update) % self.workers]
+        try:
+            queue.put_nowait((time.monotonic(), update))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self.enqueued += 1
+        return True
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            enqueued_at, update = await queue.get()
+            try:
+                # Пока все слоты заняты, очередь шарда растёт, и submit в итоге вернёт False
+                await self._running.acquire()
+                self.last_wait = time.monotonic() - enqueued_at
+                UPDATE_QUEUE_WAIT.labels('webhook').observe(self.last_wait)
+                note_queue_wait(self.last_wait)
+                try:
+                    task = await run_in_chat_order(self.process(update))
+                except BaseException:
+                    self._running.release()
+                    raise
+                self._in_flight.add(task)
+                task.add_done_callback(self._finished)
+            except Exception as e:
+                self._failed(update, e)
+            finally:
+                queue.task_done()
+
+    def _finished(self, task: "asyncio.Task") -> None:
+        self._in_flight.discard(task)
+        self._running.release()
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            self._failed(None, error)
+        else:
+            self.processed += 1
+
+    def _failed(self, update: Optional[Update], error: BaseException) -> None:
+        self.failed += 1
+        ERRORS.labels('webhook').inc()
+        update_id = update.update_id if update is not None else '?'
+        logger.error(f"UpdateWorkerPool: ошибка обработки апдейта {update_id}: {error}")
+
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "depth": self.depth(),
+            "max_shard_depth": max((q.qsize() for q in self._queues), default=0),
+            "in_flight": len(self._in_flight),
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "last_wait_seconds": round(self.last_wait, 3),
+        }